@@ -1,12 +1,132 @@
+from django.conf import settings
 from django.contrib import admin
-from api.models import Category, Product, Order, OrderItem, Review,  ProductSpecification
-
-# Register your models here.
-admin.site.register(Category)
-admin.site.register(Product)
-admin.site.register(Order)
-admin.site.register(OrderItem)
-admin.site.register(Review)
-# admin.site.register(ProductImage)
-admin.site.register(ProductSpecification)
-# Register your models here.
\ No newline at end of file
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Min
+from django.utils.functional import cached_property
+
+from api.checkout import delete_order
+from api.models import Category, Product, Order, OrderItem, Review, ProductSpecification
+
+
+def estimated_row_count(model, using):
+    """The planner's row estimate on PostgreSQL, the primary key span elsewhere (both cheap)."""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] > 0:
+            return row[0]
+    bounds = model._default_manager.using(using).aggregate(low=Min('pk'), high=Max('pk'))
+    return 0 if bounds['high'] is None else bounds['high'] - bounds['low'] + 1
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts at most ADMIN_EXACT_COUNT_LIMIT rows, so a changelist of millions
+    of rows never runs a full COUNT(*). Past that an unfiltered changelist
+    pages through an estimate of the whole table (on SQLite the primary key
+    span, which overcounts after deletes), and a searched or filtered one
+    reports limit + 1 rows, i.e. "more than the limit".
+    """
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        queryset = self.object_list
+        exact = queryset.order_by()[:limit + 1].count()
+        if exact <= limit or queryset.query.where:
+            return exact
+        return max(estimated_row_count(queryset.model, queryset.db), exact)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables too big to count: no full count, estimated paging."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ('name', 'parent', 'depth')
+    list_select_related = ('parent',)
+    search_fields = ('name',)
+    autocomplete_fields = ('parent',)
+
+
+class ProductSpecificationInline(admin.TabularInline):
+    model = ProductSpecification
+    extra = 0
+
+
+@admin.register(Product)
+class ProductAdmin(LargeTableAdmin):
+    list_display = ('name', 'category', 'price', 'stock', 'reserved_stock', 'is_featured', 'is_bestseller', 'is_new_arrival')
+    list_select_related = ('category',)
+    list_filter = ('is_featured', 'is_bestseller', 'is_new_arrival')  # api_product_<flag>_idx
+    search_fields = ('name', '=sku')
+    autocomplete_fields = ('category',)
+    date_hierarchy = 'created_at'  # api_product_created_id_idx
+    ordering = ('-created_at', '-id')
+    readonly_fields = (
+        'reserved_stock', 'avg_rating', 'review_count',
+        'rating_1_count', 'rating_2_count', 'rating_3_count', 'rating_4_count', 'rating_5_count',
+    )
+    inlines = [ProductSpecificationInline]
+
+
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    extra = 0
+    autocomplete_fields = ('product',)
+
+
+@admin.register(Order)
+class OrderAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'status', 'payment_method', 'shipping_method', 'total', 'created_at')
+    list_filter = ('status', 'payment_method')  # api_order_status_created_idx, api_order_payment_created_idx
+    search_fields = ('=id', 'user__username')
+    autocomplete_fields = ('user',)
+    date_hierarchy = 'created_at'  # api_order_created_idx
+    ordering = ('-created_at', '-id')
+    inlines = [OrderItemInline]
+
+    def get_queryset(self, request):
+        # __str__ shows the username, in the changelist and the order autocomplete alike
+        return super().get_queryset(request).select_related('user')
+
+    def delete_model(self, request, obj):
+        delete_order(obj)
+
+    def delete_queryset(self, request, queryset):
+        for order in queryset:
+            delete_order(order)
+
+
+@admin.register(OrderItem)
+class OrderItemAdmin(LargeTableAdmin):
+    list_display = ('id', 'order_id', 'product', 'quantity', 'price')
+    list_select_related = ('product',)
+    search_fields = ('=order__id',)  # The order_id index, no join
+    autocomplete_fields = ('order', 'product')
+    ordering = ('-id',)
+
+
+@admin.register(Review)
+class ReviewAdmin(LargeTableAdmin):
+    list_display = ('id', 'product', 'user', 'rating', 'created_at')
+    list_select_related = ('product', 'user')
+    list_filter = ('rating',)  # api_review_rating_created_idx
+    search_fields = ('product__name', 'user__username')
+    autocomplete_fields = ('product', 'user')
+    date_hierarchy = 'created_at'  # api_review_created_idx
+    ordering = ('-created_at', '-id')
+
+
+@admin.register(ProductSpecification)
+class ProductSpecificationAdmin(admin.ModelAdmin):
+    list_display = ('product', 'name', 'value')
+    list_select_related = ('product',)
+    search_fields = ('product__name', 'name')
+    autocomplete_fields = ('product',)
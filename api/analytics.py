@@ -0,0 +1,228 @@
+"""
+Daily sales rollups and the queries the analytics endpoints run on them.
+
+Three tables are kept up to date as orders come in and change status, so
+reports over months of sales read a few hundred rows instead of scanning
+Order and OrderItem:
+
+* DailyProductSales / DailyCategorySales: units, revenue (price at the time
+  of purchase * quantity) and the number of orders per day, cancelled
+  orders left out,
+* DailyOrderSales: orders and their totals (shipping included) per day,
+  status and payment method, cancelled ones included.
+
+The day is the order's creation date in the current time zone. api.checkout
+records new orders and takes out deleted ones (delete_order), the Order
+save signal and the reservation sweep record status changes. Orders created or edited any other way (the admin, scripts,
+.update() calls) are only counted by the rebuild_sales_rollups command,
+which recomputes the tables from the orders.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+CANCELLED = 'cancelled'
+INTERVALS = {'day': None, 'week': TruncWeek, 'month': TruncMonth}
+DEFAULT_DAYS = 30
+
+
+def _add(queryset, key, deltas):
+    """Adds `deltas` to the row of `queryset`'s model matching `key`, creating it if needed."""
+    if not any(deltas.values()):
+        return
+    row = queryset.filter(**key)
+    changes = {name: F(name) + delta for name, delta in deltas.items()}
+    if row.update(**changes):
+        return
+    try:
+        with transaction.atomic(using=queryset.db):
+            queryset.create(**key, **deltas)
+    except IntegrityError:
+        # Created concurrently, fall back to the increment
+        row.update(**changes)
+
+
+def _item_deltas(order_ids, sign, using):
+    """({(day, product id): deltas}, {(day, category id): deltas}) of the items of these orders."""
+    from .models import OrderItem
+
+    products = defaultdict(lambda: {'units': 0, 'revenue': Decimal('0'), 'orders': 0})
+    categories = defaultdict(lambda: {'units': 0, 'revenue': Decimal('0'), 'orders': 0})
+    orders = defaultdict(set)  # Orders counted once per product and per category
+    items = OrderItem.objects.using(using).filter(order_id__in=order_ids).values_list(
+        'order_id', 'order__created_at', 'product_id', 'product__category_id', 'quantity', 'price',
+    )
+    for order_id, created_at, product_id, category_id, quantity, price in items:
+        day = timezone.localdate(created_at)
+        for deltas in (products[day, product_id], categories[day, category_id]):
+            deltas['units'] += sign * quantity
+            deltas['revenue'] += sign * quantity * price
+        orders['product', day, product_id].add(order_id)
+        orders['category', day, category_id].add(order_id)
+    for (group, day, pk), order_ids in orders.items():
+        (products if group == 'product' else categories)[day, pk]['orders'] = sign * len(order_ids)
+    return products, categories
+
+
+def _add_items(order_ids, sign, using):
+    from .models import DailyCategorySales, DailyProductSales
+
+    products, categories = _item_deltas(order_ids, sign, using)
+    for (day, product_id), deltas in sorted(products.items()):
+        _add(DailyProductSales.objects.using(using), {'day': day, 'product_id': product_id}, deltas)
+    for (day, category_id), deltas in sorted(categories.items()):
+        _add(DailyCategorySales.objects.using(using), {'day': day, 'category_id': category_id}, deltas)
+
+
+def record_order(order, using='default'):
+    """Counts a new order and its items, call it once the items are saved."""
+    from .models import DailyOrderSales
+
+    with transaction.atomic(using=using):
+        key = {'day': timezone.localdate(order.created_at), 'status': order.status, 'payment_method': order.payment_method}
+        _add(DailyOrderSales.objects.using(using), key, {'orders': 1, 'revenue': order.total})
+        if order.status != CANCELLED:
+            _add_items([order.pk], 1, using)
+
+
+def record_status_change(order_ids, old_status, new_status, using='default'):
+    """Moves the given orders from `old_status` to `new_status` in the rollups."""
+    from .models import DailyOrderSales, Order
+
+    if old_status == new_status or not order_ids:
+        return
+    with transaction.atomic(using=using):
+        totals = defaultdict(lambda: [0, Decimal('0')])
+        orders = Order.objects.using(using).filter(pk__in=order_ids).values_list('created_at', 'payment_method', 'total')
+        for created_at, payment_method, total in orders:
+            day_totals = totals[timezone.localdate(created_at), payment_method]
+            day_totals[0] += 1
+            day_totals[1] += total
+        rollups = DailyOrderSales.objects.using(using)
+        for (day, payment_method), (count, revenue) in sorted(totals.items()):
+            _add(rollups, {'day': day, 'status': old_status, 'payment_method': payment_method},
+                 {'orders': -count, 'revenue': -revenue})
+            _add(rollups, {'day': day, 'status': new_status, 'payment_method': payment_method},
+                 {'orders': count, 'revenue': revenue})
+        if CANCELLED in (old_status, new_status):
+            _add_items(order_ids, -1 if new_status == CANCELLED else 1, using)
+
+
+def record_deletion(order_ids, using='default'):
+    """Takes the given orders and their items out of the rollups, call it before deleting them."""
+    from .models import DailyOrderSales, Order
+
+    if not order_ids:
+        return
+    with transaction.atomic(using=using):
+        totals = defaultdict(lambda: [0, Decimal('0')])
+        counted = []  # Cancelled orders' items are already left out
+        orders = Order.objects.using(using).filter(pk__in=order_ids).values_list(
+            'pk', 'created_at', 'status', 'payment_method', 'total',
+        )
+        for pk, created_at, status, payment_method, total in orders:
+            day_totals = totals[timezone.localdate(created_at), status, payment_method]
+            day_totals[0] += 1
+            day_totals[1] += total
+            if status != CANCELLED:
+                counted.append(pk)
+        rollups = DailyOrderSales.objects.using(using)
+        for (day, status, payment_method), (count, revenue) in sorted(totals.items()):
+            _add(rollups, {'day': day, 'status': status, 'payment_method': payment_method},
+                 {'orders': -count, 'revenue': -revenue})
+        _add_items(counted, -1, using)
+
+
+def rebuild(since=None, using='default'):
+    """
+    Recomputes the rollups of the days from `since` on (all of them when None)
+    from Order and OrderItem. Returns the number of rows written.
+    """
+    from .models import DailyCategorySales, DailyOrderSales, DailyProductSales, Order, OrderItem
+
+    revenue = ExpressionWrapper(F('price') * F('quantity'), output_field=DecimalField(max_digits=14, decimal_places=2))
+    orders = Order.objects.using(using).annotate(day=TruncDate('created_at'))
+    items = OrderItem.objects.using(using).exclude(order__status=CANCELLED).annotate(day=TruncDate('order__created_at'))
+    rollups = (DailyProductSales, DailyCategorySales, DailyOrderSales)
+    if since is not None:
+        orders, items = orders.filter(day__gte=since), items.filter(day__gte=since)
+
+    def item_totals(group):
+        return items.values('day', group).annotate(
+            units=Sum('quantity'), revenue=Sum(revenue), orders=Count('order_id', distinct=True),
+        ).order_by()
+
+    with transaction.atomic(using=using):
+        for model in rollups:
+            stale = model.objects.using(using)
+            (stale if since is None else stale.filter(day__gte=since)).delete()
+        rows = [
+            DailyProductSales(product_id=row.pop('product_id'), **row) for row in item_totals('product_id')
+        ] + [
+            DailyCategorySales(category_id=row.pop('product__category_id'), **row)
+            for row in item_totals('product__category_id')
+        ]
+        order_rows = orders.values('day', 'status', 'payment_method').annotate(
+            orders=Count('pk'), revenue=Sum('total'),
+        ).order_by()
+        rows += [DailyOrderSales(**row) for row in order_rows]
+        for model in rollups:
+            model.objects.using(using).bulk_create([row for row in rows if type(row) is model], batch_size=1000)
+    return len(rows)
+
+
+def parse_range(params):
+    """(start, end, interval) from ?start=YYYY-MM-DD&end=...&interval=day|week|month, ValueError when invalid."""
+    end = date.fromisoformat(params['end']) if params.get('end') else timezone.localdate()
+    start = date.fromisoformat(params['start']) if params.get('start') else end - timedelta(days=DEFAULT_DAYS - 1)
+    interval = params.get('interval') or 'day'
+    if start > end:
+        raise ValueError("start must not be after end")
+    if interval not in INTERVALS:
+        raise ValueError(f"interval must be one of {', '.join(INTERVALS)}")
+    return start, end, interval
+
+
+def _periods(queryset, start, end, interval):
+    queryset = queryset.filter(day__gte=start, day__lte=end)
+    trunc = INTERVALS[interval]
+    return queryset.annotate(period=trunc('day') if trunc else F('day'))
+
+
+def order_summary(start, end, interval):
+    """Orders and revenue per period, status and payment method."""
+    from .models import DailyOrderSales
+
+    rows = _periods(DailyOrderSales.objects.all(), start, end, interval).values(
+        'period', 'status', 'payment_method',
+    ).annotate(orders=Sum('orders'), revenue=Sum('revenue')).filter(orders__gt=0).order_by('period', 'status', 'payment_method')
+    return list(rows)
+
+
+def top_products(start, end, limit, category_id=None):
+    """The best selling products over the range, by revenue."""
+    from .models import DailyProductSales
+
+    rows = DailyProductSales.objects.filter(day__gte=start, day__lte=end)
+    if category_id is not None:
+        rows = rows.filter(product__category_id=category_id)
+    return list(
+        rows.values('product_id', name=F('product__name'), slug=F('product__slug'))
+        .annotate(units=Sum('units'), revenue=Sum('revenue'), orders=Sum('orders'))
+        .filter(units__gt=0).order_by('-revenue', 'product_id')[:limit]
+    )
+
+
+def category_sales(start, end, interval):
+    """Units, revenue and orders per period and category."""
+    from .models import DailyCategorySales
+
+    rows = _periods(DailyCategorySales.objects.all(), start, end, interval).values(
+        'period', 'category_id', name=F('category__name'),
+    ).annotate(units=Sum('units'), revenue=Sum('revenue'), orders=Sum('orders')).filter(units__gt=0)
+    return list(rows.order_by('period', '-revenue', 'category_id'))
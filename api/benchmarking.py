@@ -0,0 +1,71 @@
+"""
+Helpers shared by the bench_* management commands.
+
+Benchmarks never touch the configured database: they run against a throwaway
+test database created the same way the test runner does it.
+"""
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+@contextmanager
+def benchmark_database(name=None):
+    """
+    Creates (and afterwards destroys) an empty, migrated test database.
+    Pass a file `name` for SQLite when the benchmark needs several connections,
+    the default in-memory test database is private to one connection.
+    """
+    old_name = connection.settings_dict['NAME']
+    if name:
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = name
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def time_calls(func, repeat, warmup=2):
+    """Runs func `repeat` times and returns the wall-clock samples in ms."""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        'p50': round(pct(50), 3),
+        'p95': round(pct(95), 3),
+        'p99': round(pct(99), 3),
+        'mean': round(statistics.fmean(ordered), 3),
+        'max': round(ordered[-1], 3),
+    }
+
+
+def bulk_insert(model, objects, batch_size=5000):
+    """bulk_create in fixed-size batches, returns the number of rows written."""
+    total = 0
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            model.objects.bulk_create(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+        total += len(batch)
+    return total
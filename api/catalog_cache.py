@@ -0,0 +1,152 @@
+"""
+Cached product cards and collection membership lists.
+
+A product card is the ProductSerializer payload for one product, cached per
+product and invalidated by bumping that product's version (or the global
+generation for changes that touch many cards, like a category rename).
+Collections (featured, new arrivals, bestsellers) are cached as ordered id
+lists that are only rebuilt when a member joins or leaves. Serving a
+homepage rail is then two or three cache round trips and no SQL. The nested
+category tree with its product counts is cached the same way and rebuilt
+when a category or product changes; stock moved by checkouts shows in its
+counts within CATALOG_CACHE_TIMEOUT.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import response_cache
+
+# Collection name -> Product flag
+COLLECTIONS = {
+    'featured': 'is_featured',
+    'new_arrivals': 'is_new_arrival',
+    'bestsellers': 'is_bestseller',
+}
+COLLECTION_ORDERING = ('-created_at', '-id')
+
+GENERATION_KEY = 'catalog:generation'
+CATEGORY_TREE_VERSION_KEY = 'catalog:category-tree-version'
+
+
+def _timeout():
+    return settings.CATALOG_CACHE_TIMEOUT
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:  # Missing or evicted, any fresh value invalidates
+        cache.set(key, 1, None)
+
+
+def _versions(keys):
+    versions = cache.get_many(keys)
+    missing = {key: 1 for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return versions
+
+
+def _collection_version_key(name):
+    return f'catalog:collection-version:{name}'
+
+
+def _card_version_key(product_id):
+    return f'catalog:card-version:{product_id}'
+
+
+def _origin(request):
+    # Image URLs are absolute, so payloads with images are cached per host
+    if request is None:
+        return '-'
+    return hashlib.md5(request.build_absolute_uri('/').encode()).hexdigest()[:8]
+
+
+def collection_ids(name):
+    """Ordered ids of the products in a collection, newest first."""
+    from .models import Product
+
+    version = _versions([_collection_version_key(name)])[_collection_version_key(name)]
+    key = f'catalog:collection:{name}:{version}'
+    ids = cache.get(key)
+    if ids is None:
+        ids = list(
+            Product.objects.filter(**{COLLECTIONS[name]: True})
+            .order_by(*COLLECTION_ORDERING).values_list('pk', flat=True)
+        )
+        cache.set(key, ids, _timeout())
+    return ids
+
+
+def invalidate_collections(names=None):
+    for name in names or COLLECTIONS:
+        _bump(_collection_version_key(name))
+
+
+def invalidate_cards(product_ids=None):
+    """Drops the cached cards of the given products, or of every product."""
+    # Cached responses embed the same data, whoever changed it
+    response_cache.invalidate(response_cache.PRODUCT)
+    if product_ids is None:
+        _bump(GENERATION_KEY)
+        return
+    for product_id in product_ids:
+        _bump(_card_version_key(product_id))
+
+
+def product_cards(product_ids, request):
+    """
+    ProductSerializer payloads for the given ids, in the same order. Missing
+    cards are built with one prefetching query and cached; ids that no longer
+    exist are skipped.
+    """
+    from .models import Product
+    from .serializers import ProductSerializer
+
+    product_ids = list(product_ids)
+    if not product_ids:
+        return []
+
+    origin = _origin(request)
+    version_keys = [GENERATION_KEY] + [_card_version_key(pk) for pk in product_ids]
+    versions = _versions(version_keys)
+    generation = versions[GENERATION_KEY]
+    card_keys = {
+        pk: f'catalog:card:{origin}:{generation}:{pk}:{versions[_card_version_key(pk)]}'
+        for pk in product_ids
+    }
+
+    cached = cache.get_many(list(card_keys.values()))
+    cards = {pk: cached[key] for pk, key in card_keys.items() if key in cached}
+
+    missing = [pk for pk in product_ids if pk not in cards]
+    if missing:
+        products = Product.objects.filter(pk__in=missing).for_listing()
+        fresh = {
+            card['id']: card
+            for card in ProductSerializer(products, many=True, context={'request': request}).data
+        }
+        cache.set_many({card_keys[pk]: card for pk, card in fresh.items()}, _timeout())
+        cards.update(fresh)
+
+    return [cards[pk] for pk in product_ids if pk in cards]
+
+
+def invalidate_category_tree():
+    _bump(CATEGORY_TREE_VERSION_KEY)
+
+
+def category_tree(request=None):
+    """The nested category tree with product counts, see api.category_tree.build_tree."""
+    from .category_tree import build_tree
+
+    version = _versions([CATEGORY_TREE_VERSION_KEY])[CATEGORY_TREE_VERSION_KEY]
+    key = f'catalog:category-tree:{_origin(request)}:{version}'
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_tree(request)
+        cache.set(key, tree, _timeout())
+    return tree
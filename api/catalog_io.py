@@ -0,0 +1,370 @@
+"""
+Bulk catalog import and export (CSV or JSON Lines).
+
+Imports stream the file row by row and upsert products in chunks, one
+transaction per chunk: products are matched on sku (or slug when a row has
+no sku), new ones get their slugs allocated for the whole chunk at once and
+everything is written with bulk_create/bulk_update. Since bulk writes skip
+the model signals, each chunk then syncs the attribute facets, the search
+index, the inventory ledger and the catalog cache itself.
+
+Columns: sku, slug, name, category (name), price, original_price, stock,
+is_new_arrival, is_bestseller, is_featured, description, custom_attributes
+(JSON object), specifications (JSON object or list of {name, value}). CSV
+files may also carry attr.<key> columns, merged into custom_attributes.
+Columns that are missing from a row are left untouched on update.
+"""
+import csv
+import io
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import catalog_cache, facets, inventory, search
+
+FORMATS = ('csv', 'jsonl')
+COLUMNS = [
+    'sku', 'slug', 'name', 'category', 'price', 'original_price', 'stock',
+    'is_new_arrival', 'is_bestseller', 'is_featured', 'description',
+    'custom_attributes', 'specifications',
+]
+FLAG_FIELDS = ['is_new_arrival', 'is_bestseller', 'is_featured']
+REQUIRED_FOR_CREATE = [('name', 'name'), ('price', 'price'), ('category_id', 'category')]
+UPDATABLE_FIELDS = [
+    'name', 'category_id', 'price', 'original_price', 'stock', *FLAG_FIELDS,
+    'description', 'custom_attributes',
+]
+ATTRIBUTE_PREFIX = 'attr.'
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def detect_format(filename, default='csv'):
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if extension == 'csv':
+        return 'csv'
+    return default
+
+
+def read_rows(stream, file_format):
+    """Yields (line number, row dict) from a text stream."""
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError as exc:
+                    yield line_number, ImportRowError(f"Invalid JSON: {exc.msg}")
+    else:
+        raise ValueError(f"Unsupported format '{file_format}', expected one of {', '.join(FORMATS)}")
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _decimal(value, column):
+    """`value` rounded to the places of the Product field `column`, which it must fit."""
+    from .models import Product
+
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ImportRowError(f"{column}: '{value}' is not a number")
+    if not number.is_finite():
+        raise ImportRowError(f"{column}: '{value}' is not a number")
+    field = Product._meta.get_field(column)
+    limit = Decimal(10) ** (field.max_digits - field.decimal_places)
+    if abs(number) < limit:
+        number = number.quantize(Decimal(10) ** -field.decimal_places)
+    if abs(number) >= limit:
+        raise ImportRowError(f"{column}: '{value}' has more than {field.max_digits - field.decimal_places} digits before the point")
+    return number
+
+
+def _flag(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def _json(value, column):
+    if not isinstance(value, str):
+        return value
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        raise ImportRowError(f"{column}: invalid JSON")
+
+
+def _specifications(value):
+    value = _json(value, 'specifications')
+    if isinstance(value, dict):
+        value = [{'name': name, 'value': spec} for name, spec in value.items()]
+    if not isinstance(value, list) or not all(isinstance(spec, dict) and spec.get('name') for spec in value):
+        raise ImportRowError("specifications: expected an object or a list of {name, value}")
+    return [(str(spec['name'])[:100], str(spec.get('value', ''))[:255]) for spec in value]
+
+
+def parse_row(row):
+    """
+    Validates one input row and returns {field: value} for the columns it
+    provides, plus 'category' (a name) and 'specifications' (a list of pairs).
+    """
+    if not isinstance(row, dict):
+        raise ImportRowError("Expected an object per line")
+    parsed = {}
+    for column in ('sku', 'slug', 'name', 'description'):
+        if column in row and row[column] is not None:
+            parsed[column] = str(row[column]).strip()
+    if not parsed.get('sku') and not parsed.get('slug') and not parsed.get('name'):
+        raise ImportRowError("A row needs a sku, a slug or a name")
+
+    if not _blank(row.get('category')):
+        parsed['category'] = str(row['category']).strip()
+    if not _blank(row.get('price')):
+        parsed['price'] = _decimal(row['price'], 'price')
+    if 'original_price' in row:
+        parsed['original_price'] = None if _blank(row['original_price']) else _decimal(row['original_price'], 'original_price')
+    if not _blank(row.get('stock')):
+        try:
+            parsed['stock'] = int(str(row['stock']).strip())
+        except ValueError:
+            raise ImportRowError(f"stock: '{row['stock']}' is not an integer")
+        if parsed['stock'] < 0:
+            raise ImportRowError(f"stock: '{row['stock']}' is negative")
+    for flag in FLAG_FIELDS:
+        if not _blank(row.get(flag)):
+            parsed[flag] = _flag(row[flag])
+
+    attributes = None
+    if not _blank(row.get('custom_attributes')):
+        attributes = _json(row['custom_attributes'], 'custom_attributes')
+        if not isinstance(attributes, dict):
+            raise ImportRowError("custom_attributes: expected an object")
+    flat = {
+        column[len(ATTRIBUTE_PREFIX):]: value for column, value in row.items()
+        if column and column.startswith(ATTRIBUTE_PREFIX) and not _blank(value)
+    }
+    if flat:
+        attributes = {**(attributes or {}), **flat}
+    if attributes is not None:
+        parsed['custom_attributes'] = attributes
+
+    if 'specifications' in row and row['specifications'] is not None:
+        parsed['specifications'] = [] if _blank(row['specifications']) else _specifications(row['specifications'])
+    return parsed
+
+
+class CatalogImporter:
+    """Upserts parsed rows chunk by chunk. See the module docstring."""
+
+    def __init__(self, chunk_size=CHUNK_SIZE, progress=None):
+        from .models import Category
+
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.categories = {}
+        for pk, name in Category.objects.order_by('-pk').values_list('pk', 'name'):
+            self.categories[name.casefold()] = pk  # Oldest wins on duplicate names
+        self.result = {'rows': 0, 'created': 0, 'updated': 0, 'failed': 0, 'errors': [], 'seconds': 0.0}
+
+    def error(self, line_number, message):
+        self.result['failed'] += 1
+        if len(self.result['errors']) < MAX_REPORTED_ERRORS:
+            self.result['errors'].append({'line': line_number, 'error': message})
+
+    def run(self, rows):
+        started = time.perf_counter()
+        chunk = []
+        for line_number, row in rows:
+            self.result['rows'] += 1
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                chunk.append((line_number, parse_row(row)))
+            except ImportRowError as exc:
+                self.error(line_number, str(exc))
+            if len(chunk) >= self.chunk_size:
+                self.write_chunk(chunk)
+                chunk = []
+                self.report(started)
+        if chunk:
+            self.write_chunk(chunk)
+        self.result['errors'].sort(key=lambda error: error['line'])
+        self.report(started)
+        return self.result
+
+    def report(self, started):
+        self.result['seconds'] = round(time.perf_counter() - started, 3)
+        if self.progress:
+            self.progress(self.result)
+
+    def category_id(self, name):
+        from .models import Category
+
+        key = name.casefold()
+        if key not in self.categories:
+            self.categories[key] = Category.objects.create(name=name).pk
+        return self.categories[key]
+
+    def write_chunk(self, chunk):
+        from .models import Product, ProductSpecification
+
+        # The last row wins when a key repeats within the chunk
+        keyed = {}
+        for line_number, row in chunk:
+            key = ('sku', row['sku']) if row.get('sku') else ('slug', row.get('slug')) if row.get('slug') else None
+            keyed[key or ('line', line_number)] = (line_number, row)
+
+        # Outside the chunk's transaction: the pks are cached for the later
+        # chunks, which must not get categories a failed chunk rolled back
+        for _, row in keyed.values():
+            if 'category' in row:
+                row['category_id'] = self.category_id(row.pop('category'))
+
+        with transaction.atomic():
+            existing = {}
+            skus = [value for kind, value in keyed if kind == 'sku']
+            slugs = [value for kind, value in keyed if kind == 'slug']
+            if skus:
+                for product in Product.objects.filter(sku__in=skus).order_by('-pk'):
+                    existing[('sku', product.sku)] = product
+            if slugs:
+                for product in Product.objects.filter(slug__in=slugs):
+                    existing[('slug', product.slug)] = product
+
+            to_create, to_update, specifications = [], [], {}
+            # Updated products grouped by the columns their rows have, stock aside
+            updated_fields, stocked = {}, []
+            now = timezone.now()
+            for key, (line_number, row) in keyed.items():
+                product = existing.get(key)
+                try:
+                    if product is None:
+                        missing = [column for field, column in REQUIRED_FOR_CREATE if field not in row]
+                        if missing:
+                            raise ImportRowError(f"New products need {', '.join(missing)}")
+                        product = Product(**{field: row[field] for field in UPDATABLE_FIELDS + ['sku', 'slug'] if field in row})
+                        to_create.append(product)
+                    else:
+                        fields = tuple(field for field in UPDATABLE_FIELDS if field in row)
+                        for field in fields:
+                            setattr(product, field, row[field])
+                        product.updated_at = now  # bulk_update skips auto_now
+                        to_update.append(product)
+                        updated_fields.setdefault(tuple(field for field in fields if field != 'stock'), []).append(product)
+                        if 'stock' in row:
+                            stocked.append(product)
+                except ImportRowError as exc:
+                    self.error(line_number, str(exc))
+                    continue
+                if 'specifications' in row:
+                    specifications[id(product)] = (product, row['specifications'])
+
+            # Requested slugs that are already taken are reallocated like generated ones
+            requested = {product.slug for product in to_create if product.slug}
+            taken = set(Product.objects.filter(slug__in=requested).values_list('slug', flat=True)) if requested else set()
+            needs_slug = []
+            for product in to_create:
+                if not product.slug or product.slug in taken:
+                    needs_slug.append(product)
+                taken.add(product.slug)
+            if needs_slug:
+                slugs = Product.objects.allocate_slugs([product.slug or product.name for product in needs_slug])
+                for product, slug in zip(needs_slug, slugs):
+                    product.slug = slug
+
+            Product.objects.bulk_create(to_create, batch_size=500)
+            # Only the columns the rows have: the others keep what concurrent
+            # writes (checkouts taking stock, admin edits) put there meanwhile
+            for fields, products in updated_fields.items():
+                Product.objects.bulk_update(products, [*fields, 'updated_at'], batch_size=500)
+            inventory.set_stock(stocked)
+
+            if specifications:
+                ProductSpecification.objects.filter(
+                    product_id__in=[product.pk for product, _ in specifications.values()]
+                ).delete()
+                ProductSpecification.objects.bulk_create([
+                    ProductSpecification(product_id=product.pk, name=name, value=value)
+                    for product, pairs in specifications.values() for name, value in pairs
+                ], batch_size=1000)
+
+            inventory.record_stock_edits(to_create, created=True)
+
+            products = to_create + to_update
+            product_ids = [product.pk for product in products]
+            facets.sync_product_attributes(products)
+            search.index('product', product_ids)
+            catalog_cache.invalidate_cards(product_ids)
+
+        catalog_cache.invalidate_collections()
+        # bulk writes skip the signals that keep the tree's product counts
+        catalog_cache.invalidate_category_tree()
+        self.result['created'] += len(to_create)
+        self.result['updated'] += len(to_update)
+
+
+def import_catalog(stream, file_format, chunk_size=CHUNK_SIZE, progress=None):
+    """Imports a text stream, returns the summary counts and the first errors."""
+    return CatalogImporter(chunk_size, progress).run(read_rows(stream, file_format))
+
+
+class _Echo:
+    """File-like object whose write() returns the line, for csv.writer."""
+    def write(self, value):
+        return value
+
+
+def export_catalog(file_format, queryset=None, chunk_size=CHUNK_SIZE):
+    """Yields the catalog as CSV or JSON Lines text, one row at a time."""
+    from .models import Product
+
+    if file_format not in FORMATS:
+        raise ValueError(f"Unsupported format '{file_format}', expected one of {', '.join(FORMATS)}")
+    queryset = (queryset if queryset is not None else Product.objects.all()).for_listing().order_by('pk')
+
+    writer = csv.writer(_Echo())
+    if file_format == 'csv':
+        yield writer.writerow(COLUMNS)
+    for product in queryset.iterator(chunk_size=chunk_size):
+        row = {
+            'sku': product.sku,
+            'slug': product.slug,
+            'name': product.name,
+            'category': product.category.name,
+            'price': str(product.price),
+            'original_price': str(product.original_price) if product.original_price is not None else None,
+            'stock': product.stock,
+            **{flag: getattr(product, flag) for flag in FLAG_FIELDS},
+            'description': product.description,
+            'custom_attributes': product.custom_attributes,
+            'specifications': [{'name': spec.name, 'value': spec.value} for spec in product.specifications.all()],
+        }
+        if file_format == 'jsonl':
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+        else:
+            yield writer.writerow([
+                json.dumps(row[column], ensure_ascii=False) if column in ('custom_attributes', 'specifications')
+                else '' if row[column] is None else row[column]
+                for column in COLUMNS
+            ])
+
+
+def text_stream(uploaded_file):
+    """Wraps an uploaded (binary) file for read_rows."""
+    return io.TextIOWrapper(uploaded_file, encoding='utf-8-sig', newline='')
@@ -0,0 +1,147 @@
+"""
+The category tree as materialized paths.
+
+Every category stores the ids from its root down to itself, e.g. "/1/5/9/",
+and its depth. A subtree is then one scan of the path index, see
+subtree_filter(). Category.save() keeps the paths right; moving a category
+rewrites the paths of its whole subtree with a single UPDATE.
+
+build_tree() renders the full nested tree with in-stock product counts from
+one query. catalog_cache.category_tree() caches it.
+"""
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Count, F, Q, Value
+from django.db.models.functions import Concat, Substr
+
+SEPARATOR = '/'
+
+
+def subtree_filter(path, field='path', using='default'):
+    """
+    Lookups matching `path` and all of its descendants.
+
+    SQLite's LIKE can't use the index of a case-sensitive column, so there
+    it is the range path >= '/1/5/' AND path < '/1/50' ('0' sorts right
+    after '/' byte-wise). Other databases compare in the column's collation,
+    which needn't be byte-wise (en_US ignores the slashes), so they get
+    startswith: PostgreSQL serves LIKE 'prefix%' from the varchar_pattern_ops
+    index Django adds next to the regular one.
+    """
+    if connections[using].vendor == 'sqlite':
+        return {f'{field}__gte': path, f'{field}__lt': path[:-1] + '0'}
+    return {f'{field}__startswith': path}
+
+
+def validate_parent(category, using=None):
+    """Raises ValidationError when the category's parent is itself or one of its descendants."""
+    from .models import Category
+
+    if category.parent_id is None or category.pk is None:
+        return
+    if category.parent_id == category.pk:
+        raise ValidationError({'parent': "A category can't be its own parent."})
+    parent_path = Category.objects.using(using).filter(pk=category.parent_id).values_list('path', flat=True).first()
+    if parent_path and f'{SEPARATOR}{category.pk}{SEPARATOR}' in parent_path:
+        raise ValidationError({'parent': "A category can't be moved under its own subtree."})
+
+
+def _parent_position(category, using=None):
+    """(path, depth) the category should have under its current parent."""
+    from .models import Category
+
+    if category.parent_id is None:
+        return f'{SEPARATOR}{category.pk}{SEPARATOR}', 0
+    parent = Category.objects.using(using).filter(pk=category.parent_id).values_list('path', 'depth').first()
+    if parent is None:  # Parent saved without a path yet, e.g. a fixture
+        return f'{SEPARATOR}{category.pk}{SEPARATOR}', 0
+    parent_path, parent_depth = parent
+    return f'{parent_path}{category.pk}{SEPARATOR}', parent_depth + 1
+
+
+def move_subtree(category, using=None):
+    """
+    Called after the category is saved: stores its path and depth and, when
+    it moved, rewrites the paths and depths of its descendants.
+    """
+    from .models import Category
+
+    categories = Category.objects.using(using)
+    old_path, old_depth = categories.filter(pk=category.pk).values_list('path', 'depth').get()
+    path, depth = _parent_position(category, using)
+    category.path, category.depth = path, depth
+    if (path, depth) == (old_path, old_depth):
+        return
+
+    categories.filter(pk=category.pk).update(path=path, depth=depth)
+    if old_path:
+        categories.filter(**subtree_filter(old_path, using=categories.db)).exclude(pk=category.pk).update(
+            path=Concat(Value(path), Substr('path', len(old_path) + 1)),
+            depth=F('depth') + (depth - old_depth),
+        )
+
+
+def rebuild_paths(category_model=None):
+    """Recomputes every path from the parent links. Used by the api migrations."""
+    if category_model is None:
+        from .models import Category as category_model
+
+    parents = dict(category_model.objects.values_list('pk', 'parent_id'))
+    positions = {}
+
+    def position(pk, seen=()):
+        if pk not in positions:
+            parent_id = parents.get(pk)
+            if parent_id is None or parent_id not in parents or parent_id in seen:
+                positions[pk] = (f'{SEPARATOR}{pk}{SEPARATOR}', 0)
+            else:
+                parent_path, parent_depth = position(parent_id, seen + (pk,))
+                positions[pk] = (f'{parent_path}{pk}{SEPARATOR}', parent_depth + 1)
+        return positions[pk]
+
+    for pk in parents:
+        path, depth = position(pk)
+        category_model.objects.filter(pk=pk).update(path=path, depth=depth)
+
+
+def build_tree(request=None):
+    """
+    Nested [{...CategorySerializer fields, 'depth', 'direct_product_count',
+    'product_count', 'children': [...]}] sorted by name, where the counts are
+    in-stock products directly in the category and in its whole subtree.
+    """
+    from .models import Category
+    from .serializers import CategorySerializer
+
+    categories = list(
+        Category.objects.annotate(direct_product_count=Count('products', filter=Q(products__stock__gt=0)))
+        .order_by('path')
+    )
+    rendered = CategorySerializer(categories, many=True, context={'request': request}).data
+    nodes = {}
+    for category, data in zip(categories, rendered):
+        nodes[category.pk] = {
+            **data,
+            'depth': category.depth,
+            'direct_product_count': category.direct_product_count,
+            'product_count': category.direct_product_count,
+            'children': [],
+        }
+
+    roots = []
+    for category in categories:
+        parent = nodes.get(category.parent_id)
+        (parent['children'] if parent else roots).append(nodes[category.pk])
+    # Deepest first, so each subtree total is complete before it's added to its parent
+    for category in sorted(categories, key=lambda category: category.depth, reverse=True):
+        parent = nodes.get(category.parent_id)
+        if parent:
+            parent['product_count'] += nodes[category.pk]['product_count']
+
+    def sort(children):
+        children.sort(key=lambda node: node['name'].casefold())
+        for node in children:
+            sort(node['children'])
+
+    sort(roots)
+    return roots
@@ -0,0 +1,94 @@
+"""
+Server-side checkout: turns a cart into an Order in one transaction.
+
+Stock is taken by api.inventory.take_stock(), one conditional UPDATE per
+product in primary key order, so concurrent buyers can never take more than
+what is left and overlapping carts can't deadlock. Prices, the shipping cost
+and the total are all computed here, nothing is taken from the client. If
+any line is short the whole transaction rolls back.
+
+With `hold`, the order is placed as pending and its stock is only reserved
+(e.g. while the M-Pesa payment completes). Moving the order out of pending
+commits the reservations, cancelling it or letting them expire releases them.
+Orders are deleted through delete_order(), which releases them too; a plain
+delete() would cascade the reservations away with their units still held.
+"""
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+
+from . import analytics, catalog_cache, inventory
+
+
+class CheckoutError(Exception):
+    """The cart can't be fulfilled. `unavailable` lists the short lines."""
+
+    def __init__(self, message, unavailable=()):
+        super().__init__(message)
+        self.unavailable = list(unavailable)
+
+
+def shipping_cost(shipping_method):
+    return Decimal(str(settings.SHIPPING_COSTS[shipping_method]))
+
+
+def merge_cart(items):
+    """{product id: total quantity} from a list of {'product', 'quantity'} lines."""
+    quantities = Counter()
+    for item in items:
+        quantities[item['product']] += item['quantity']
+    return dict(quantities)
+
+
+def place_order(user, items, shipping_method, payment_method, hold=False, using='default'):
+    """
+    Takes (or with `hold`, reserves) the stock for `items` and creates the
+    order with its items. Raises CheckoutError (and changes nothing) when a
+    product is missing or short of stock.
+    """
+    from .models import Order, OrderItem, Product
+
+    quantities = merge_cart(items)
+    if not quantities:
+        raise CheckoutError("The cart is empty")
+    product_ids = sorted(quantities)
+
+    with transaction.atomic(using=using):
+        try:
+            inventory.take_stock(quantities, hold=hold, using=using)
+        except inventory.InsufficientStock as exc:
+            raise CheckoutError(str(exc), exc.unavailable)
+
+        prices = dict(Product.objects.using(using).filter(pk__in=product_ids).values_list('pk', 'price'))
+        shipping = shipping_cost(shipping_method)
+        subtotal = sum((prices[product_id] * quantities[product_id] for product_id in product_ids), Decimal('0'))
+        order = Order.objects.using(using).create(
+            user=user,
+            shipping_method=shipping_method,
+            shipping_cost=shipping,
+            payment_method=payment_method,
+            total=subtotal + shipping,
+        )
+        OrderItem.objects.using(using).bulk_create([
+            OrderItem(order=order, product_id=product_id, quantity=quantities[product_id], price=prices[product_id])
+            for product_id in product_ids
+        ])
+        if hold:
+            inventory.create_reservations(quantities, order=order, user=user, using=using)
+        else:
+            inventory.record_sale(quantities, order, using=using)
+        analytics.record_order(order, using=using)
+
+    # Cards show the stock, the UPDATEs above bypass the save signals
+    catalog_cache.invalidate_cards(product_ids)
+    return order
+
+
+def delete_order(order, using='default'):
+    """Deletes the order, returning its held stock and taking it out of the sales rollups."""
+    with transaction.atomic(using=using):
+        inventory.release(order.reservations.all(), using=using)
+        analytics.record_deletion([order.pk], using=using)
+        order.delete(using=using)
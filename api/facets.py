@@ -0,0 +1,195 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Min
+
+# Keys exposed by /api/products/filter-options/. These should be consistently
+# used in custom_attributes when adding products.
+FILTERABLE_ATTRIBUTE_KEYS = ['brand', 'storage', 'type', 'ram', 'processor']
+
+KEY_MAX_LENGTH = 100
+VALUE_MAX_LENGTH = 255
+
+
+def normalize_key(key):
+    return str(key).strip().lower()[:KEY_MAX_LENGTH]
+
+
+def normalize_value(value):
+    """Case- and whitespace-insensitive form used for grouping and filtering."""
+    return ' '.join(str(value).split()).casefold()[:VALUE_MAX_LENGTH]
+
+
+def extract_attributes(custom_attributes):
+    """
+    Returns {key: (display_value, normalized_value)} for the indexable entries of
+    a custom_attributes dict. Keys match case-insensitively (first one wins) and
+    only non-empty strings and numbers are indexed.
+    """
+    attributes = {}
+    if not isinstance(custom_attributes, dict):
+        return attributes
+
+    for raw_key, raw_value in custom_attributes.items():
+        key = normalize_key(raw_key)
+        if not key or key in attributes:
+            continue
+        if isinstance(raw_value, bool) or not isinstance(raw_value, (str, int, float)):
+            continue
+        value = str(raw_value).strip()[:VALUE_MAX_LENGTH]
+        if value:
+            attributes[key] = (value, normalize_value(value))
+    return attributes
+
+
+def _apply_facet_deltas(deltas, labels):
+    from .models import AttributeFacet
+
+    touched = []
+    for (key, normalized), delta in deltas.items():
+        if not delta:
+            continue
+        touched.append((key, normalized))
+        facet = AttributeFacet.objects.filter(key=key, normalized_value=normalized)
+        if facet.update(product_count=F('product_count') + delta) or delta < 0:
+            continue
+        try:
+            with transaction.atomic():
+                AttributeFacet.objects.create(
+                    key=key, normalized_value=normalized,
+                    value=labels[(key, normalized)], product_count=delta,
+                )
+        except IntegrityError:
+            # Created concurrently, fall back to the increment
+            facet.update(product_count=F('product_count') + delta)
+
+    for key, normalized in touched:
+        AttributeFacet.objects.filter(
+            key=key, normalized_value=normalized, product_count__lte=0
+        ).delete()
+
+
+def sync_product_attributes(products):
+    """
+    Brings the ProductAttribute rows and AttributeFacet counts of the given
+    (saved) products in line with their custom_attributes.
+    """
+    from .models import ProductAttribute
+
+    products = [product for product in products if product.pk]
+    if not products:
+        return
+
+    with transaction.atomic():
+        existing = {}
+        for row in ProductAttribute.objects.filter(product_id__in=[p.pk for p in products]):
+            existing[(row.product_id, row.key)] = row
+
+        deltas = Counter()
+        labels = {}
+        to_create, to_update, to_delete = [], [], []
+
+        for product in products:
+            wanted = extract_attributes(product.custom_attributes)
+            for key, (value, normalized) in wanted.items():
+                row = existing.pop((product.pk, key), None)
+                if row is not None and row.normalized_value == normalized:
+                    if row.value != value:
+                        row.value = value
+                        to_update.append(row)
+                    continue
+                if row is not None:
+                    to_delete.append(row.pk)
+                    deltas[(key, row.normalized_value)] -= 1
+                to_create.append(ProductAttribute(
+                    product_id=product.pk, key=key, value=value, normalized_value=normalized,
+                ))
+                deltas[(key, normalized)] += 1
+                labels.setdefault((key, normalized), value)
+
+        # Whatever is left over was removed from custom_attributes
+        for row in existing.values():
+            to_delete.append(row.pk)
+            deltas[(row.key, row.normalized_value)] -= 1
+
+        if to_delete:
+            ProductAttribute.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            ProductAttribute.objects.bulk_update(to_update, ['value'])
+        if to_create:
+            ProductAttribute.objects.bulk_create(to_create)
+        _apply_facet_deltas(deltas, labels)
+
+
+def remove_product_attributes(product_ids):
+    """Drops the attribute rows of products that are about to be deleted."""
+    from .models import ProductAttribute
+
+    with transaction.atomic():
+        rows = ProductAttribute.objects.filter(product_id__in=product_ids)
+        deltas = Counter(rows.values_list('key', 'normalized_value'))
+        rows.delete()
+        _apply_facet_deltas({pair: -count for pair, count in deltas.items()}, {})
+
+
+def rebuild_attribute_index(product_model=None, attribute_model=None, facet_model=None, batch_size=2000):
+    """
+    Recomputes every ProductAttribute row and AttributeFacet count from scratch.
+    Model classes can be passed in so data migrations can use historical models.
+    """
+    if product_model is None:
+        from .models import AttributeFacet, Product, ProductAttribute
+        product_model, attribute_model, facet_model = Product, ProductAttribute, AttributeFacet
+
+    with transaction.atomic():
+        attribute_model.objects.all().delete()
+        facet_model.objects.all().delete()
+
+        batch = []
+        products = product_model.objects.values_list('pk', 'custom_attributes')
+        for product_id, custom_attributes in products.iterator(chunk_size=batch_size):
+            for key, (value, normalized) in extract_attributes(custom_attributes).items():
+                batch.append(attribute_model(
+                    product_id=product_id, key=key, value=value, normalized_value=normalized,
+                ))
+            if len(batch) >= batch_size:
+                attribute_model.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            attribute_model.objects.bulk_create(batch)
+
+        facets = (
+            attribute_model.objects.values('key', 'normalized_value')
+            .annotate(value=Min('value'), product_count=Count('id'))
+        )
+        facet_model.objects.bulk_create(
+            [facet_model(**facet) for facet in facets.iterator()], batch_size=batch_size,
+        )
+
+
+def facet_counts(keys=FILTERABLE_ATTRIBUTE_KEYS, products=None):
+    """
+    Returns {key: [{'value': ..., 'count': ...}, ...]} sorted by value.
+
+    Without `products` the precomputed AttributeFacet table answers directly.
+    With a (filtered) Product queryset the counts are scoped to it.
+    """
+    from .models import AttributeFacet, ProductAttribute
+
+    if products is None:
+        rows = AttributeFacet.objects.filter(key__in=keys).values_list('key', 'value', 'product_count')
+    else:
+        rows = (
+            ProductAttribute.objects
+            .filter(key__in=keys, product__in=products.order_by().values('pk'))
+            .values('key', 'normalized_value')
+            .annotate(label=Min('value'), count=Count('id'))
+            .values_list('key', 'label', 'count')
+        )
+
+    counts = {key: [] for key in keys}
+    for key, value, count in rows:
+        counts[key].append({'value': value, 'count': count})
+    for key in counts:
+        counts[key].sort(key=lambda facet: facet['value'].casefold())
+    return counts
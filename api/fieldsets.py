@@ -0,0 +1,224 @@
+"""
+Sparse fieldsets (?fields=) and field expansion (?expand=) for the api.
+
+    ?fields=id,name,price,category_name
+    ?fields=id,product.name,product.price      (nested serializers, dotted)
+    ?expand=category                           (replace an id with the object)
+    ?expand=items.product
+
+Serializers opt in with SparseFieldsetSerializerMixin and list what can be
+expanded in Meta.expandable_fields. SparseFieldsetViewMixin reads the params
+into the serializer context and narrows the queryset to the requested fields:
+only() the columns they read, select_related/prefetch_related only the
+relations they traverse. Fields whose source isn't a model path (method
+fields, source='*') declare what they read in Meta.field_dependencies, or a
+queryset method that prefetches for them in Meta.field_querysets.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+
+READ_ACTIONS = ('list', 'retrieve')
+
+
+def parse_fieldset(value):
+    """'id,product.name' -> {'id': {}, 'product': {'name': {}}}, None when empty."""
+    spec = {}
+    for item in value.split(','):
+        parts = [part.strip() for part in item.split('.') if part.strip()]
+        node = spec
+        for part in parts:
+            node = node.setdefault(part, {})
+    return spec or None
+
+
+def subtree(spec, path):
+    """The part of `spec` for the serializer at `path`, None when it isn't restricted."""
+    for name in path:
+        if not spec:
+            return None
+        spec = spec.get(name)
+    return spec or None
+
+
+def project(data, spec):
+    """Applies a ?fields= spec to an already rendered payload (e.g. a cached card)."""
+    if not spec or not isinstance(data, dict):
+        return data
+    projected = {}
+    for name, children in spec.items():
+        if name in data:
+            value = data[name]
+            if isinstance(value, list):
+                projected[name] = [project(item, children) for item in value]
+            else:
+                projected[name] = project(value, children)
+    return projected
+
+
+class SparseFieldsetSerializerMixin:
+    """Drops the fields that weren't requested and expands the ones that were."""
+
+    def sparse_path(self):
+        path, node = [], self
+        while node.parent is not None:
+            if node.field_name:
+                path.append(node.field_name)
+            node = node.parent
+        return path[::-1]
+
+    def get_fields(self):
+        fields = super().get_fields()
+        path = self.sparse_path()
+        expand = subtree(self.context.get('expand'), path) or {}
+        for name, serializer_path in getattr(self.Meta, 'expandable_fields', {}).items():
+            if name in expand and name in fields:
+                fields[name] = import_string(serializer_path)(read_only=True)
+        requested = subtree(self.context.get('fields'), path)
+        if requested:
+            fields = {name: field for name, field in fields.items() if name in requested}
+        return fields
+
+    def nested_context(self, name):
+        """Context for a serializer built by hand for field `name`, e.g. in a method field."""
+        path = self.sparse_path() + [name]
+        context = dict(self.context)
+        for key in ('fields', 'expand'):
+            context[key] = subtree(self.context.get(key), path)
+        return context
+
+
+def _nested(field):
+    if isinstance(field, serializers.ListSerializer):
+        return field.child
+    if isinstance(field, serializers.BaseSerializer):
+        return field
+    return None
+
+
+def relation_chain(model, path):
+    """The model fields along a '__' path, stopping at the first non-field."""
+    chain = []
+    for part in path.split('__'):
+        if model is None:
+            break
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            break
+        chain.append(field)
+        model = field.related_model if field.is_relation else None
+    return chain
+
+
+class QueryPlan:
+    """Columns, joins and prefetches a serializer tree needs."""
+
+    def __init__(self):
+        self.only = set()
+        self.select = set()
+        self.prefetch = set()
+        self.methods = set()
+        self.unrestricted = set()  # Prefixes whose model needs every column
+
+    def add_path(self, model, path, prefix='', in_prefetch=False):
+        chain = relation_chain(model, path)
+        for depth, field in enumerate(chain, start=1):
+            lookup = prefix + '__'.join(field.name for field in chain[:depth])
+            traversed = depth < len(chain)
+            if field.is_relation and (field.one_to_many or field.many_to_many or not field.concrete):
+                # Everything below a reverse or many-to-many relation is prefetched
+                self.prefetch.add(lookup)
+                in_prefetch = True
+            elif in_prefetch:
+                if field.is_relation and traversed:
+                    self.prefetch.add(lookup)
+            else:
+                self.only.add(lookup)
+                if field.is_relation and traversed:
+                    self.select.add(lookup)
+
+    def add_serializer(self, serializer, model, prefix='', in_prefetch=False):
+        meta = getattr(serializer, 'Meta', None)
+        dependencies = getattr(meta, 'field_dependencies', {})
+        querysets = getattr(meta, 'field_querysets', {})
+        for name, field in serializer.fields.items():
+            if name in querysets and not prefix:
+                self.methods.add(querysets[name])
+            elif field.source == '*':
+                if name in dependencies:
+                    paths = dependencies[name]
+                elif hasattr(field, 'sparse_dependencies'):
+                    paths = field.sparse_dependencies(model)
+                else:
+                    self.unrestricted.add(prefix)  # Can't tell what it reads
+                    continue
+                for path in paths:
+                    self.add_path(model, path, prefix, in_prefetch)
+            else:
+                path = field.source.replace('.', '__')
+                self.add_path(model, path, prefix, in_prefetch)
+                chain = relation_chain(model, path)
+                nested = _nested(field)
+                if nested is None or not chain or not chain[-1].is_relation:
+                    continue
+                related, lookup = chain[-1], prefix + path
+                if related.one_to_many or related.many_to_many or not related.concrete or in_prefetch:
+                    self.prefetch.add(lookup)
+                    self.add_serializer(nested, related.related_model, lookup + '__', True)
+                else:
+                    self.select.add(lookup)
+                    self.add_serializer(nested, related.related_model, lookup + '__', False)
+
+    def apply(self, queryset, always=()):
+        for name in always:
+            self.add_path(queryset.model, name)
+        if '' not in self.unrestricted:
+            only = {queryset.model._meta.pk.name} | {
+                path for path in self.only
+                if not any(path.startswith(prefix) for prefix in self.unrestricted)
+            }
+            queryset = queryset.only(*only)
+        if self.select:
+            queryset = queryset.select_related(*self.select)
+        if self.prefetch:
+            queryset = queryset.prefetch_related(*sorted(self.prefetch))
+        for method in sorted(self.methods):
+            queryset = getattr(queryset, method)()
+        return queryset
+
+
+class SparseFieldsetViewMixin:
+    """Reads ?fields= and ?expand= on read actions and narrows the queryset to match."""
+    fields_param = 'fields'
+    expand_param = 'expand'
+
+    def get_fieldsets(self):
+        if not hasattr(self, '_fieldsets'):
+            params = self.request.query_params if self.request is not None else {}
+            read = self.action in READ_ACTIONS or (self.request is not None and self.request.method == 'GET')
+            self._fieldsets = (
+                parse_fieldset(params.get(self.fields_param, '')) if read else None,
+                parse_fieldset(params.get(self.expand_param, '')) if read else None,
+            )
+        return self._fieldsets
+
+    def has_sparse_fieldsets(self):
+        return self.action in READ_ACTIONS and any(self.get_fieldsets())
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        fields, expand = self.get_fieldsets()
+        if fields:
+            context['fields'] = fields
+        if expand:
+            context['expand'] = expand
+        return context
+
+    def narrow_queryset(self, queryset):
+        """`queryset` restricted to what the requested fields read."""
+        plan = QueryPlan()
+        plan.add_serializer(self.get_serializer(), queryset.model)
+        always = set(getattr(self, 'ordering_fields', None) or ())
+        always.update(getattr(self.paginator, 'ordering_fields', None) or ())
+        return plan.apply(queryset, always)
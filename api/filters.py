@@ -0,0 +1,118 @@
+import django_filters
+from django.db.models import Exists, OuterRef
+from rest_framework.filters import BaseFilterBackend, SearchFilter
+from rest_framework.settings import api_settings
+
+from . import search
+from .category_tree import subtree_filter
+from .facets import normalize_key, normalize_value
+from .models import AttributeFacet, Category, Product, ProductAttribute
+from .pagination import KeysetPagination
+
+
+class ProductFilter(django_filters.FilterSet):
+    min_price = django_filters.NumberFilter(field_name='price', lookup_expr='gte')
+    max_price = django_filters.NumberFilter(field_name='price', lookup_expr='lte')
+    min_rating = django_filters.NumberFilter(field_name='avg_rating', lookup_expr='gte')
+    min_reviews = django_filters.NumberFilter(field_name='review_count', lookup_expr='gte')
+    # ?in_category=<id>: the category and all of its descendants
+    in_category = django_filters.NumberFilter(method='filter_in_category')
+
+    class Meta:
+        model = Product
+        fields = ['category', 'is_new_arrival', 'is_bestseller', 'is_featured']
+
+    def filter_in_category(self, queryset, name, value):
+        path = Category.objects.filter(pk=value).values_list('path', flat=True).first()
+        if not path:
+            return queryset.none()
+        return queryset.filter(**subtree_filter(path, 'category__path', queryset.db))
+
+
+class AttributeFilterBackend(BaseFilterBackend):
+    """
+    Filters products on their indexed custom attributes, e.g.
+    ?attr.brand=Lenovo&attr.ram=16GB,32GB
+
+    Values for the same key are OR'ed (comma separated or repeated params),
+    different keys are AND'ed. Matching is case- and whitespace-insensitive.
+    Each key becomes one id IN (...) subquery served by the (key, value,
+    product) index, the most selective key (per the facet index) first.
+
+    Count-free keyset pages don't need every match, so there only a key rare
+    enough to drive the query is listed and the others become EXISTS probes
+    per product. Without such a key the paginator walks the ordering index
+    and stops at a full page (KeysetPagination.fetch_in_windows).
+    """
+    param_prefix = 'attr.'
+    # Most matches a key may have to be listed on count-free keyset pages
+    max_listed_matches = 4000
+
+    def get_attribute_filters(self, request):
+        attribute_filters = {}
+        for param, values in request.query_params.lists():
+            if not param.startswith(self.param_prefix):
+                continue
+            key = normalize_key(param[len(self.param_prefix):])
+            normalized = {
+                normalize_value(value)
+                for raw in values for value in raw.split(',') if value.strip()
+            }
+            if key and normalized:
+                attribute_filters.setdefault(key, set()).update(normalized)
+        return attribute_filters
+
+    def get_match_counts(self, attribute_filters):
+        """Products matching each key, read from the facet index."""
+        counts = dict.fromkeys(attribute_filters, 0)
+        all_values = set().union(*attribute_filters.values())
+        facets = (
+            AttributeFacet.objects
+            .filter(key__in=attribute_filters, normalized_value__in=all_values)
+            .values_list('key', 'normalized_value', 'product_count')
+        )
+        for key, normalized, product_count in facets:
+            if normalized in attribute_filters[key]:
+                counts[key] += product_count
+        return counts
+
+    def filter_queryset(self, request, queryset, view):
+        attribute_filters = self.get_attribute_filters(request)
+        if not attribute_filters:
+            return queryset
+
+        counts = self.get_match_counts(attribute_filters)
+        keys = sorted(attribute_filters, key=counts.get)
+        listed = keys
+        paginator = getattr(view, 'paginator', None)
+        if isinstance(paginator, KeysetPagination) and paginator.scans_in_order(request):
+            listed = keys[:1] if counts[keys[0]] <= self.max_listed_matches else []
+            request.scan_in_order = not listed
+
+        for key in keys:
+            matches = ProductAttribute.objects.filter(key=key, normalized_value__in=attribute_filters[key])
+            if key in listed:
+                queryset = queryset.filter(pk__in=matches.values('product_id'))
+            else:
+                queryset = queryset.filter(Exists(matches.filter(product=OuterRef('pk'))))
+        return queryset
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    ?search= backed by the FTS5 index named by the view's `search_index`.
+    Words are prefix-matched and, unless the client asked for an explicit
+    ?ordering=, results come back in BM25 relevance order. Falls back to the
+    regular icontains search over `search_fields` when FTS5 isn't available.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        kind = getattr(view, 'search_index', None)
+        terms = ' '.join(self.get_search_terms(request))
+        if not terms or kind is None or not search.is_enabled(queryset.db):
+            return super().filter_queryset(request, queryset, view)
+
+        queryset = search.filter_queryset(queryset, kind, terms)
+        if not request.query_params.get(api_settings.ORDERING_PARAM):
+            queryset = queryset.order_by('search_rank')
+        return queryset
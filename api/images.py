@@ -0,0 +1,209 @@
+"""
+Resized WebP renditions of uploaded images.
+
+When a product, category, review or profile image is saved, a background
+worker pool reads the upload once and writes one file per configured
+rendition (IMAGE_RENDITIONS, e.g. a 200px "thumb" and a 600px "medium") and
+format. Files are named after a hash of the source bytes, so they never
+change once written and identical uploads share them. The result is stored on
+the row itself, in its image_renditions JSON field:
+
+    {'image_main': {
+        'source': 'products/images/laptop.jpg',
+        'renditions': {'thumb': {'width': 200, 'webp': 'renditions/3f/3f9a...-200.webp'}, ...},
+    }}
+
+so serializers build srcset maps without extra queries. An entry whose source
+no longer matches the field is stale and ignored until the worker catches up.
+Existing images are processed with the build_image_renditions command.
+"""
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+logger = logging.getLogger(__name__)
+
+# Model label -> image fields. Each model stores its renditions in image_renditions.
+IMAGE_FIELDS = {
+    'api.Product': ['image_main', 'image_alt1', 'image_alt2', 'image_alt3', 'image_alt4'],
+    'api.Category': ['image'],
+    'api.ReviewImage': ['image'],
+}
+
+RENDITIONS_DIR = 'renditions'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def image_models():
+    return [(apps.get_model(label), fields) for label, fields in IMAGE_FIELDS.items()]
+
+
+def output_formats():
+    """The configured formats this Pillow build can encode (AVIF needs Pillow 11.2+)."""
+    return [fmt for fmt in settings.IMAGE_RENDITION_FORMATS if features.check(fmt)]
+
+
+def is_current(entry, source, formats):
+    return bool(entry) and entry.get('source') == source and all(
+        fmt in rendition for rendition in entry['renditions'].values() for fmt in formats
+    )
+
+
+def needs_renditions(instance):
+    """True when an image field of `instance` changed since its renditions were built."""
+    stored = instance.image_renditions or {}
+    formats = output_formats()
+    for field in IMAGE_FIELDS[instance._meta.label]:
+        source = getattr(instance, field).name or None
+        if source is None:
+            if field in stored:
+                return True
+        elif not is_current(stored.get(field), source, formats):
+            return True
+    return False
+
+
+def render(source, formats, storage=default_storage):
+    """Writes the renditions of one stored image and returns its image_renditions entry."""
+    with storage.open(source, 'rb') as file:
+        data = file.read()
+    digest = hashlib.sha256(data).hexdigest()[:20]
+
+    image = Image.open(io.BytesIO(data))
+    # JPEGs can be decoded at a fraction of their size when that still covers
+    # the largest rendition (a square box, EXIF rotation may swap the sides)
+    largest = max(settings.IMAGE_RENDITIONS.values())
+    image.draft('RGB', (largest, largest))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.getbands() else 'RGB')
+
+    renditions = {}
+    for name, width in settings.IMAGE_RENDITIONS.items():
+        width = min(width, image.width)  # Never upscale
+        entry = {'width': width}
+        resized = None
+        for fmt in formats:
+            path = f"{RENDITIONS_DIR}/{digest[:2]}/{digest}-{width}.{fmt}"
+            if not storage.exists(path):
+                if resized is None:
+                    height = max(round(image.height * width / image.width), 1)
+                    resized = image.resize((width, height), Image.Resampling.LANCZOS)
+                buffer = io.BytesIO()
+                resized.save(buffer, fmt.upper(), quality=settings.IMAGE_RENDITION_QUALITY)
+                path = storage.save(path, ContentFile(buffer.getvalue()))
+            entry[fmt] = path
+        renditions[name] = entry
+    return {'source': source, 'renditions': renditions}
+
+
+def build_renditions(model, pk, force=False, using='default'):
+    """
+    Brings the renditions of one row in line with its image fields. Returns
+    True when image_renditions was updated.
+    """
+    fields = IMAGE_FIELDS[model._meta.label]
+    queryset = model._default_manager.using(using).filter(pk=pk)
+    row = queryset.values(*fields, 'image_renditions').first()
+    if row is None:
+        return False
+
+    stored = row['image_renditions'] or {}
+    formats = output_formats()
+    renditions = {}
+    for field in fields:
+        source = row[field]
+        if not source:
+            continue
+        if not force and is_current(stored.get(field), source, formats):
+            renditions[field] = stored[field]
+            continue
+        try:
+            renditions[field] = render(source, formats)
+        except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as exc:
+            logger.warning("Could not build renditions for %s %s.%s (%s): %s", model.__name__, pk, field, source, exc)
+
+    if renditions == stored:
+        return False
+    # Skipped when an image was replaced meanwhile, that save scheduled its own build
+    if not queryset.filter(**{field: row[field] for field in fields}).update(image_renditions=renditions):
+        return False
+    from . import catalog_cache, response_cache
+
+    if model._meta.label == 'api.Product':
+        catalog_cache.invalidate_cards([pk])
+    response_cache.invalidate_model(model)
+    return True
+
+
+def _pool_executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(settings.IMAGE_RENDITION_WORKERS, thread_name_prefix='image-renditions')
+    return _pool
+
+
+def _build_in_worker(model, pk, using):
+    try:
+        build_renditions(model, pk, using=using)
+    except Exception:
+        logger.exception("Building renditions for %s %s failed", model.__name__, pk)
+    finally:
+        connections.close_all()  # The worker thread's own connections
+
+
+def schedule(instance, using='default'):
+    """
+    Builds the renditions of `instance` once the current transaction commits,
+    on the worker pool, or inline when IMAGE_RENDITION_WORKERS is 0.
+    """
+    model, pk = type(instance), instance.pk
+
+    def submit():
+        if settings.IMAGE_RENDITION_WORKERS > 0:
+            _pool_executor().submit(_build_in_worker, model, pk, using)
+        else:
+            build_renditions(model, pk, using=using)
+
+    transaction.on_commit(submit, using=using)
+
+
+def rendition_urls(instance, field, request=None):
+    """
+    {'srcset': {format: 'url 200w, url 600w'}, <rendition>: {format: url}} for
+    one image field, or None when its renditions aren't built yet.
+    """
+    image = getattr(instance, field)
+    return stored_rendition_urls(getattr(instance, 'image_renditions', None), field, image.name if image else None, request)
+
+
+def stored_rendition_urls(renditions, field, image_name, request=None):
+    """rendition_urls() from the stored image_renditions and image name, e.g. a values() row."""
+    entry = (renditions or {}).get(field)
+    if not entry or not image_name or entry.get('source') != image_name:
+        return None
+
+    def url(path):
+        url = default_storage.url(path)
+        return request.build_absolute_uri(url) if request is not None else url
+
+    urls, srcset = {}, {}
+    for name, rendition in entry['renditions'].items():
+        urls[name] = {fmt: url(path) for fmt, path in rendition.items() if fmt != 'width'}
+        for fmt, rendition_url in urls[name].items():
+            candidate = f"{rendition_url} {rendition['width']}w"
+            if candidate not in srcset.setdefault(fmt, []):
+                srcset[fmt].append(candidate)
+    return {'srcset': {fmt: ', '.join(candidates) for fmt, candidates in srcset.items()}, **urls}
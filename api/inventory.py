@@ -0,0 +1,245 @@
+"""
+Inventory ledger and time-boxed stock reservations.
+
+Product.stock is the quantity available to sell and Product.reserved_stock
+the quantity held by active reservations. Both are plain counters changed
+with conditional F() UPDATEs, so listings read them as is and never touch
+the ledger. Every change is also appended to InventoryMovement, keeping
+
+    stock == sum(stock_change) and reserved_stock == sum(reserved_change)
+
+for each product. A reservation moves units from stock to reserved_stock
+for STOCK_RESERVATION_SECONDS, e.g. while an M-Pesa STK push is pending. It
+ends when it is committed (the units are sold), released (back to stock) or
+expired. Expiry is not checked per request: release_expired() sweeps the
+overdue reservations in batches and is run by the
+release_expired_reservations command.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import analytics, catalog_cache
+
+SWEEP_BATCH_SIZE = 500
+
+
+class InsufficientStock(Exception):
+    """Some products are short. `unavailable` lists {product, requested, available}."""
+
+    def __init__(self, unavailable):
+        super().__init__("Some products are not available in the requested quantity")
+        self.unavailable = unavailable
+
+
+def take_stock(quantities, hold=False, using='default'):
+    """
+    Takes {product id: quantity} out of the available stock, or moves it to
+    reserved_stock when `hold` is set. Must run inside a transaction, raises
+    InsufficientStock (leaving the rollback to the caller) when a product is
+    missing or short.
+
+    One conditional UPDATE per product, in primary key order: it checks and
+    decrements in one statement, so concurrent buyers can't oversell, and the
+    fixed order keeps overlapping carts from deadlocking. Taking the write
+    locks before reading anything also avoids SQLite's read-to-write lock
+    upgrade, which fails immediately instead of waiting under contention.
+    """
+    from .models import Product
+
+    products = Product.objects.using(using)
+    short = []
+    for product_id in sorted(quantities):
+        quantity = quantities[product_id]
+        changes = {'stock': F('stock') - quantity}
+        if hold:
+            changes['reserved_stock'] = F('reserved_stock') + quantity
+        if not products.filter(pk=product_id, stock__gte=quantity).update(**changes):
+            short.append(product_id)
+    if short:
+        available = dict(products.filter(pk__in=short).values_list('pk', 'stock'))
+        raise InsufficientStock([
+            {'product': product_id, 'requested': quantities[product_id], 'available': available.get(product_id, 0)}
+            for product_id in short
+        ])
+
+
+def record_sale(quantities, order, using='default'):
+    """Ledger entries for stock taken by take_stock() without a hold."""
+    from .models import InventoryMovement
+
+    InventoryMovement.objects.using(using).bulk_create([
+        InventoryMovement(product_id=product_id, kind='sale', stock_change=-quantity, order=order)
+        for product_id, quantity in quantities.items()
+    ])
+
+
+def create_reservations(quantities, order=None, user=None, seconds=None, using='default'):
+    """Reservations (and their ledger entries) for stock taken by take_stock(hold=True)."""
+    from .models import InventoryMovement, StockReservation
+
+    seconds = settings.STOCK_RESERVATION_SECONDS if seconds is None else seconds
+    expires_at = timezone.now() + timedelta(seconds=seconds)
+    reservations = StockReservation.objects.using(using).bulk_create([
+        StockReservation(product_id=product_id, quantity=quantity, order=order, user=user, expires_at=expires_at)
+        for product_id, quantity in sorted(quantities.items())
+    ])
+    InventoryMovement.objects.using(using).bulk_create([
+        InventoryMovement(
+            product_id=reservation.product_id, kind='reserve', stock_change=-reservation.quantity,
+            reserved_change=reservation.quantity, reservation=reservation, order=order,
+        )
+        for reservation in reservations
+    ])
+    return reservations
+
+
+def reserve(quantities, order=None, user=None, seconds=None, using='default'):
+    """Holds {product id: quantity} for `seconds`, all or nothing. Returns the reservations."""
+    with transaction.atomic(using=using):
+        take_stock(quantities, hold=True, using=using)
+        reservations = create_reservations(quantities, order, user, seconds, using)
+    catalog_cache.invalidate_cards(quantities)
+    return reservations
+
+
+def adjust(product_id, quantity, kind='adjustment', note='', using='default'):
+    """
+    Adds (or with a negative quantity, removes) available stock, e.g. for a
+    delivery. Returns False without changing anything when removing more
+    than is available.
+    """
+    from .models import InventoryMovement, Product
+
+    with transaction.atomic(using=using):
+        products = Product.objects.using(using).filter(pk=product_id)
+        if quantity < 0:
+            products = products.filter(stock__gte=-quantity)
+        if not products.update(stock=F('stock') + quantity):
+            return False
+        InventoryMovement.objects.using(using).create(product_id=product_id, kind=kind, stock_change=quantity, note=note)
+    catalog_cache.invalidate_cards([product_id])
+    return True
+
+
+def record_stock_edits(products, created=False, using='default'):
+    """
+    Ledger entries for stock set directly on saved products (forms, the API,
+    imports), from the stock each one was loaded with.
+    """
+    from .models import InventoryMovement
+
+    movements = []
+    for product in products:
+        previous = 0 if created else product.get_loaded_value('stock')
+        if previous is not None and product.stock != previous:
+            movements.append(InventoryMovement(
+                product_id=product.pk, kind='receipt' if created else 'adjustment',
+                stock_change=product.stock - previous,
+            ))
+    InventoryMovement.objects.using(using).bulk_create(movements)
+
+
+def set_stock(products, using='default'):
+    """
+    Writes the stock set on saved `products`, e.g. an import's counts. The
+    ledger entries are taken from the stock locked at write time rather
+    than the loaded copies, which may predate a checkout.
+    """
+    from .models import InventoryMovement, Product
+
+    products = list({product.pk: product for product in products}.values())
+    if not products:
+        return
+    with transaction.atomic(using=using):
+        current = dict(
+            Product.objects.using(using).select_for_update().filter(pk__in=[product.pk for product in products])
+            .order_by('pk').values_list('pk', 'stock')
+        )
+        Product.objects.using(using).bulk_update(products, ['stock'], batch_size=500)
+        InventoryMovement.objects.using(using).bulk_create([
+            InventoryMovement(product_id=product.pk, kind='adjustment', stock_change=product.stock - current[product.pk])
+            for product in products if product.pk in current and product.stock != current[product.pk]
+        ])
+    catalog_cache.invalidate_cards([product.pk for product in products])
+
+
+def _end(reservations, status, using='default'):
+    """
+    Ends the active reservations among `reservations` (a queryset). Returns
+    the number ended. Each one is claimed with its own conditional UPDATE, so
+    a reservation racing between a commit and the sweeper ends exactly once.
+    """
+    from .models import InventoryMovement, Order, Product, StockReservation
+
+    kind = {StockReservation.COMMITTED: 'commit', StockReservation.RELEASED: 'release', StockReservation.EXPIRED: 'expire'}[status]
+    with transaction.atomic(using=using):
+        rows = list(
+            reservations.using(using).filter(status=StockReservation.ACTIVE)
+            .select_for_update(skip_locked=True).order_by('pk')
+            .values_list('pk', 'product_id', 'order_id', 'quantity')
+        )
+        active = StockReservation.objects.using(using).filter(status=StockReservation.ACTIVE)
+        ended = [row for row in rows if active.filter(pk=row[0]).update(status=status)]
+        if not ended:
+            return 0
+
+        held = {}
+        for _, product_id, _, quantity in ended:
+            held[product_id] = held.get(product_id, 0) + quantity
+        for product_id in sorted(held):
+            changes = {'reserved_stock': F('reserved_stock') - held[product_id]}
+            if status != StockReservation.COMMITTED:
+                changes['stock'] = F('stock') + held[product_id]
+            Product.objects.using(using).filter(pk=product_id).update(**changes)
+
+        InventoryMovement.objects.using(using).bulk_create([
+            InventoryMovement(
+                product_id=product_id, kind=kind, reservation_id=pk, order_id=order_id, reserved_change=-quantity,
+                stock_change=0 if status == StockReservation.COMMITTED else quantity,
+            )
+            for pk, product_id, order_id, quantity in ended
+        ])
+        if status == StockReservation.EXPIRED:
+            # An order whose hold ran out can no longer be fulfilled as placed
+            order_ids = sorted({order_id for _, _, order_id, _ in ended if order_id})
+            pending = Order.objects.using(using).filter(status='pending')
+            cancelled = [pk for pk in order_ids if pending.filter(pk=pk).update(status='cancelled')]
+            analytics.record_status_change(cancelled, 'pending', 'cancelled', using=using)
+
+    catalog_cache.invalidate_cards(held)
+    return len(ended)
+
+
+def commit(reservations, using='default'):
+    """Turns active reservations into sales."""
+    from .models import StockReservation
+
+    return _end(reservations, StockReservation.COMMITTED, using)
+
+
+def release(reservations, using='default'):
+    """Returns the units of active reservations to the available stock."""
+    from .models import StockReservation
+
+    return _end(reservations, StockReservation.RELEASED, using)
+
+
+def release_expired(now=None, batch_size=SWEEP_BATCH_SIZE, using='default'):
+    """Expires every overdue reservation, batch by batch. Returns how many were expired."""
+    from .models import StockReservation
+
+    now = now or timezone.now()
+    overdue = StockReservation.objects.using(using).filter(status=StockReservation.ACTIVE, expires_at__lte=now)
+    expired = 0
+    while True:
+        batch = list(overdue.order_by('expires_at', 'pk').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return expired
+        ended = _end(StockReservation.objects.filter(pk__in=batch), StockReservation.EXPIRED, using)
+        if not ended:  # Claimed by a concurrent sweeper
+            return expired
+        expired += ended
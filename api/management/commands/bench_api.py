@@ -0,0 +1,206 @@
+import gc
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.test import APIClient
+
+from api.benchmarking import benchmark_database, summarize, time_calls
+from api.models import Category, Order, Product, Wishlist
+from api.recommendations import rebuild_related
+from api.seeding import default_counts, seed
+
+DEFAULT_SCALES = (1000, 100_000, 1_000_000)
+BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'api_baseline.json')
+
+# (name, who calls it, method, path, payload), formatted with the sample rows
+# picked by sample(). Not benchmarked: login and registration (password
+# hashing, whatever the data), M-Pesa and the chatbot's ask (external APIs),
+# catalog import/export (bulk jobs) and the admin's product writes.
+ENDPOINTS = [
+    ('categories', None, 'get', '/api/categories/', None),
+    ('category tree', None, 'get', '/api/categories/?view=tree', None),
+    ('products', None, 'get', '/api/products/', None),
+    ('products in category', None, 'get', '/api/products/?in_category={category}', None),
+    ('products filtered', None, 'get',
+     '/api/products/?attr.brand=Lenovo,HP&attr.ram=16GB&min_price=50000&max_price=150000&ordering=price', None),
+    ('products by rating', None, 'get', '/api/products/?ordering=-avg_rating&min_reviews=5', None),
+    ('product search', None, 'get', '/api/products/?search=lenovo gaming', None),
+    ('product detail', None, 'get', '/api/products/{slug}/', None),
+    ('featured', None, 'get', '/api/products/featured/', None),
+    ('new arrivals', None, 'get', '/api/products/new-arrivals/', None),
+    ('bestsellers', None, 'get', '/api/products/bestsellers/', None),
+    ('batch', None, 'get', '/api/products/batch/?ids={ids}', None),
+    ('filter options', None, 'get', '/api/products/filter-options/', None),
+    ('filter options in category', None, 'get', '/api/products/filter-options/?in_category={category}', None),
+    ('related', None, 'get', '/api/products/{slug}/related/', None),
+    ('reviews', None, 'get', '/api/products/{slug}/reviews/', None),
+    ('chatbot search', None, 'get', '/api/chatbot/search-products/?q=lenovo', None),
+    ('profile', 'user', 'get', '/api/auth/user/', None),
+    ('orders', 'user', 'get', '/api/orders/', None),
+    ('order detail', 'user', 'get', '/api/orders/{order}/', None),
+    ('wishlist', 'user', 'get', '/api/wishlist/', None),
+    ('wishlist contains', 'user', 'get', '/api/wishlist/contains/?ids={ids}', None),
+    ('wishlist toggle', 'user', 'post', '/api/wishlist/toggle/', {'product_id': '{product}'}),
+    ('checkout', 'user', 'post', '/api/orders/checkout/', {
+        'items': [{'product': '{product}', 'quantity': 1}], 'shipping_method': 'home', 'payment_method': 'cash',
+    }),
+    ('review', 'user', 'post', '/api/products/{slug}/reviews/', {'rating': 4, 'comment': 'Benchmark review'}),
+    ('sales summary', 'admin', 'get', '/api/analytics/?interval=week', None),
+    ('top products', 'admin', 'get', '/api/analytics/products/', None),
+    ('category sales', 'admin', 'get', '/api/analytics/categories/', None),
+]
+
+
+def fill(template, rows):
+    """`template` (a path or payload) with the {placeholders} replaced by the sample rows."""
+    if isinstance(template, str):
+        value = template.format(**rows)
+        return int(value) if value.isdigit() and template.startswith('{') else value
+    if isinstance(template, dict):
+        return {key: fill(value, rows) for key, value in template.items()}
+    if isinstance(template, list):
+        return [fill(value, rows) for value in template]
+    return template
+
+
+class QueryCounter:
+    """Counts the queries run on a connection, see connection.execute_wrapper()."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def compare(results, baseline, tolerance, slack_ms):
+    """The regressions of `results` against `baseline`, both {scale: {endpoint: measures}}."""
+    regressions = []
+    for scale, endpoints in results.items():
+        for name, measured in endpoints.items():
+            expected = baseline.get(scale, {}).get(name)
+            if expected is None:
+                continue
+            if measured['queries'] > expected['queries']:
+                regressions.append(f"{name} at {scale}: {expected['queries']} -> {measured['queries']} queries")
+            # The median: one slow sample on a busy machine moves the p95 of a short run
+            if measured['p50'] > expected['p50'] * (1 + tolerance) + slack_ms:
+                regressions.append(f"{name} at {scale}: p50 {expected['p50']:.1f} -> {measured['p50']:.1f}ms")
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway database at each catalog size (see api.seeding) and measures every "
+        "API endpoint through the full request stack: the number of queries and the latency "
+        "percentiles with cold caches. Compares them with the committed baseline and fails "
+        "on more queries, or a median slower than --tolerance and --slack-ms allow; "
+        "--update-baseline records the new numbers instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', type=int, nargs='+', default=list(DEFAULT_SCALES),
+                            help="Numbers of products to benchmark at.")
+        parser.add_argument('--repeat', type=int, default=30)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--baseline', default=BASELINE)
+        parser.add_argument('--update-baseline', action='store_true')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help="Allowed median slowdown, as a fraction of the baseline.")
+        parser.add_argument('--slack-ms', type=float, default=5.0,
+                            help="Allowed median slowdown in milliseconds, on top of --tolerance.")
+
+    def handle(self, *args, **options):
+        # testserver in ALLOWED_HOSTS like the test runner, and no query log to slow things down
+        setup_test_environment(debug=False)
+        try:
+            results = {}
+            with tempfile.TemporaryDirectory() as directory:
+                for scale in options['scales']:
+                    # A file for SQLite: a million products don't fit an in-memory database comfortably
+                    path = os.path.join(directory, f'bench_api_{scale}.sqlite3') if connection.vendor == 'sqlite' else None
+                    with benchmark_database(path):
+                        results[str(scale)] = self.run_scale(scale, options)
+        finally:
+            teardown_test_environment()
+
+        baseline = {}
+        if os.path.exists(options['baseline']):
+            with open(options['baseline']) as stream:
+                baseline = json.load(stream)
+        if options['update_baseline']:
+            baseline.setdefault('scales', {}).update(results)
+            baseline['database'] = connection.vendor
+            baseline['repeat'] = options['repeat']
+            os.makedirs(os.path.dirname(options['baseline']), exist_ok=True)
+            with open(options['baseline'], 'w') as stream:
+                json.dump(baseline, stream, indent=2, sort_keys=True)
+                stream.write('\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote the baseline to {options['baseline']}."))
+            return
+
+        regressions = compare(results, baseline.get('scales', {}), options['tolerance'], options['slack_ms'])
+        if regressions:
+            raise CommandError("Regressions against the baseline:\n" + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
+
+    def sample(self, products):
+        """The rows the endpoint paths point at: the most reviewed product, a department, a shopper, an admin."""
+        product = Product.objects.order_by('-review_count', 'pk').first()
+        Product.objects.filter(pk=product.pk).update(stock=10 ** 6)  # Enough for every checkout
+        rebuild_related([product.pk])
+        shopper = Order.objects.values('user_id').order_by('user_id').first()['user_id']
+        Wishlist.objects.get_or_create(user_id=shopper, product=product)
+        root = Category.objects.filter(depth=0).order_by('pk').first()
+        User = get_user_model()
+        return {
+            'user': User.objects.get(pk=shopper),
+            'admin': User.objects.create_user('bench-admin', is_staff=True),
+        }, {
+            'product': product.pk,
+            'slug': product.slug,
+            'category': root.pk,
+            'order': Order.objects.filter(user_id=shopper).order_by('-pk').values_list('pk', flat=True).first(),
+            'ids': ','.join(str(pk) for pk, _ in products[:24]),
+        }
+
+    def run_scale(self, scale, options):
+        self.stdout.write(f"Seeding {scale} products...")
+        seeded = seed(default_counts(scale), seed=options['seed'])
+        users, rows = self.sample(seeded['products'])
+        del seeded
+        gc.collect()  # Not in the middle of the first endpoint's timings
+        results = {}
+        for name, caller, method, path, payload in ENDPOINTS:
+            client = APIClient()
+            if caller:
+                client.force_authenticate(users[caller])
+            url, data = fill(path, rows), fill(payload, rows)
+
+            def call():
+                for cache in caches.all():
+                    cache.clear()  # Cold: the database work is what grows with the catalog
+                if method == 'get':
+                    return client.get(url)
+                return client.post(url, data, format='json')
+
+            queries = QueryCounter()
+            with connection.execute_wrapper(queries):
+                response = call()
+            if response.status_code >= 400:
+                raise CommandError(f"{name}: {method.upper()} {url} returned {response.status_code}")
+            timings = summarize(time_calls(call, options['repeat']))
+            results[name] = {'queries': queries.count, **{key: timings[key] for key in ('p50', 'p95', 'p99')}}
+            self.stdout.write(
+                f"{scale:>8} | {name:<28} {queries.count:>3} queries | p50={timings['p50']:>8.2f}ms "
+                f"p95={timings['p95']:>8.2f}ms p99={timings['p99']:>8.2f}ms"
+            )
+        return results
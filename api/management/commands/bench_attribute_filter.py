@@ -0,0 +1,141 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api.benchmarking import benchmark_database, bulk_insert, summarize, time_calls
+from api.facets import rebuild_attribute_index
+from api.models import Category, Product
+from api.views import ProductViewSet
+
+BRANDS = ['Lenovo', 'HP', 'Dell', 'Apple', 'Asus', 'Acer', 'MSI', 'Microsoft', 'Samsung', 'Toshiba']
+RAM = ['4GB', '8GB', '16GB', '32GB', '64GB']
+STORAGE = ['128GB SSD', '256GB SSD', '512GB SSD', '1TB SSD', '2TB SSD', '1TB HDD']
+TYPES = ['Ultrabook', 'Gaming', 'Business', 'Convertible', 'Chromebook']
+PROCESSORS = [f"Intel Core i{tier} - {gen}" for tier in (3, 5, 7, 9) for gen in ('1135G7', '1255U', '13620H')]
+
+SCENARIOS = [
+    ('single key', 'attr.brand=Lenovo'),
+    ('multi-value OR', 'attr.brand=Lenovo,HP&attr.ram=16GB'),
+    ('three keys', 'attr.brand=Dell&attr.ram=16GB,32GB&attr.storage=512GB SSD'),
+    ('attributes + price range', 'attr.brand=Asus&attr.type=Gaming&min_price=50000&max_price=150000'),
+    ('attributes + category', 'attr.ram=8GB&category={category}'),
+    ('multi-value OR by price', 'attr.brand=Lenovo,HP&attr.ram=16GB&ordering=price'),
+    ('three keys, top rated', 'attr.brand=Dell&attr.ram=16GB,32GB&attr.storage=512GB SSD&ordering=-avg_rating'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks ?attr.<key>= product filtering against a synthetic catalog in a "
+        "throwaway database. The budget applies to fetching the first filtered page "
+        "through ProductViewSet's filters and ?pagination=cursor&count=false, with cold "
+        "caches. The whole list request and the exact COUNT the page-number paginator "
+        "adds (it visits every matching product) are timed and reported alongside, "
+        "outside the budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=200_000)
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--budget-ms', type=float, default=20.0,
+                            help="Fail when a scenario's page fetch p95 exceeds this many milliseconds.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        # testserver in ALLOWED_HOSTS like the test runner, and no query log to slow things down
+        setup_test_environment(debug=False)
+        try:
+            failures = self.run_scenarios(rng, options)
+        finally:
+            teardown_test_environment()
+
+        if failures:
+            raise CommandError(f"Over the {options['budget_ms']}ms budget: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS(f"All scenarios within {options['budget_ms']}ms (p95)."))
+
+    def run_scenarios(self, rng, options):
+        with benchmark_database():
+            started = time.perf_counter()
+            category_ids = self.build_catalog(rng, options['products'])
+            self.stdout.write(
+                f"Seeded {options['products']} products in {time.perf_counter() - started:.1f}s"
+            )
+
+            failures = []
+            client = APIClient()
+            for label, query in SCENARIOS:
+                query = query.format(category=category_ids[0])
+
+                def cold(fetch):
+                    def call():
+                        for cache in caches.all():
+                            cache.clear()  # Cold: the response and card caches would hide the queries
+                        fetch()
+                    return call
+
+                def request():
+                    response = client.get(f"/api/products/?{query}&pagination=cursor&count=false")
+                    if response.status_code != 200:
+                        raise CommandError(f"{label}: ?{query} returned {response.status_code}")
+
+                page = summarize(time_calls(cold(lambda: self.page(query)), options['repeat']))
+                whole = summarize(time_calls(cold(request), options['repeat']))
+                count = summarize(time_calls(lambda: self.count(query), options['repeat']))
+                self.stdout.write(
+                    f"{label:<26} page p50={page['p50']:>6.2f}ms p95={page['p95']:>6.2f}ms | "
+                    f"request p50={whole['p50']:>6.2f}ms | "
+                    f"count p50={count['p50']:>7.2f}ms p95={count['p95']:>7.2f}ms  ?{query}"
+                )
+                if page['p95'] > options['budget_ms']:
+                    failures.append(label)
+        return failures
+
+    def build_catalog(self, rng, count):
+        categories = Category.objects.bulk_create(
+            [Category(name=name) for name in TYPES]
+        )
+        category_ids = [category.pk for category in categories]
+
+        def products():
+            for i in range(count):
+                yield Product(
+                    name=f"Bench laptop {i}",
+                    slug=f"bench-laptop-{i}",
+                    price=Decimal(rng.randrange(20_000, 300_000)),
+                    category_id=rng.choice(category_ids),
+                    stock=rng.randrange(0, 50),
+                    custom_attributes={
+                        'brand': rng.choice(BRANDS),
+                        'ram': rng.choice(RAM),
+                        'storage': rng.choice(STORAGE),
+                        'type': rng.choice(TYPES),
+                        'processor': rng.choice(PROCESSORS),
+                    },
+                )
+
+        # bulk_create skips the signals, so index the attributes in one pass afterwards
+        bulk_insert(Product, products())
+        rebuild_attribute_index()
+        return category_ids
+
+    def view(self, query):
+        request = Request(APIRequestFactory().get(f"/api/products/?{query}"))
+        return ProductViewSet(request=request, action='list', format_kwarg=None, kwargs={})
+
+    def page(self, query):
+        """The first page ProductViewSet.list fetches for the query string, with keyset pagination and no count."""
+        view = self.view(f"{query}&pagination=cursor&count=false")
+        return view.paginate_queryset(view.filter_queryset(view.get_queryset()))
+
+    def count(self, query):
+        """The total ProductViewSet.list's paginator counts for the given query string."""
+        view = self.view(query)
+        return view.filter_queryset(view.get_queryset()).order_by().count()
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections
+from django.db.models import Sum
+
+from api.benchmarking import benchmark_database, summarize
+from api.checkout import CheckoutError, place_order
+from api.models import Category, OrderItem, Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Races --buyers concurrent checkouts for the last --stock units of one product "
+        "in a throwaway database and fails if more units are sold than were in stock."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=200)
+        parser.add_argument('--stock', type=int, default=10)
+        parser.add_argument('--quantity', type=int, default=1, help="Units each buyer asks for.")
+
+    def handle(self, *args, **options):
+        buyers, stock = options['buyers'], options['stock']
+        # Every buyer thread needs its own connection, so SQLite needs a file
+        with tempfile.TemporaryDirectory() as directory, \
+                benchmark_database(os.path.join(directory, 'bench_checkout.sqlite3')):
+            category = Category.objects.create(name='Flash sale')
+            product = Product.objects.create(name='Flash sale laptop', price=Decimal('99999'), category=category, stock=stock)
+            users = get_user_model().objects.bulk_create([
+                get_user_model()(username=f'buyer{i}') for i in range(buyers)
+            ])
+
+            outcomes = {'ordered': 0, 'sold out': 0, 'error': 0}
+            latencies = []
+            lock = threading.Lock()
+            start = threading.Barrier(buyers)
+
+            def buy(user):
+                start.wait()
+                began = time.perf_counter()
+                try:
+                    place_order(user, [{'product': product.pk, 'quantity': options['quantity']}], 'home', 'cash')
+                    outcome = 'ordered'
+                except CheckoutError:
+                    outcome = 'sold out'
+                except DatabaseError:
+                    outcome = 'error'
+                finally:
+                    connections.close_all()
+                with lock:
+                    outcomes[outcome] += 1
+                    latencies.append((time.perf_counter() - began) * 1000)
+
+            threads = [threading.Thread(target=buy, args=(user,)) for user in users]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            product.refresh_from_db()
+            sold = OrderItem.objects.filter(product=product).aggregate(units=Sum('quantity'))['units'] or 0
+            timings = summarize(latencies)
+            self.stdout.write(
+                f"{buyers} buyers in {elapsed:.2f}s: {outcomes['ordered']} ordered, "
+                f"{outcomes['sold out']} sold out, {outcomes['error']} errors | "
+                f"p50={timings['p50']:.1f}ms p95={timings['p95']:.1f}ms | "
+                f"{sold} units sold, {product.stock} left of {stock}"
+            )
+
+        if sold > stock or sold + product.stock != stock:
+            raise CommandError(f"Oversold: {sold} units sold out of {stock}, {product.stock} left.")
+        self.stdout.write(self.style.SUCCESS("No oversell."))
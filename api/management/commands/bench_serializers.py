@@ -0,0 +1,78 @@
+import random
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.benchmarking import benchmark_database, bulk_insert, summarize, time_calls
+from api.models import Category, Product, ProductSpecification
+from api.renderers import FastJSONRenderer
+from api.row_serializers import RowSerializer
+from api.serializers import ProductSerializer
+
+PAGE_SIZES = (12, 100, 1000)
+
+
+class Command(BaseCommand):
+    help = (
+        "Renders product list pages through ProductSerializer + JSONRenderer and through "
+        "RowSerializer + FastJSONRenderer in a throwaway database, and fails if the two "
+        "outputs differ by a single byte."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        request = Request(APIRequestFactory().get('/api/products/'))
+        context = {'request': request}
+
+        with benchmark_database():
+            self.build_catalog(rng, max(PAGE_SIZES))
+            products = Product.objects.order_by('pk')
+
+            def serializer_page(size):
+                page = list(products.for_listing()[:size])
+                return JSONRenderer().render(ProductSerializer(page, many=True, context=context).data)
+
+            def row_page(size):
+                rows = RowSerializer(ProductSerializer(context=context), products)
+                return FastJSONRenderer().render(rows.render(rows.values(products)[:size]))
+
+            for size in PAGE_SIZES:
+                if serializer_page(size) != row_page(size):
+                    raise CommandError(f"The outputs differ for a page of {size}.")
+                slow = summarize(time_calls(lambda: serializer_page(size), options['repeat']))
+                fast = summarize(time_calls(lambda: row_page(size), options['repeat']))
+                self.stdout.write(
+                    f"{size:>5} items | serializer p50={slow['p50']:>8.2f}ms p95={slow['p95']:>8.2f}ms | "
+                    f"rows p50={fast['p50']:>8.2f}ms p95={fast['p95']:>8.2f}ms | "
+                    f"{slow['p50'] / fast['p50']:.1f}x"
+                )
+        self.stdout.write(self.style.SUCCESS("Identical output at every page size."))
+
+    def build_catalog(self, rng, count):
+        categories = Category.objects.bulk_create([Category(name=name) for name in ('Laptops', 'Phones', 'Tablets')])
+
+        def products():
+            for i in range(count):
+                price = Decimal(rng.randrange(20_000, 300_000))
+                yield Product(
+                    name=f"Bench product {i}", slug=f"bench-product-{i}", price=price,
+                    original_price=price + 5000 if i % 3 == 0 else None,
+                    category=rng.choice(categories), stock=rng.randrange(0, 50),
+                    is_featured=i % 7 == 0, avg_rating=round(rng.uniform(1, 5), 2), review_count=rng.randrange(0, 500),
+                    custom_attributes={'brand': rng.choice(['HP', 'Dell', 'Lenovo']), 'ram': rng.choice(['8GB', '16GB'])},
+                    image_main=f'products/bench-{i}.jpg' if i % 2 else '',
+                )
+
+        bulk_insert(Product, products())
+        bulk_insert(ProductSpecification, (
+            ProductSpecification(product_id=pk, name=name, value=value)
+            for pk in Product.objects.values_list('pk', flat=True)
+            for name, value in (('RAM', '16GB'), ('CPU', 'i7'), ('Storage', '512GB SSD'))
+        ))
@@ -0,0 +1,111 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connection, connections
+
+from api.benchmarking import benchmark_database, summarize
+from api.checkout import place_order
+from api.models import Category, Product, Wishlist
+
+
+def profiles(vendor):
+    """(name, settings_dict overrides) to compare on this database engine."""
+    if vendor == 'sqlite':
+        return [
+            ('sqlite defaults', {'OPTIONS': {}, 'CONN_MAX_AGE': 0}),
+            ('sqlite tuned', {'OPTIONS': dict(settings.SQLITE_OPTIONS), 'CONN_MAX_AGE': settings.DB_CONN_MAX_AGE}),
+        ]
+    return [
+        ('connection per request', {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False}),
+        ('persistent connections', {'CONN_MAX_AGE': settings.DB_CONN_MAX_AGE or 60, 'CONN_HEALTH_CHECKS': True}),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs --workers threads of concurrent requests (checkouts, wishlist toggles and "
+        "product reads) against a throwaway database once per connection profile: Django's "
+        "defaults and the tuned settings. Reports throughput, latency and failed requests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=50, help="Requests per worker.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        overridden = ('OPTIONS', 'CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')
+        saved = {key: connection.settings_dict[key] for key in overridden if key in connection.settings_dict}
+        with tempfile.TemporaryDirectory() as directory:
+            for index, (name, overrides) in enumerate(profiles(connection.vendor)):
+                connection.settings_dict.update(overrides)
+                # Every worker needs its own connection, so SQLite needs a file
+                path = os.path.join(directory, f'bench_writes_{index}.sqlite3') if connection.vendor == 'sqlite' else None
+                try:
+                    with benchmark_database(path):
+                        self.run_profile(name, options)
+                finally:
+                    for key in overridden:
+                        connection.settings_dict.pop(key, None)
+                    connection.settings_dict.update(saved)
+
+    def run_profile(self, name, options):
+        workers, requests = options['workers'], options['requests']
+        category = Category.objects.create(name='Bench')
+        products = Product.objects.bulk_create([
+            Product(name=f'Bench product {i}', slug=f'bench-product-{i}', price=Decimal('1000'), category=category, stock=10 ** 6)
+            for i in range(50)
+        ])
+        users = get_user_model().objects.bulk_create([get_user_model()(username=f'worker{i}') for i in range(workers)])
+
+        latencies, failures = [], {'locked': 0, 'other': 0}
+        lock = threading.Lock()
+        start = threading.Barrier(workers)
+
+        def work(index, user):
+            rng = random.Random(options['seed'] + index)
+            start.wait()
+            for _ in range(requests):
+                product = rng.choice(products)
+                roll = rng.random()
+                began = time.perf_counter()
+                try:
+                    if roll < 0.2:
+                        place_order(user, [{'product': product.pk, 'quantity': 1}], 'home', 'cash')
+                    elif roll < 0.6:
+                        if not Wishlist.objects.filter(user=user, product=product).delete()[0]:
+                            Wishlist.objects.create(user=user, product=product)
+                    else:
+                        list(Product.objects.for_listing()[:24])
+                    failure = None
+                except DatabaseError as exc:
+                    failure = 'locked' if 'locked' in str(exc) else 'other'
+                finally:
+                    close_old_connections()  # What the end of a request does
+                with lock:
+                    latencies.append((time.perf_counter() - began) * 1000)
+                    if failure:
+                        failures[failure] += 1
+            connections.close_all()
+
+        threads = [threading.Thread(target=work, args=(index, user)) for index, user in enumerate(users)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        timings = summarize(latencies)
+        self.stdout.write(
+            f"{name:<24} | {len(latencies) / elapsed:>7.1f} req/s | p50={timings['p50']:>7.1f}ms "
+            f"p95={timings['p95']:>7.1f}ms p99={timings['p99']:>7.1f}ms | "
+            f"{failures['locked']} locked, {failures['other']} other errors"
+        )
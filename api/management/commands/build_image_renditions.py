@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Q
+
+from api.images import IMAGE_FIELDS, build_renditions, image_models
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds the missing or outdated image renditions of every product, category, "
+        "review and profile image already in the media storage."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', choices=list(IMAGE_FIELDS), help="Only these models (repeatable).")
+        parser.add_argument('--force', action='store_true', help="Rebuild renditions that look current too.")
+        parser.add_argument('--workers', type=int, default=max(settings.IMAGE_RENDITION_WORKERS, 1))
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1.")
+
+        def build(model, pk):
+            try:
+                return build_renditions(model, pk, force=options['force'])
+            finally:
+                connections.close_all()
+
+        for model, fields in image_models():
+            if options['model'] and model._meta.label not in options['model']:
+                continue
+            has_image = Q()
+            for field in fields:
+                has_image |= Q(**{f'{field}__gt': ''})
+            pks = list(model._default_manager.filter(has_image).values_list('pk', flat=True))
+            with ThreadPoolExecutor(options['workers']) as pool:
+                updated = sum(pool.map(lambda pk: build(model, pk), pks))
+            self.stdout.write(self.style.SUCCESS(
+                f"{model._meta.label}: {len(pks)} rows with images, {updated} updated."
+            ))
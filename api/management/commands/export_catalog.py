@@ -0,0 +1,23 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from api.catalog_io import FORMATS, detect_format, export_catalog
+
+
+class Command(BaseCommand):
+    help = "Streams the catalog to a CSV or JSON Lines file (default: stdout), in the import_catalog columns."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-')
+        parser.add_argument('--file-format', choices=FORMATS, help="Defaults to the file extension, then csv.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['file_format'] or detect_format(path)
+        if path == '-':
+            sys.stdout.writelines(export_catalog(file_format))
+            return
+        with open(path, 'w', encoding='utf-8', newline='') as stream:
+            stream.writelines(export_catalog(file_format))
+        self.stdout.write(self.style.SUCCESS(f"Exported the catalog to {path}."))
@@ -0,0 +1,44 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.catalog_io import CHUNK_SIZE, FORMATS, detect_format, import_catalog
+
+
+class Command(BaseCommand):
+    help = (
+        "Upserts products from a CSV or JSON Lines file (or - for stdin), matching "
+        "existing products on sku, then slug. See api.catalog_io for the columns."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--file-format', choices=FORMATS, help="Defaults to the file extension, then csv.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['file_format'] or detect_format(path)
+
+        def progress(result):
+            rate = result['rows'] / result['seconds'] if result['seconds'] else 0
+            self.stdout.write(f"{result['rows']} rows, {rate:.0f} rows/s", ending='\r')
+            self.stdout.flush()
+
+        try:
+            if path == '-':
+                result = import_catalog(sys.stdin, file_format, options['chunk_size'], progress)
+            else:
+                with open(path, encoding='utf-8-sig', newline='') as stream:
+                    result = import_catalog(stream, file_format, options['chunk_size'], progress)
+        except OSError as exc:
+            raise CommandError(exc)
+
+        self.stdout.write('')
+        for error in result['errors']:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        rate = result['rows'] / result['seconds'] if result['seconds'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['rows']} rows in {result['seconds']:.1f}s ({rate:.0f} rows/s): "
+            f"{result['created']} created, {result['updated']} updated, {result['failed']} failed."
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from api.facets import rebuild_attribute_index
+from api.models import AttributeFacet, ProductAttribute
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the product attribute rows and facet counts from Product.custom_attributes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rebuild_attribute_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {ProductAttribute.objects.count()} attributes "
+            f"into {AttributeFacet.objects.count()} facets."
+        ))
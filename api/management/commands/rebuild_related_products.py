@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.recommendations import ORDER_BATCH_SIZE, refresh
+
+
+class Command(BaseCommand):
+    help = (
+        "Adds the orders placed since the last run to the co-purchase counts and rebuilds "
+        "the related products of the products they contain. --rebuild starts over from the "
+        "first order and rebuilds every product, e.g. after a catalog import."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true')
+        parser.add_argument('--batch-size', type=int, default=ORDER_BATCH_SIZE)
+        parser.add_argument('--every', type=float, help="Run again every this many seconds instead of exiting.")
+
+    def handle(self, *args, **options):
+        rebuild = options['rebuild']
+        while True:
+            touched, rebuilt = refresh(rebuild=rebuild, batch_size=options['batch_size'])
+            if rebuilt or not options['every']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Read orders of {touched} products, rebuilt related products of {rebuilt}."
+                ))
+            if not options['every']:
+                return
+            rebuild = False
+            time.sleep(options['every'])
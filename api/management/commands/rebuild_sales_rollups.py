@@ -0,0 +1,19 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from api.analytics import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the daily sales rollups from the orders, e.g. after a data import or "
+        "orders edited in the admin. --since only redoes the days from that date on."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help="YYYY-MM-DD (default: every day).")
+
+    def handle(self, *args, **options):
+        written = rebuild(since=options['since'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} rollup rows."))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the FTS5 full-text search tables for products, categories and FAQs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kinds', nargs='*', help=f"Indexes to rebuild: {', '.join(search.INDEXES)} (default: all).")
+
+    def handle(self, *args, **options):
+        if not search.is_enabled():
+            raise CommandError("Full-text search needs SQLite with FTS5 and the api migrations applied.")
+        kinds = options['kinds'] or list(search.INDEXES)
+        unknown = set(kinds) - set(search.INDEXES)
+        if unknown:
+            raise CommandError(f"Unknown index: {', '.join(sorted(unknown))}")
+        search.rebuild(kinds)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt search index: {', '.join(kinds)}."))
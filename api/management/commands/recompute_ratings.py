@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.ratings import recompute_ratings
+
+
+class Command(BaseCommand):
+    help = "Recomputes Product.avg_rating, review_count and the rating histogram from the reviews."
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_ids', nargs='*', type=int, help="Only these products (default: all).")
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        updated = recompute_ratings(options['product_ids'] or None, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Recomputed ratings for {updated} products."))
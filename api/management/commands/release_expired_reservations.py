@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.inventory import SWEEP_BATCH_SIZE, release_expired
+
+
+class Command(BaseCommand):
+    help = (
+        "Returns the stock of overdue reservations and cancels the pending orders they "
+        "belonged to. Run it from a scheduler, or keep it running with --every."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE)
+        parser.add_argument('--every', type=float, help="Sweep again every this many seconds instead of exiting.")
+
+    def handle(self, *args, **options):
+        while True:
+            expired = release_expired(batch_size=options['batch_size'])
+            if expired or not options['every']:
+                self.stdout.write(self.style.SUCCESS(f"Released {expired} expired reservations."))
+            if not options['every']:
+                return
+            time.sleep(options['every'])
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.models import Product
+from api.seeding import PASSWORD, default_counts, seed
+
+COUNTED = ('categories', 'users', 'reviews', 'orders', 'wishlists', 'transactions')
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills an empty database with a synthetic shop: nested categories, products with "
+        "custom_attributes and specifications, users, reviews, orders, wishlists and M-Pesa "
+        "transactions. The other counts default to proportions of --products, see api.seeding."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        for name in COUNTED:
+            parser.add_argument(f'--{name}', type=int, help=f"Number of {name} (default: scaled to --products).")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--related', action='store_true',
+                            help="Also build the related products (a few queries per product).")
+
+    def handle(self, *args, **options):
+        if Product.objects.exists():
+            raise CommandError("The database already has products, seed an empty one.")
+        counts = default_counts(options['products'])
+        counts.update({name: options[name] for name in COUNTED if options[name] is not None})
+        self.stdout.write(', '.join(f"{count} {name}" for name, count in counts.items()))
+
+        def progress(step, seconds):
+            self.stdout.write(f"{step:<16} {seconds:>7.1f}s")
+
+        with transaction.atomic():
+            seed(counts, seed=options['seed'], related=options['related'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Seeded. Users log in as seed-user-<n> / {PASSWORD}."))
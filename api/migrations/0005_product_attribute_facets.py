@@ -0,0 +1,52 @@
+# Generated by Django 5.1 on 2026-10-16 20:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from api.facets import rebuild_attribute_index
+
+
+def build_attribute_index(apps, schema_editor):
+    rebuild_attribute_index(
+        apps.get_model('api', 'Product'),
+        apps.get_model('api', 'ProductAttribute'),
+        apps.get_model('api', 'AttributeFacet'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_product_image_alt1_product_image_alt2_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttributeFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100)),
+                ('normalized_value', models.CharField(max_length=255)),
+                ('value', models.CharField(max_length=255)),
+                ('product_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('key', 'normalized_value')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductAttribute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100)),
+                ('value', models.CharField(max_length=255)),
+                ('normalized_value', models.CharField(max_length=255)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attributes', to='api.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['key', 'normalized_value', 'product'], name='api_attr_key_value_idx')],
+                'unique_together': {('product', 'key')},
+            },
+        ),
+        migrations.RunPython(build_attribute_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+from api import search
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        if 'ENABLE_FTS5' not in {row[0] for row in cursor.fetchall()}:
+            return
+    search.create_tables(connection)
+    search.rebuild(
+        model_overrides={
+            'product': apps.get_model('api', 'Product'),
+            'category': apps.get_model('api', 'Category'),
+            'faq': apps.get_model('chatbot', 'FAQ'),
+        },
+        using=connection.alias,
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        search.drop_tables(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_product_attribute_facets'),
+        ('chatbot', '0002_chatbotquery_alter_faq_options_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
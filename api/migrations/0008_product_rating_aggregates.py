@@ -0,0 +1,69 @@
+# Generated by Django 5.1 on 2026-10-16 20:59
+
+import django.core.validators
+from django.db import migrations, models
+
+from api.ratings import recompute_ratings
+
+
+def compute_ratings(apps, schema_editor):
+    recompute_ratings(product_model=apps.get_model('api', 'Product'), review_model=apps.get_model('api', 'Review'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='avg_rating',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='rating',
+            field=models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)]),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['avg_rating', 'id'], name='api_product_rating_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['review_count', 'id'], name='api_product_reviews_id_idx'),
+        ),
+        migrations.RunPython(compute_ratings, migrations.RunPython.noop),
+    ]
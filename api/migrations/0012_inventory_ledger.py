@@ -0,0 +1,68 @@
+# Generated by Django 5.1 on 2026-10-16 21:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def record_opening_stock(apps, schema_editor):
+    # Opens the ledger with the current stock, so it sums to Product.stock
+    Product = apps.get_model('api', 'Product')
+    InventoryMovement = apps.get_model('api', 'InventoryMovement')
+    batch = []
+    for product_id, stock in Product.objects.filter(stock__gt=0).values_list('pk', 'stock').iterator(chunk_size=2000):
+        batch.append(InventoryMovement(product_id=product_id, kind='adjustment', stock_change=stock, note='Opening balance'))
+        if len(batch) >= 2000:
+            InventoryMovement.objects.bulk_create(batch)
+            batch = []
+    InventoryMovement.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_image_renditions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reserved_stock',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('active', 'Active'), ('committed', 'Committed'), ('released', 'Released'), ('expired', 'Expired')], default='active', max_length=10)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='api.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='api.product')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'expires_at'], name='api_reservation_expiry_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='InventoryMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('receipt', 'Receipt'), ('adjustment', 'Adjustment'), ('sale', 'Sale'), ('reserve', 'Reserve'), ('commit', 'Commit'), ('release', 'Release'), ('expire', 'Expire')], max_length=10)),
+                ('stock_change', models.IntegerField(default=0)),
+                ('reserved_change', models.IntegerField(default=0)),
+                ('note', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='inventory_movements', to='api.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_movements', to='api.product')),
+                ('reservation', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movements', to='api.stockreservation')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'created_at'], name='api_movement_product_idx')],
+            },
+        ),
+        migrations.RunPython(record_opening_stock, migrations.RunPython.noop),
+    ]
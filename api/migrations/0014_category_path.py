@@ -0,0 +1,30 @@
+# Generated by Django 5.1 on 2026-10-16 22:10
+
+from django.db import migrations, models
+
+from api.category_tree import rebuild_paths
+
+
+def compute_paths(apps, schema_editor):
+    rebuild_paths(category_model=apps.get_model('api', 'Category'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_order_user_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(compute_paths, migrations.RunPython.noop),
+    ]
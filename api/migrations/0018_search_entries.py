@@ -0,0 +1,39 @@
+# Generated by Django 5.1 on 2026-10-17 02:38
+
+import api.search
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_admin_changelist_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategorySearchEntry',
+            fields=[
+                ('category', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='api.category')),
+                ('document', api.search.DocumentField(db_column='api_search_category')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'api_search_category',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSearchEntry',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='api.product')),
+                ('document', api.search.DocumentField(db_column='api_search_product')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'api_search_product',
+                'managed': False,
+            },
+        ),
+    ]
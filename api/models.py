@@ -1,22 +1,132 @@
 ### api/models.py
 
-from django.db import models
+from collections import Counter
+
+from django.db import models, transaction
 from django.conf import settings
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db.models.functions import Coalesce
 from django.utils.text import slugify
 
+from .ratings import RATINGS, histogram_field
+from .search import DocumentField, search_entry_field
+
+class LoadedValuesMixin:
+    """
+    Remembers the `tracked_fields` values a row had in the database, so save
+    signals can tell what changed without re-reading the row.
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values) if name in cls.tracked_fields
+        }
+        return instance
+
+    def get_loaded_value(self, name, default=None):
+        """The value `name` had when loaded (or last saved), `default` for new rows."""
+        return getattr(self, '_loaded_values', {}).get(name, default)
+
+    def load_tracked_values(self, using=None):
+        """Reads the stored values of an existing row that wasn't loaded from the database."""
+        if self.pk is None or hasattr(self, '_loaded_values'):
+            return
+        row = type(self)._default_manager.using(using).filter(pk=self.pk).values(*self.tracked_fields).first()
+        if row is not None:
+            self._loaded_values = row
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {name: getattr(self, name) for name in self.tracked_fields}
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
   
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, blank=True, null=True, related_name='children')
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)  # Built by api.images
+    # Materialized path of ancestor ids, e.g. "/1/5/", maintained by save(), see api.category_tree
+    path = models.CharField(max_length=255, blank=True, editable=False, db_index=True)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
 
     class Meta:
         verbose_name_plural = 'Categories'
 
+    def clean(self):
+        from .category_tree import validate_parent
+
+        validate_parent(self, using=self._state.db)
+
+    def save(self, *args, **kwargs):
+        from .category_tree import move_subtree, validate_parent
+
+        # clean() reports it in forms, this guards the saves that skip it
+        validate_parent(self, using=kwargs.get('using'))
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # The stored path is authoritative, a stale copy must not write its own back
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ('path', 'depth')
+            ]
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            move_subtree(self, using=kwargs.get('using'))
+
     def __str__(self):
         return self.name
 
-class Product(models.Model):
+class ProductQuerySet(models.QuerySet):
+    SLUG_COLLISION_BATCH = 200
+
+    def allocate_slugs(self, names):
+        """
+        Unique slugs for new products named `names`, numbered like "name-1",
+        "name-2" on collision. Collisions are resolved from one prefix lookup
+        instead of probing each candidate.
+        """
+        max_length = self.model._meta.get_field('slug').max_length
+        bases = [slugify(name)[:max_length] or 'product' for name in names]
+        taken = set(self.filter(slug__in=set(bases)).values_list('slug', flat=True))
+        colliding = list(taken | {base for base, count in Counter(bases).items() if count > 1})
+        for start in range(0, len(colliding), self.SLUG_COLLISION_BATCH):
+            # Leaves room for a "-<n>" suffix when the base is truncated
+            prefixes = models.Q()
+            for base in colliding[start:start + self.SLUG_COLLISION_BATCH]:
+                prefixes |= models.Q(slug__startswith=base[:max_length - 8])
+            taken.update(self.filter(prefixes).values_list('slug', flat=True))
+
+        slugs = []
+        for base in bases:
+            slug, counter = base, 1
+            while slug in taken:
+                suffix = f"-{counter}"
+                slug = f"{base[:max_length - len(suffix)]}{suffix}"
+                counter += 1
+            taken.add(slug)
+            slugs.append(slug)
+        return slugs
+
+    def for_listing(self):
+        """Everything ProductSerializer reads, fetched up front."""
+        return self.select_related('category').prefetch_related('specifications')
+
+    def with_latest_reviews(self):
+        """Prefetches the latest reviews ProductDetailSerializer embeds as latest_reviews."""
+        reviews = Review.objects.for_display()[:settings.PRODUCT_DETAIL_REVIEWS]
+        return self.prefetch_related(models.Prefetch('reviews', queryset=reviews, to_attr='latest_reviews'))
+
+    def for_detail(self):
+        """for_listing() plus the latest reviews ProductDetailSerializer embeds."""
+        return self.for_listing().with_latest_reviews()
+
+class Product(LoadedValuesMixin, models.Model):
+    tracked_fields = ('is_new_arrival', 'is_bestseller', 'is_featured', 'stock')
+
+    objects = ProductQuerySet.as_manager()
+
     name = models.CharField(max_length=255)
     slug = models.SlugField(unique=True, blank=True)
     custom_attributes = models.JSONField(default=dict, blank=True, help_text="Dynamic key-value pairs for product features.")
@@ -24,35 +134,119 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     original_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
-    sku = models.CharField(max_length=50, blank=True)
-    stock = models.PositiveIntegerField(default=0)
+    sku = models.CharField(max_length=50, blank=True, db_index=True)  # Import upserts match on it
+    stock = models.PositiveIntegerField(default=0)  # Available to sell, see api.inventory
+    reserved_stock = models.PositiveIntegerField(default=0, editable=False)  # Held by active reservations
     is_new_arrival = models.BooleanField(default=False)
     is_bestseller = models.BooleanField(default=False)
     is_featured = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Review aggregates, maintained by api.ratings (don't edit by hand)
+    avg_rating = models.FloatField(default=0)
+    review_count = models.PositiveIntegerField(default=0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+
     # New image fields: main image and up to 4 alternatives
     image_main = models.ImageField(upload_to='products/images/', blank=True, null=True, help_text="Main product image.")
     image_alt1 = models.ImageField(upload_to='products/images/', blank=True, null=True, help_text="Alternative product image 1.")
     image_alt2 = models.ImageField(upload_to='products/images/', blank=True, null=True, help_text="Alternative product image 2.")
     image_alt3 = models.ImageField(upload_to='products/images/', blank=True, null=True, help_text="Alternative product image 3.")
     image_alt4 = models.ImageField(upload_to='products/images/', blank=True, null=True, help_text="Alternative product image 4.")
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)  # Built by api.images
+
+    class Meta:
+        indexes = [
+            # Keyset pagination seeks on (ordering field, id), see api.pagination
+            models.Index(fields=['price', 'id'], name='api_product_price_id_idx'),
+            models.Index(fields=['name', 'id'], name='api_product_name_id_idx'),
+            models.Index(fields=['created_at', 'id'], name='api_product_created_id_idx'),
+            models.Index(fields=['avg_rating', 'id'], name='api_product_rating_id_idx'),
+            models.Index(fields=['review_count', 'id'], name='api_product_reviews_id_idx'),
+            # The admin changelist's flag filters, newest first
+            models.Index(fields=['is_featured', 'created_at'], name='api_product_featured_idx'),
+            models.Index(fields=['is_bestseller', 'created_at'], name='api_product_bestseller_idx'),
+            models.Index(fields=['is_new_arrival', 'created_at'], name='api_product_new_arrival_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.name)
             # Ensure uniqueness if generated slug already exists
-            original_slug = self.slug
-            counter = 1
-            while Product.objects.filter(slug=self.slug).exclude(pk=self.pk).exists():
-                self.slug = f"{original_slug}-{counter}"
-                counter += 1
+            self.slug = Product.objects.exclude(pk=self.pk).allocate_slugs([self.name])[0]
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # The stock counters and review aggregates are changed by the UPDATEs
+            # of api.inventory and api.ratings, a copy loaded earlier must not
+            # write its stale values back
+            skipped = {'reserved_stock', 'avg_rating', 'review_count', *map(histogram_field, RATINGS)}
+            if self.stock == self.get_loaded_value('stock'):
+                skipped.add('stock')
+            elif hasattr(self, '_loaded_values'):
+                # Overwritten on purpose, re-read it so the ledger records the actual change
+                self._loaded_values['stock'] = Product.objects.using(kwargs.get('using')).filter(
+                    pk=self.pk).values_list('stock', flat=True).first()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in skipped
+            ]
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
+class ProductAttribute(models.Model):
+    """One normalized row per key of Product.custom_attributes, kept in sync by api.signals."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='attributes')
+    key = models.CharField(max_length=100)
+    value = models.CharField(max_length=255)
+    normalized_value = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = ('product', 'key')
+        indexes = [
+            models.Index(fields=['key', 'normalized_value', 'product'], name='api_attr_key_value_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key}: {self.value}"
+
+class AttributeFacet(models.Model):
+    """Catalog-wide product count for each (attribute key, normalized value) pair."""
+    key = models.CharField(max_length=100)
+    normalized_value = models.CharField(max_length=255)
+    value = models.CharField(max_length=255)  # Display label, first spelling seen
+    product_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('key', 'normalized_value')
+
+    def __str__(self):
+        return f"{self.key}: {self.value} ({self.product_count})"
+
+class ProductSearchEntry(models.Model):
+    """A row of the api_search_product FTS5 table, see api.search."""
+    product = search_entry_field(Product)
+    document = DocumentField(db_column='api_search_product')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'api_search_product'
+
+class CategorySearchEntry(models.Model):
+    """A row of the api_search_category FTS5 table, see api.search."""
+    category = search_entry_field(Category)
+    document = DocumentField(db_column='api_search_category')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'api_search_category'
+
 class ProductSpecification(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='specifications')
     name = models.CharField(max_length=100)
@@ -61,24 +255,68 @@ class ProductSpecification(models.Model):
     def __str__(self):
         return f"{self.name}: {self.value}"
 
-class Review(models.Model):
+class ReviewQuerySet(models.QuerySet):
+    def for_display(self):
+        """Newest first, with what ReviewSerializer reads."""
+        return self.select_related('user').prefetch_related('images').order_by('-created_at', '-id')
+
+class Review(LoadedValuesMixin, models.Model):
+    tracked_fields = ('product_id', 'rating')
+
+    objects = ReviewQuerySet.as_manager()
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews')
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    rating = models.PositiveSmallIntegerField()
+    rating = models.PositiveSmallIntegerField(validators=[MinValueValidator(1), MaxValueValidator(5)])
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # The reviews action seeks on (product, sort field, id), see api.pagination
+            models.Index(fields=['product', 'created_at', 'id'], name='api_review_product_recent_idx'),
+            models.Index(fields=['product', 'rating', 'id'], name='api_review_product_rating_idx'),
+            # The admin changelist: date hierarchy and rating filter
+            models.Index(fields=['created_at', 'id'], name='api_review_created_idx'),
+            models.Index(fields=['rating', 'created_at'], name='api_review_rating_created_idx'),
+        ]
+
     def __str__(self):
         return f"Review by {self.user.username} for {self.product.name}"
 
 class ReviewImage(models.Model):
     review = models.ForeignKey(Review, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='reviews/')
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)  # Built by api.images
 
     def __str__(self):
-        return f"Image for review #{self.review.id}"
+        return f"Image for review #{self.review_id}"
+
+class OrderQuerySet(models.QuerySet):
+    def for_history(self):
+        """The items and their products OrderSerializer reads, in two extra queries."""
+        items = OrderItem.objects.select_related('product').order_by('pk')
+        return self.prefetch_related(models.Prefetch('items', queryset=items))
+
+    def with_summary(self):
+        """
+        Annotates item_count (units) and first_image (the image_main name of the
+        first item that has one) with correlated subqueries, for OrderSummarySerializer.
+        """
+        items = OrderItem.objects.filter(order=models.OuterRef('pk'))
+        units = items.order_by().values('order').annotate(units=models.Sum('quantity')).values('units')
+        first_image = items.exclude(product__image_main='').exclude(product__image_main__isnull=True) \
+            .order_by('pk').values('product__image_main')[:1]
+        return self.annotate(
+            item_count=Coalesce(models.Subquery(units), 0),
+            first_image=models.Subquery(first_image),
+        )
+
+class Order(LoadedValuesMixin, models.Model):
+    tracked_fields = ('status',)
+
+    objects = OrderQuerySet.as_manager()
 
-class Order(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Pending'),
         ('processing', 'Processing'),
@@ -105,6 +343,16 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Order history seeks on (user, created_at, id), see api.pagination
+            models.Index(fields=['user', 'created_at', 'id'], name='api_order_user_created_idx'),
+            # The admin changelist: date hierarchy, status and payment method filters
+            models.Index(fields=['created_at', 'id'], name='api_order_created_idx'),
+            models.Index(fields=['status', 'created_at'], name='api_order_status_created_idx'),
+            models.Index(fields=['payment_method', 'created_at'], name='api_order_payment_created_idx'),
+        ]
+
     def __str__(self):
         return f"Order #{self.id} by {self.user.username}"
 
@@ -115,7 +363,7 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)  # Price at the time of purchase
 
     def __str__(self):
-        return f"{self.quantity} x {self.product.name} in Order #{self.order.id}"
+        return f"{self.quantity} x {self.product.name} in Order #{self.order_id}"
 
 class Wishlist(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='wishlist')
@@ -127,3 +375,156 @@ class Wishlist(models.Model):
 
     def __str__(self):
         return f"{self.product.name} in {self.user.username}'s wishlist"
+
+
+class StockReservation(models.Model):
+    """Stock held for a cart or a pending order until it expires, see api.inventory."""
+    ACTIVE = 'active'
+    COMMITTED = 'committed'
+    RELEASED = 'released'
+    EXPIRED = 'expired'
+    STATUS_CHOICES = (
+        (ACTIVE, 'Active'),
+        (COMMITTED, 'Committed'),
+        (RELEASED, 'Released'),
+        (EXPIRED, 'Expired'),
+    )
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, blank=True, null=True, related_name='reservations')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=ACTIVE)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # The expiry sweeper scans active reservations by expiry
+            models.Index(fields=['status', 'expires_at'], name='api_reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} held until {self.expires_at:%Y-%m-%d %H:%M} ({self.status})"
+
+class InventoryMovement(models.Model):
+    """
+    Append-only stock ledger. For every product, stock and reserved_stock are
+    the sums of stock_change and reserved_change.
+    """
+    KIND_CHOICES = (
+        ('receipt', 'Receipt'),
+        ('adjustment', 'Adjustment'),
+        ('sale', 'Sale'),
+        ('reserve', 'Reserve'),
+        ('commit', 'Commit'),
+        ('release', 'Release'),
+        ('expire', 'Expire'),
+    )
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='inventory_movements')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    stock_change = models.IntegerField(default=0)
+    reserved_change = models.IntegerField(default=0)
+    reservation = models.ForeignKey(StockReservation, on_delete=models.SET_NULL, blank=True, null=True, related_name='movements')
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, blank=True, null=True, related_name='inventory_movements')
+    note = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'created_at'], name='api_movement_product_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.stock_change:+d} for {self.product_id}"
+
+class CoPurchase(models.Model):
+    """
+    Orders containing both products, in both directions. The product == other
+    row counts the orders containing the product. See api.recommendations.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='co_purchases')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('product', 'other')
+
+    def __str__(self):
+        return f"{self.product_id} + {self.other_id}: {self.orders} orders"
+
+class RelatedProduct(models.Model):
+    """The top related products of each product, rebuilt by api.recommendations."""
+    BOUGHT_TOGETHER = 'bought_together'
+    SIMILAR = 'similar'
+    SOURCE_CHOICES = (
+        (BOUGHT_TOGETHER, 'Frequently bought together'),
+        (SIMILAR, 'Same category and attributes'),
+    )
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_products')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+
+    class Meta:
+        constraints = [
+            # Also the index the related action reads in rank order
+            models.UniqueConstraint(fields=['product', 'rank'], name='api_related_product_rank_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} #{self.rank}: {self.related_id} ({self.source})"
+
+class IndexCheckpoint(models.Model):
+    """How far an incremental index job has read, e.g. the last order folded into CoPurchase."""
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} at {self.last_id}"
+
+class DailyProductSales(models.Model):
+    """Units, revenue and orders of a product per day, kept up to date by api.analytics."""
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'product')
+
+    def __str__(self):
+        return f"{self.day} {self.product_id}: {self.units} units"
+
+class DailyCategorySales(models.Model):
+    """Units, revenue and orders of a category per day, kept up to date by api.analytics."""
+    day = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'category')
+
+    def __str__(self):
+        return f"{self.day} {self.category_id}: {self.units} units"
+
+class DailyOrderSales(models.Model):
+    """Orders and their totals per day, status and payment method, kept up to date by api.analytics."""
+    day = models.DateField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    payment_method = models.CharField(max_length=10, choices=Order.PAYMENT_METHOD_CHOICES)
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('day', 'status', 'payment_method')
+
+    def __str__(self):
+        return f"{self.day} {self.status}/{self.payment_method}: {self.orders} orders"
@@ -0,0 +1,204 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks with WHERE (field, id) > (value, last_id)
+    instead of OFFSET, so every page costs the same as the first one.
+
+    The sort field comes from ?ordering= (one of `ordering_fields`, with an
+    optional leading '-') and the primary key breaks ties, so the composite
+    index (field, id) serves both the seek and the sort. The total count is
+    included unless the client sends ?count=false.
+
+    Filters that probe each row instead of narrowing the query through an
+    index (see AttributeFilterBackend) mark the request with `scan_in_order`.
+    Without a count to serve, such a page is then read through windows of the
+    ordering index, see fetch_in_windows().
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering_param = api_settings.ORDERING_PARAM
+    mode_query_param = 'pagination'
+    ordering_fields = ('created_at',)
+    default_ordering = '-created_at'
+    invalid_cursor_message = 'Invalid cursor'
+    # Rows of the ordering index in the first window, None reads pages in one query
+    scan_window = None
+
+    @classmethod
+    def is_requested(cls, request):
+        """Where it's opt-in, cursor mode means ?pagination=cursor or any ?cursor= link."""
+        params = request.query_params
+        return params.get(cls.mode_query_param) == 'cursor' or cls.cursor_query_param in params
+
+    def wants_count(self, request):
+        return request.query_params.get(self.count_query_param, '').lower() not in ('0', 'false', 'no')
+
+    def scans_in_order(self, request):
+        """Whether a page of row-probing filters would be read window by window."""
+        return self.scan_window is not None and not self.wants_count(request)
+
+    def get_ordering(self, request):
+        for term in request.query_params.get(self.ordering_param, '').split(','):
+            term = term.strip()
+            if term.lstrip('-') in self.ordering_fields:
+                return term
+        return self.default_ordering
+
+    def encode_cursor(self, values, reverse=False):
+        payload = {'o': self.ordering, 'v': [self.value_to_string(value) for value in values], 'r': int(reverse)}
+        token = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+            if payload['o'] != self.ordering:
+                raise ValueError('ordering changed')
+            values = [field.to_python(value) for field, value in zip(self.fields, payload['v'], strict=True)]
+            return values, bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def value_to_string(value):
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return str(value)
+
+    def seek_filter(self, values, descending):
+        """(f1, f2, ...) > (v1, v2, ...) expanded for the ORM, or < when descending."""
+        condition = Q()
+        for position in reversed(range(len(self.fields))):
+            name = self.field_names[position]
+            lookup = 'lt' if descending[position] else 'gt'
+            strict = Q(**{f'{name}__{lookup}': values[position]})
+            condition = strict if position == len(self.fields) - 1 else strict | (
+                Q(**{name: values[position]}) & condition
+            )
+        # The redundant bound on the leading field lets SQLite range-search the
+        # composite index instead of scanning it from the start.
+        leading = 'lte' if descending[0] else 'gte'
+        return Q(**{f'{self.field_names[0]}__{leading}': values[0]}) & condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = remove_query_param(request.build_absolute_uri(), self.cursor_query_param)
+        self.ordering = self.get_ordering(request)
+
+        model = queryset.model
+        sort_field = self.ordering.lstrip('-')
+        pk_name = model._meta.pk.name
+        self.field_names = [sort_field] if sort_field == pk_name else [sort_field, pk_name]
+        self.fields = [model._meta.get_field(name) for name in self.field_names]
+        descending = [self.ordering.startswith('-')] * len(self.field_names)
+
+        self.count = None
+        if self.wants_count(request):
+            self.count = queryset.order_by().count()
+
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor[1])
+        # Walking backwards flips every direction, the page is re-reversed below
+        scan_descending = [not desc for desc in descending] if reverse else descending
+        queryset = queryset.order_by(*[
+            f"-{name}" if desc else name for name, desc in zip(self.field_names, scan_descending)
+        ])
+        if cursor:
+            queryset = queryset.filter(self.seek_filter(cursor[0], scan_descending))
+
+        if getattr(request, 'scan_in_order', False) and self.scans_in_order(request):
+            rows = self.fetch_in_windows(queryset, scan_descending, cursor[0] if cursor else None)
+        else:
+            rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else cursor is not None
+        self.page = rows
+        return rows
+
+    def fetch_in_windows(self, queryset, descending, after=None):
+        """
+        The first page_size + 1 rows of the ordered `queryset`, filtered one
+        window of the ordering index at a time until the page is full. Left to
+        itself SQLite drives such a query from a filter's index and sorts every
+        match. The first window has scan_window rows, the next ones are sized
+        after the share of rows matched so far (four times as many on none).
+        """
+        index = queryset.model._default_manager.db_manager(queryset.db).order_by(*queryset.query.order_by)
+        size, scanned, rows = self.scan_window, 0, []
+        while len(rows) <= self.page_size:
+            window = index.filter(self.seek_filter(after, descending)) if after else index
+            rows += queryset.filter(pk__in=window.values('pk')[:size])[:self.page_size + 1 - len(rows)]
+            missing = self.page_size + 1 - len(rows)
+            last = list(window.values_list(*self.field_names)[size - 1:size]) if missing > 0 else None
+            if not last:
+                break
+            after, scanned = last[0], scanned + size
+            size = max(self.scan_window, 2 * missing * scanned // len(rows)) if rows else size * 4
+        return rows
+
+    def position(self, obj):
+        if isinstance(obj, dict):  # values() rows, see api.row_serializers
+            return [obj[name] for name in self.field_names]
+        return [getattr(obj, name) for name in self.field_names]
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.position(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.position(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        payload = {'next': self.get_next_link(), 'previous': self.get_previous_link()}
+        if self.count is not None:
+            payload = {'count': self.count, **payload}
+        return Response({**payload, 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer', 'example': 123},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class ReviewCursorPagination(KeysetPagination):
+    ordering_fields = ('created_at', 'rating')
+
+
+class ProductCursorPagination(KeysetPagination):
+    ordering_fields = ('price', 'name', 'created_at', 'avg_rating', 'review_count')
+    scan_window = 1000
+
+
+class OrderCursorPagination(KeysetPagination):
+    ordering_fields = ('created_at',)
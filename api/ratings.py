@@ -0,0 +1,100 @@
+"""
+Denormalized review aggregates on Product: avg_rating, review_count and the
+rating_<n>_count histogram.
+
+api.signals applies every review create/edit/delete as a single UPDATE with
+F() deltas, so concurrent reviews can't lose counts and listings never touch
+the reviews table. The recompute_ratings command rebuilds them in bulk.
+"""
+from collections import Counter
+
+from django.db.models import Case, Count, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast, Round
+from django.db.models.lookups import GreaterThan
+
+RATINGS = range(1, 6)
+
+
+def histogram_field(rating):
+    return f'rating_{rating}_count'
+
+
+def bucket(rating):
+    # Reviews predating the 1-5 validation are clamped into the histogram
+    return min(max(int(rating), RATINGS[0]), RATINGS[-1])
+
+
+def average_expression(counts):
+    """avg_rating computed in SQL from {rating: count expression}."""
+    total = sum(counts.values(), Value(0))
+    weighted = sum((count * rating for rating, count in counts.items()), Value(0))
+    return Case(
+        When(GreaterThan(total, 0), then=Round(Cast(weighted, FloatField()) / Cast(total, FloatField()), 2)),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+
+
+def apply_rating_changes(product_id, added=(), removed=(), using='default'):
+    """Adds and removes individual ratings from a product's aggregates."""
+    from .models import Product
+
+    deltas = Counter()
+    for rating in added:
+        deltas[bucket(rating)] += 1
+    for rating in removed:
+        deltas[bucket(rating)] -= 1
+    deltas = {rating: delta for rating, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    # The right-hand sides all read the pre-update row, so the average is
+    # computed from the new histogram in the same statement.
+    counts = {rating: F(histogram_field(rating)) + deltas.get(rating, 0) for rating in RATINGS}
+    Product.objects.using(using).filter(pk=product_id).update(
+        review_count=F('review_count') + sum(deltas.values()),
+        avg_rating=average_expression(counts),
+        **{histogram_field(rating): counts[rating] for rating in deltas},
+    )
+
+
+def recompute_ratings(product_ids=None, product_model=None, review_model=None, batch_size=2000):
+    """
+    Recomputes the aggregates from the reviews table, for the given products
+    or the whole catalog. Returns the number of products written.
+    """
+    if product_model is None or review_model is None:
+        from .models import Product, Review
+        product_model, review_model = product_model or Product, review_model or Review
+
+    bucket_filters = {
+        RATINGS[0]: Q(rating__lte=RATINGS[0]),
+        RATINGS[-1]: Q(rating__gte=RATINGS[-1]),
+        **{rating: Q(rating=rating) for rating in RATINGS[1:-1]},
+    }
+    fields = ['avg_rating', 'review_count'] + [histogram_field(rating) for rating in RATINGS]
+
+    queryset = product_model.objects.order_by('pk')
+    if product_ids is not None:
+        queryset = queryset.filter(pk__in=product_ids)
+    pks = list(queryset.values_list('pk', flat=True))
+
+    for start in range(0, len(pks), batch_size):
+        batch = pks[start:start + batch_size]
+        histograms = {
+            row.pop('product_id'): row
+            for row in review_model.objects.filter(product_id__in=batch).order_by()
+            .values('product_id')
+            .annotate(**{str(rating): Count('pk', filter=condition) for rating, condition in bucket_filters.items()})
+        }
+        products = []
+        for pk in batch:
+            counts = {rating: histograms.get(pk, {}).get(str(rating), 0) for rating in RATINGS}
+            total = sum(counts.values())
+            product = product_model(pk=pk, review_count=total)
+            product.avg_rating = round(sum(rating * count for rating, count in counts.items()) / total, 2) if total else 0
+            for rating, count in counts.items():
+                setattr(product, histogram_field(rating), count)
+            products.append(product)
+        product_model.objects.bulk_update(products, fields)
+    return len(pks)
@@ -0,0 +1,217 @@
+"""
+"Frequently bought together" and related products, precomputed.
+
+update_co_purchases() folds the orders placed since its last run into
+CoPurchase, the number of orders each pair of products appeared in.
+rebuild_related() turns those counts into the top RELATED_PRODUCTS_LIMIT
+neighbours of each product in RelatedProduct, which the related action of
+ProductViewSet reads with one indexed query:
+
+* bought together: products sharing orders, scored by cosine similarity
+  (orders together / sqrt(orders of a * orders of b)) so that products in
+  every basket don't crowd out the rest,
+* similar: when there aren't enough of those, products of the same category
+  sharing the most custom_attributes (through ProductAttribute), then the
+  category's bestsellers and most reviewed products.
+
+refresh() runs both for the products the new orders touched and the ones
+without neighbours yet; the rebuild_related_products command runs it from a
+scheduler. Orders are read once, by increasing id, after they've settled:
+a pending order can still be cancelled by the reservation sweep, and
+cancelled orders are skipped.
+"""
+import math
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import combinations
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from . import response_cache
+
+CHECKPOINT = 'co_purchases'
+ORDER_BATCH_SIZE = 1000
+REBUILD_BATCH_SIZE = 500
+# Pairs grow with the square of the basket, bulk orders say little anyway
+MAX_BASKET_SIZE = 50
+
+
+def settled_before():
+    """Orders created before this can't be cancelled by the reservation sweep anymore."""
+    return timezone.now() - timedelta(seconds=settings.STOCK_RESERVATION_SECONDS + 60)
+
+
+def _add_co_purchases(pairs):
+    from .models import CoPurchase
+
+    existing = CoPurchase.objects.filter(
+        product_id__in={product for product, _ in pairs},
+        other_id__in={other for _, other in pairs},
+    )
+    updated = []
+    for row in existing:
+        count = pairs.pop((row.product_id, row.other_id), 0)
+        if count:
+            row.orders += count
+            updated.append(row)
+    CoPurchase.objects.bulk_update(updated, ['orders'], batch_size=ORDER_BATCH_SIZE)
+    CoPurchase.objects.bulk_create(
+        [CoPurchase(product_id=product, other_id=other, orders=count) for (product, other), count in pairs.items()],
+        batch_size=ORDER_BATCH_SIZE,
+    )
+
+
+def update_co_purchases(batch_size=ORDER_BATCH_SIZE):
+    """
+    Adds the settled orders placed since the last run to CoPurchase and
+    returns the ids of the products they contain.
+    """
+    from .models import IndexCheckpoint, Order, OrderItem
+
+    touched = set()
+    while True:
+        with transaction.atomic():
+            checkpoint, _ = IndexCheckpoint.objects.select_for_update().get_or_create(name=CHECKPOINT)
+            order_ids = list(
+                Order.objects.filter(pk__gt=checkpoint.last_id, created_at__lt=settled_before())
+                .order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not order_ids:
+                return touched
+
+            baskets = defaultdict(set)
+            items = OrderItem.objects.filter(order_id__in=order_ids).exclude(order__status='cancelled')
+            for order_id, product_id in items.values_list('order_id', 'product_id'):
+                baskets[order_id].add(product_id)
+
+            pairs = Counter()
+            for products in baskets.values():
+                if len(products) > MAX_BASKET_SIZE:
+                    continue
+                touched.update(products)
+                # The diagonal counts the orders of each product
+                pairs.update((product, product) for product in products)
+                for a, b in combinations(products, 2):
+                    pairs[a, b] += 1
+                    pairs[b, a] += 1
+            _add_co_purchases(pairs)
+
+            checkpoint.last_id = order_ids[-1]
+            checkpoint.save(update_fields=['last_id', 'updated_at'])
+
+
+def _bought_together(product_ids):
+    """{product id: [(other id, score), ...] best first} from CoPurchase."""
+    from .models import CoPurchase
+
+    rows = list(CoPurchase.objects.filter(product_id__in=product_ids).values_list('product_id', 'other_id', 'orders'))
+    totals = {product: orders for product, other, orders in rows if product == other}
+    others = {other for _, other, _ in rows} - set(totals)
+    if others:
+        totals.update(
+            CoPurchase.objects.filter(product_id__in=others, other_id=F('product_id')).values_list('product_id', 'orders')
+        )
+
+    neighbours = defaultdict(list)
+    for product, other, orders in rows:
+        if product != other and totals.get(product) and totals.get(other):
+            neighbours[product].append((other, orders / math.sqrt(totals[product] * totals[other])))
+    for scored in neighbours.values():
+        scored.sort(key=lambda item: (-item[1], item[0]))
+    return neighbours
+
+
+def _similar(product_id, category_id, attributes, exclude, limit):
+    """[(product id, share of the attributes in common), ...] in the same category."""
+    from .models import ProductAttribute
+
+    if not attributes:
+        return []
+    matches = Q()
+    for key, value in attributes:
+        matches |= Q(key=key, normalized_value=value)
+    rows = (
+        ProductAttribute.objects.filter(matches, product__category_id=category_id)
+        .exclude(product_id__in=exclude | {product_id})
+        .values('product_id').annotate(shared=Count('id')).order_by('-shared', 'product_id')
+        .values_list('product_id', 'shared')[:limit]
+    )
+    return [(other, shared / len(attributes)) for other, shared in rows]
+
+
+def rebuild_related(product_ids=None, limit=None):
+    """Recomputes the RelatedProduct rows of `product_ids` (all products when None)."""
+    from .models import Product, ProductAttribute, RelatedProduct
+
+    limit = limit or settings.RELATED_PRODUCTS_LIMIT
+    if product_ids is None:
+        product_ids = Product.objects.order_by('pk').values_list('pk', flat=True)
+    product_ids = sorted(product_ids)
+    popular = {}  # category id -> its most popular product ids, for this run
+
+    def category_popular(category_id):
+        if category_id not in popular:
+            popular[category_id] = list(
+                Product.objects.filter(category_id=category_id)
+                .order_by('-is_bestseller', '-review_count', 'pk').values_list('pk', flat=True)[:limit + 1]
+            )
+        return popular[category_id]
+
+    for start in range(0, len(product_ids), REBUILD_BATCH_SIZE):
+        chunk = product_ids[start:start + REBUILD_BATCH_SIZE]
+        categories = dict(Product.objects.filter(pk__in=chunk).values_list('pk', 'category_id'))
+        attributes = defaultdict(list)
+        for product, key, value in ProductAttribute.objects.filter(product_id__in=chunk).values_list(
+                'product_id', 'key', 'normalized_value'):
+            attributes[product].append((key, value))
+        neighbours = _bought_together(chunk)
+
+        rows = []
+        for product, category in categories.items():
+            picked = [(other, score, RelatedProduct.BOUGHT_TOGETHER) for other, score in neighbours[product][:limit]]
+            seen = {other for other, _, _ in picked}
+            if len(picked) < limit:
+                for other, score in _similar(product, category, attributes[product], seen, limit - len(picked)):
+                    picked.append((other, score, RelatedProduct.SIMILAR))
+                    seen.add(other)
+            for other in category_popular(category):
+                if len(picked) >= limit:
+                    break
+                if other != product and other not in seen:
+                    picked.append((other, 0.0, RelatedProduct.SIMILAR))
+                    seen.add(other)
+            rows.extend(
+                RelatedProduct(product_id=product, related_id=other, rank=rank, score=score, source=source)
+                for rank, (other, score, source) in enumerate(picked, start=1)
+            )
+
+        with transaction.atomic():
+            RelatedProduct.objects.filter(product_id__in=chunk).delete()
+            RelatedProduct.objects.bulk_create(rows)
+    return len(product_ids)
+
+
+def refresh(rebuild=False, batch_size=ORDER_BATCH_SIZE):
+    """
+    Reads the new orders and rebuilds the neighbours of the products in them
+    and of the products without any yet; (products touched, products rebuilt).
+    With rebuild=True it starts over from the first order and rebuilds all.
+    """
+    from .models import CoPurchase, IndexCheckpoint, Product
+
+    if rebuild:
+        with transaction.atomic():
+            CoPurchase.objects.all().delete()
+            IndexCheckpoint.objects.filter(name=CHECKPOINT).delete()
+    touched = update_co_purchases(batch_size=batch_size)
+    if rebuild:
+        rebuilt = rebuild_related()
+    else:
+        missing = Product.objects.filter(related_products__isnull=True).values_list('pk', flat=True)
+        rebuilt = rebuild_related(touched | set(missing))
+    if rebuilt:
+        response_cache.invalidate(response_cache.PRODUCT)
+    return len(touched), rebuilt
@@ -0,0 +1,140 @@
+"""
+Catalog reads from a read replica.
+
+With a replica configured (DB_REPLICA_NAME / DB_REPLICA_HOST, see
+settings.REPLICA_DATABASE), the GET and HEAD requests of the catalog views
+(ReplicaReadMixin), and the POSTs they list as read_only_actions, run their
+queries on it. Every write still goes to the primary, and so does
+everything outside those views: checkout, orders, payments, the admin.
+
+A replica lags behind the primary, so a client that just wrote would not
+find its own write there. ReplicaPinMiddleware keeps a client on the
+primary for REPLICA_PIN_SECONDS after any successful write, with a signed
+cookie and, for authenticated users (JWT clients don't keep cookies), a
+flag in the default cache. Use a shared cache when running several
+processes. The response cache follows the same rule: pinned clients skip
+it, and a response read from the replica isn't cached until the writes
+behind it are REPLICA_PIN_SECONDS old (may_be_behind()).
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_COOKIE = 'read_primary_until'
+
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def _pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def _user(request):
+    user = getattr(request, 'user', None)
+    return user if user is not None and user.is_authenticated else None
+
+
+def is_pinned(request):
+    """Whether the client wrote recently enough that the replica may not have it yet."""
+    now = time.time()
+    try:
+        until = float(request.get_signed_cookie(PIN_COOKIE, default=0, salt=PIN_COOKIE))
+    except ValueError:
+        until = 0
+    if until > now:
+        return True
+    user = _user(request)
+    return user is not None and (cache.get(_pin_key(user.pk)) or 0) > now
+
+
+def pin(request, response):
+    """Keeps the client on the primary for the next REPLICA_PIN_SECONDS."""
+    seconds = settings.REPLICA_PIN_SECONDS
+    until = time.time() + seconds
+    response.set_signed_cookie(PIN_COOKIE, str(until), salt=PIN_COOKIE, max_age=seconds, httponly=True, samesite='Lax')
+    user = _user(request)
+    if user is not None:
+        cache.set(_pin_key(user.pk), until, seconds)
+
+
+def replica_for(request):
+    """The alias `request` can read from, None for the primary."""
+    if not settings.REPLICA_DATABASE or is_pinned(request):
+        return None
+    return settings.REPLICA_DATABASE
+
+
+def may_be_behind(request, written_at):
+    """Whether `request` read from a replica that may not have a write made at `written_at` yet."""
+    return getattr(request, 'read_replica', None) is not None and written_at > time.time() - settings.REPLICA_PIN_SECONDS
+
+
+@contextmanager
+def reads_from(alias):
+    """Routes the reads made in the block to `alias` (None: the primary)."""
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """Writes go to the primary, reads too unless a reads_from() block says otherwise."""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # The replica holds the same rows
+
+
+class ReplicaReadMixin:
+    """
+    Runs the reads of a view's GET and HEAD requests against the replica, and
+    those of `read_only_actions` (viewset actions, or 'post' on a plain
+    APIView) that only read whatever their method.
+    """
+    read_only_actions = ()
+
+    def reads_only(self, request):
+        method = request.method.lower()
+        action = self.action_map.get(method) if hasattr(self, 'action_map') else method
+        return request.method in SAFE_METHODS or action in self.read_only_actions
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)  # Authenticates, is_pinned() needs the user
+        if self.reads_only(request):
+            alias = replica_for(request)
+            request._request.reads_only = True  # Nothing to pin, see ReplicaPinMiddleware
+            request._request.read_replica = alias  # See may_be_behind()
+            self._replica_token = _read_alias.set(alias)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            _read_alias.reset(token)
+            self._replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ReplicaPinMiddleware:
+    """Pins clients to the primary after they write, see is_pinned()."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        wrote = request.method not in SAFE_METHODS and not getattr(request, 'reads_only', False)
+        if settings.REPLICA_DATABASE and wrote and response.status_code < 400:
+            pin(request, response)
+        return response
@@ -0,0 +1,183 @@
+"""
+Cached GET responses with ETag / Last-Modified and 304s.
+
+CachedResponseMixin serves repeated GETs of the public catalog endpoints
+from the RESPONSE_CACHE_ALIAS cache, keyed on the normalized URL (scheme,
+host, path and sorted query params) and the Accept header. Each entry
+records the versions of the tags it was built from ('product', 'category',
+...). Saving or deleting a model bumps its tag (api.signals), so any entry
+built from an older version counts as a miss. Writers that bypass the
+signals bump the tags themselves (see catalog_cache.invalidate_cards).
+
+A tag version is the time of its last bump, so the newest version of an
+entry's tags is also its Last-Modified. Clients revalidating with
+If-None-Match or If-Modified-Since get a 304 from the cache without any
+SQL.
+
+The default backend is a LocMemCache per process: an invalidation in one
+worker then reaches the others only after RESPONSE_CACHE_TIMEOUT. Point
+RESPONSE_CACHE_BACKEND / RESPONSE_CACHE_LOCATION at a shared cache (Redis,
+Memcached) to share both the entries and the invalidations.
+
+With a read replica, clients pinned to the primary after a write neither
+read nor fill the cache, and responses read from the replica aren't cached
+while the replica may still miss the last writes to their tags (see
+api.replicas).
+"""
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.exceptions import APIException
+
+from . import replicas
+
+PRODUCT = 'product'
+CATEGORY = 'category'
+REVIEW = 'review'
+SPECIFICATION = 'specification'
+
+# Model label -> the tag its changes bump
+MODEL_TAGS = {
+    'api.Product': PRODUCT,
+    'api.Category': CATEGORY,
+    'api.Review': REVIEW,
+    'api.ReviewImage': REVIEW,
+    'api.ProductSpecification': SPECIFICATION,
+}
+
+CACHED_METHODS = ('GET', 'HEAD')
+
+
+def _cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def _tag_key(tag):
+    return f'response-tag:{tag}'
+
+
+def is_enabled():
+    return settings.RESPONSE_CACHE_TIMEOUT > 0
+
+
+def invalidate(*tags):
+    """Marks every cached response built from these tags as stale."""
+    if tags:
+        _cache().set_many({_tag_key(tag): time.time() for tag in tags}, None)
+
+
+def invalidate_model(model):
+    tag = MODEL_TAGS.get(model._meta.label)
+    if tag:
+        invalidate(tag)
+
+
+def request_key(request):
+    """Cache key for a GET, the same whatever the order of the query params."""
+    params = urlencode(sorted(request.GET.lists()), doseq=True)
+    url = f"{request.scheme}://{request.get_host()}{request.path}?{params}"
+    raw = f"{url}\n{request.META.get('HTTP_ACCEPT', '')}"
+    return f'response:{hashlib.md5(raw.encode()).hexdigest()}'
+
+
+def lookup(key, tags):
+    """(the cached entry or None when missing or stale, the current tag versions)."""
+    cache = _cache()
+    found = cache.get_many([key, *[_tag_key(tag) for tag in tags]])
+    versions = {tag: found.get(_tag_key(tag)) for tag in tags}
+    missing = [tag for tag, version in versions.items() if version is None]
+    if missing:  # First use or evicted, any fresh value invalidates
+        now = time.time()
+        cache.set_many({_tag_key(tag): now for tag in missing}, None)
+        versions.update(dict.fromkeys(missing, now))
+    entry = found.get(key)
+    if entry is not None and entry['versions'] != versions:
+        entry = None
+    return entry, versions
+
+
+def _validators(entry, response):
+    response['ETag'] = entry['etag']
+    response['Last-Modified'] = http_date(entry['last_modified'])
+    response['Cache-Control'] = 'no-cache'  # Clients may keep it, but must revalidate
+
+
+def store(key, versions, response):
+    """Caches a rendered response and returns the entry, None when it can't be shared."""
+    if response.status_code != 200 or response.streaming or response.cookies \
+            or getattr(getattr(response, 'accepted_renderer', None), 'format', None) != 'json':
+        return None
+    entry = {
+        'versions': versions,
+        'content': response.content,
+        'etag': quote_etag(hashlib.md5(response.content).hexdigest()),
+        'last_modified': int(max(versions.values(), default=time.time())),
+    }
+    _validators(entry, response)
+    entry['headers'] = dict(response.items())
+    _cache().set(key, entry, settings.RESPONSE_CACHE_TIMEOUT)
+    return entry
+
+
+def replay(request, entry):
+    response = HttpResponse(entry['content'])
+    for header, value in entry['headers'].items():
+        response[header] = value
+    return get_conditional_response(request, etag=entry['etag'], last_modified=entry['last_modified'], response=response)
+
+
+def serve(request, tags, render):
+    """The cached response for `request`, or render()'s one, cached once rendered."""
+    key = request_key(request)
+    entry, versions = lookup(key, tags)
+    if entry is not None:
+        return replay(request, entry)
+
+    response = render()
+
+    def cache_rendered(response):
+        if replicas.may_be_behind(request, max(versions.values(), default=0)):
+            return
+        entry = store(key, versions, response)
+        if entry is not None:
+            return get_conditional_response(
+                request, etag=entry['etag'], last_modified=entry['last_modified'], response=response,
+            )
+
+    if hasattr(response, 'add_post_render_callback'):
+        response.add_post_render_callback(cache_rendered)
+    return response
+
+
+class CachedResponseMixin:
+    """
+    Serves GET and HEAD of `cached_actions` (viewset actions, or 'get' on a
+    plain APIView) from the response cache, invalidated by `cache_tags`.
+    """
+    cached_actions = ('list', 'retrieve')
+    cache_tags = ()
+
+    def dispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        action = self.action_map.get(method) if hasattr(self, 'action_map') else method
+        if request.method not in CACHED_METHODS or action not in self.cached_actions or not is_enabled() \
+                or self.reads_own_writes(request, *args, **kwargs):
+            return super().dispatch(request, *args, **kwargs)
+        dispatch = super().dispatch
+        return serve(request, self.cache_tags, lambda: dispatch(request, *args, **kwargs))
+
+    def reads_own_writes(self, request, *args, **kwargs):
+        """Whether the client is pinned to the primary, which the cache may be behind."""
+        if not settings.REPLICA_DATABASE:
+            return False
+        try:
+            # Authenticates like dispatch() will, JWT users are pinned by the cache flag
+            return replicas.is_pinned(self.initialize_request(request, *args, **kwargs))
+        except APIException:  # Bad credentials, left for dispatch() to report
+            return True
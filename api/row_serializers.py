@@ -0,0 +1,253 @@
+"""
+A fast read path for list endpoints.
+
+Rendering a page through ModelSerializer builds a model instance per row
+and then walks every field through get_attribute(), the None and SkipField
+checks and a to_representation() call. RowSerializer compiles the
+serializer once per request into one extractor per field over values()
+rows: forward relations are joined into the same query, reverse ones cost
+one values() query each, the way prefetch_related would.
+
+The output is the same, byte for byte once rendered, as the serializer it
+was compiled from; the tests and the bench_serializers command compare the
+two. A serializer it can't reproduce exactly raises Unsupported while
+compiling and RowListMixin falls back to the serializer:
+
+* plain fields convert the values() value the way the DRF field would,
+* file fields build the URL from the stored name,
+* method and source='*' fields need their columns in Meta.field_dependencies
+  (or the field's sparse_dependencies(), see api.fieldsets) and a
+  row_<name>(*values) method on the serializer, row_representation() on
+  the field.
+"""
+from django.conf import settings
+from rest_framework import relations, serializers
+from rest_framework.fields import empty
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .fieldsets import relation_chain
+from .renderers import FastJSONRenderer
+
+SKIP = object()  # Left out of the row, like a field raising SkipField
+
+# to_representation() returns values() values of these unchanged
+IDENTITY_FIELDS = (
+    serializers.CharField, serializers.BooleanField, serializers.ReadOnlyField,
+    serializers.ChoiceField, serializers.JSONField,
+)
+CONVERTERS = {serializers.IntegerField: int, serializers.FloatField: float}
+
+
+class Unsupported(Exception):
+    """The serializer has a field RowSerializer can't reproduce exactly."""
+
+
+class ReverseRelation:
+    """A many=True nested serializer over a reverse foreign key, loaded per page."""
+
+    def __init__(self, key, related, child):
+        self.key = key  # Column of the parent row the children point at
+        self.link = related.field.attname
+        self.manager = related.related_model._default_manager
+        self.ordering = related.related_model._meta.ordering or ['pk']
+        self.rows = child
+        self.rows.column(self.link)
+        self.groups = {}
+
+    def load(self, parent_rows):
+        keys = {row[self.key] for row in parent_rows} - {None}
+        self.groups = {}
+        if not keys:
+            return
+        queryset = self.manager.filter(**{f'{self.link}__in': keys}).order_by(*self.ordering)
+        rows = list(self.rows.values(queryset))
+        for row, data in zip(rows, self.rows.render(rows)):
+            self.groups.setdefault(row[self.link], []).append(data)
+
+    def extract(self, row):
+        return self.groups.get(row[self.key], [])
+
+
+class RowSerializer:
+    """`serializer` compiled into extractors over values() rows of `queryset`."""
+
+    def __init__(self, serializer, queryset=None, model=None, prefix='', root=None):
+        if isinstance(serializer, serializers.ListSerializer):
+            serializer = serializer.child
+        self.model = model or serializer.Meta.model
+        self.prefix = prefix
+        self.root = root or self
+        if root is None:
+            self.columns = {}  # Ordered set of values() paths
+            self.relations = []
+            self.annotations = set(queryset.query.annotations) if queryset is not None else set()
+        self.skippable = False
+        self.fields = [(field.field_name, self.compile(serializer, field)) for field in serializer._readable_fields]
+
+    def column(self, path):
+        path = self.prefix + path
+        self.root.columns[path] = None
+        return path
+
+    def compile(self, serializer, field):
+        if field.source == '*':
+            return self.compile_computed(serializer, field)
+
+        path = '__'.join(field.source_attrs)
+        chain = relation_chain(self.model, path)
+        if len(chain) != len(field.source_attrs) and (self.prefix or path not in self.root.annotations):
+            raise Unsupported(f"{field.field_name}: {field.source} isn't a column")
+
+        if isinstance(field, serializers.ListSerializer):
+            related = chain[-1] if chain else None
+            if len(chain) != 1 or not related.one_to_many:
+                raise Unsupported(f"{field.field_name}: only reverse foreign keys can be nested with many=True")
+            key = self.column(related.field.target_field.attname)
+            relation = ReverseRelation(key, related, RowSerializer(field.child, model=related.related_model))
+            self.root.relations.append(relation)
+            return relation.extract
+
+        if isinstance(field, serializers.BaseSerializer):
+            if not chain or not chain[-1].is_relation or not chain[-1].concrete or chain[-1].many_to_many:
+                raise Unsupported(f"{field.field_name}: only forward relations can be nested")
+            key = self.column(path)
+            nested = RowSerializer(field, model=chain[-1].related_model, prefix=f'{self.prefix}{path}__', root=self.root)
+            return lambda row: None if row[key] is None else nested.render_row(row)
+
+        column = self.column(path)
+        convert = self.converter(field, chain[-1] if chain else None)
+        guards = self.guards(field, path, chain)
+        if guards:
+            def extract(row):
+                for guard_column, missing in guards:
+                    if row[guard_column] is None:
+                        return missing
+                value = row[column]
+                return None if value is None else convert(value)
+            return extract
+        if convert is None:
+            return lambda row: row[column]
+        return lambda row: None if row[column] is None else convert(row[column])
+
+    def guards(self, field, path, chain):
+        """
+        (column, result) for each nullable relation the source goes through:
+        DRF returns None past a missing reverse one-to-one and otherwise skips
+        the field (or uses its default).
+        """
+        guards = []
+        for depth, relation in enumerate(chain[:-1], start=1):
+            if not relation.null and relation.concrete:
+                continue
+            column = self.column('__'.join(field.source_attrs[:depth]))
+            if not relation.concrete:
+                guards.append((column, None))
+            elif field.default is not empty:
+                raise Unsupported(f"{field.field_name}: defaults aren't supported")
+            elif field.allow_null:
+                guards.append((column, None))
+            elif not field.required:
+                self.skippable = True
+                guards.append((column, SKIP))
+            else:
+                raise Unsupported(f"{field.field_name}: {field.source} can be missing")
+        return guards
+
+    def converter(self, field, model_field):
+        """Function turning a non-None values() value into field.to_representation(), None for as is."""
+        if isinstance(field, serializers.FileField):
+            return self.file_url(field, model_field)
+        if isinstance(field, relations.ManyRelatedField):
+            raise Unsupported(f"{field.field_name}: many related fields aren't supported")
+        if isinstance(field, relations.RelatedField):
+            if isinstance(field, relations.PrimaryKeyRelatedField) and field.pk_field is None:
+                return None
+            raise Unsupported(f"{field.field_name}: only primary key relations are supported")
+        if isinstance(field, serializers.MultipleChoiceField) or (
+                isinstance(field, serializers.JSONField) and field.binary):
+            return field.to_representation
+        if isinstance(field, IDENTITY_FIELDS):
+            return None
+        return CONVERTERS.get(type(field), field.to_representation)
+
+    def file_url(self, field, model_field):
+        if model_field is None or not hasattr(model_field, 'storage'):
+            raise Unsupported(f"{field.field_name}: {field.source} isn't a file column")
+        storage = model_field.storage
+        request = field.context.get('request')
+        if not getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+            return lambda name: name or None
+        if request is None:
+            return lambda name: storage.url(name) if name else None
+        build_absolute_uri = request.build_absolute_uri
+        return lambda name: build_absolute_uri(storage.url(name)) if name else None
+
+    def compile_computed(self, serializer, field):
+        dependencies = getattr(getattr(serializer, 'Meta', None), 'field_dependencies', {})
+        if field.field_name in dependencies:
+            paths = dependencies[field.field_name]
+        elif hasattr(field, 'sparse_dependencies'):
+            paths = field.sparse_dependencies(self.model)
+        else:
+            raise Unsupported(f"{field.field_name}: no field_dependencies")
+        if isinstance(field, serializers.SerializerMethodField):
+            method = getattr(serializer, f'row_{field.field_name}', None)
+        else:
+            method = getattr(field, 'row_representation', None)
+        if method is None:
+            raise Unsupported(f"{field.field_name}: no row method")
+        columns = [self.column(path) for path in paths]
+        return lambda row: method(*[row[column] for column in columns])
+
+    def render_row(self, row):
+        if self.skippable:
+            data = {}
+            for name, extract in self.fields:
+                value = extract(row)
+                if value is not SKIP:
+                    data[name] = value
+            return data
+        return {name: extract(row) for name, extract in self.fields}
+
+    def values(self, queryset, extra=()):
+        """`queryset` as the values() rows render() needs, plus the `extra` columns."""
+        return queryset.prefetch_related(None).values(*self.columns, *[name for name in extra if name not in self.columns])
+
+    def render(self, rows):
+        rows = list(rows)
+        for relation in self.relations:
+            relation.load(rows)
+        return [self.render_row(row) for row in rows]
+
+
+class RowListMixin:
+    """Serves list() through RowSerializer whenever it can compile the serializer."""
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def get_row_serializer(self, queryset):
+        if not settings.FAST_READ_PATH:
+            return None
+        try:
+            return RowSerializer(self.get_serializer(), queryset)
+        except Unsupported:
+            return None
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        row_serializer = self.get_row_serializer(queryset)
+        if row_serializer is not None:
+            # The paginator reads the sort columns of the last row for its cursor
+            extra = [queryset.model._meta.pk.name, *(getattr(self.paginator, 'ordering_fields', None) or ())]
+            queryset = row_serializer.values(queryset, extra)
+
+        page = self.paginate_queryset(queryset)
+        items = queryset if page is None else page
+        if row_serializer is not None:
+            data = row_serializer.render(items)
+        else:
+            data = self.get_serializer(items, many=True).data
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
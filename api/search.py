@@ -0,0 +1,246 @@
+"""
+Full-text search over products, categories and FAQs.
+
+On SQLite every kind of document lives in its own FTS5 virtual table whose
+rowid is the primary key of the source row. The tables are kept in sync by
+api.signals and chatbot.signals and can be rebuilt with the
+rebuild_search_index command. Querysets join them through unmanaged entry
+models (api.models.ProductSearchEntry and friends). On other databases (or an
+SQLite build without FTS5) callers fall back to their icontains lookups.
+"""
+import re
+
+from django.apps import apps
+from django.db import connections, models, transaction
+from django.db.models import F, Value
+
+# kind -> (table, model label, indexed columns). Column order matters, the
+# BM25 weights below follow it.
+INDEXES = {
+    'product': ('api_search_product', 'api.Product', ['name', 'sku', 'category', 'attributes', 'description']),
+    'category': ('api_search_category', 'api.Category', ['name']),
+    'faq': ('api_search_faq', 'chatbot.FAQ', ['question', 'category', 'answer']),
+}
+
+WEIGHTS = {
+    'product': [10.0, 6.0, 3.0, 2.0, 1.0],
+    'category': [1.0],
+    'faq': [5.0, 2.0, 1.0],
+}
+
+STOPWORDS = {
+    'a', 'an', 'and', 'any', 'are', 'at', 'be', 'can', 'do', 'does', 'for', 'from', 'have',
+    'how', 'i', 'in', 'is', 'it', 'me', 'much', 'my', 'of', 'on', 'or', 'please', 'show',
+    'the', 'there', 'this', 'to', 'what', 'which', 'with', 'you', 'your',
+}
+
+BATCH_SIZE = 1000
+
+# Indexed models reach their unmanaged entry model (see search_entry_field)
+# through this reverse one-to-one name.
+ENTRY_RELATION = 'search_entry'
+
+_enabled = {}
+
+
+def is_enabled(using='default'):
+    """True when the FTS5 tables exist on this database."""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    cache_key = (using, str(connection.settings_dict['NAME']))
+    if cache_key not in _enabled:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = %s",
+                [INDEXES['product'][0]],
+            )
+            _enabled[cache_key] = cursor.fetchone()[0] == 1
+    return _enabled[cache_key]
+
+
+class DocumentField(models.TextField):
+    """
+    The hidden column an FTS5 table has under its own name, which is what
+    MATCH is applied to: entry models declare it with db_column=<table>.
+    """
+
+
+@DocumentField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+def search_entry_field(model):
+    """
+    The primary key of an unmanaged model over an FTS5 table: a one-to-one to
+    the indexed `model` on the table's rowid, so querysets of `model` can join
+    it as `search_entry`. Nothing is cascaded, the signals keep the rows.
+    """
+    return models.OneToOneField(
+        model, primary_key=True, db_column='rowid', on_delete=models.DO_NOTHING,
+        db_constraint=False, related_name=ENTRY_RELATION,
+    )
+
+
+def create_tables(connection):
+    """Creates the FTS5 tables. Used by the api migrations."""
+    with connection.cursor() as cursor:
+        for kind, (table, _, columns) in INDEXES.items():
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+                f"{', '.join(columns)}, tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')"
+            )
+            # Persist the column weights so ORDER BY rank is a weighted BM25
+            weights = ', '.join(str(weight) for weight in WEIGHTS[kind])
+            cursor.execute(f"INSERT INTO {table}({table}, rank) VALUES ('rank', 'bm25({weights})')")
+    _enabled.clear()
+
+
+def drop_tables(connection):
+    with connection.cursor() as cursor:
+        for table, _, _ in INDEXES.values():
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    _enabled.clear()
+
+
+def build_match(query, match_all=True):
+    """
+    Turns free text into an FTS5 MATCH expression, or None when nothing is
+    searchable. Every word is quoted (so user input can't inject FTS syntax)
+    and prefix-matched. match_all=False ORs the words and drops stopwords,
+    which suits natural-language questions ranked by BM25.
+    """
+    words = re.findall(r'\w+', query.lower())
+    if not match_all:
+        words = [word for word in words if word not in STOPWORDS]
+    terms = []
+    for word in dict.fromkeys(words):
+        terms.append(f'"{word}"*' if len(word) > 1 else f'"{word}"')
+    if not terms:
+        return None
+    return (' AND ' if match_all else ' OR ').join(terms)
+
+
+def _documents(kind, pks=None, model=None, using='default'):
+    """Yields (pk, column values) for the given kind, read in batches."""
+    model = model or apps.get_model(INDEXES[kind][1])
+    queryset = model.objects.using(using).order_by()
+    if pks is not None:
+        queryset = queryset.filter(pk__in=pks)
+
+    if kind == 'product':
+        rows = queryset.values_list('pk', 'name', 'sku', 'category__name', 'custom_attributes', 'description')
+        for pk, name, sku, category, custom_attributes, description in rows.iterator(chunk_size=BATCH_SIZE):
+            attributes = ''
+            if isinstance(custom_attributes, dict):
+                attributes = ' '.join(str(value) for value in custom_attributes.values() if value is not None)
+            yield pk, [name, sku, category or '', attributes, description]
+    elif kind == 'category':
+        for pk, name in queryset.values_list('pk', 'name').iterator(chunk_size=BATCH_SIZE):
+            yield pk, [name]
+    else:
+        rows = queryset.values_list('pk', 'question', 'category', 'answer')
+        for pk, question, category, answer in rows.iterator(chunk_size=BATCH_SIZE):
+            yield pk, [question, category or '', answer]
+
+
+def _write(kind, documents, using='default'):
+    table, _, columns = INDEXES[kind]
+    placeholders = ', '.join(['%s'] * (len(columns) + 1))
+    insert = f"INSERT INTO {table} (rowid, {', '.join(columns)}) VALUES ({placeholders})"
+    with connections[using].cursor() as cursor:
+        batch = []
+        for pk, values in documents:
+            batch.append([pk, *values])
+            if len(batch) >= BATCH_SIZE:
+                cursor.executemany(insert, batch)
+                batch = []
+        if batch:
+            cursor.executemany(insert, batch)
+
+
+def remove(kind, pks, using='default'):
+    if not pks or not is_enabled(using):
+        return
+    table = INDEXES[kind][0]
+    with connections[using].cursor() as cursor:
+        for start in range(0, len(pks), BATCH_SIZE):
+            chunk = list(pks[start:start + BATCH_SIZE])
+            cursor.execute(
+                f"DELETE FROM {table} WHERE rowid IN ({', '.join(['%s'] * len(chunk))})", chunk,
+            )
+
+
+def index(kind, pks, using='default'):
+    """(Re)indexes the given rows from their current database state."""
+    pks = list(pks)
+    if not pks or not is_enabled(using):
+        return
+    with transaction.atomic(using=using):
+        remove(kind, pks, using)
+        _write(kind, _documents(kind, pks, using=using), using)
+
+
+def indexed_values(kind, pk, using='default'):
+    """The column values currently stored for a row, or None."""
+    table, _, columns = INDEXES[kind]
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE rowid = %s", [pk])
+        row = cursor.fetchone()
+    return dict(zip(columns, row)) if row else None
+
+
+def rebuild(kinds=None, model_overrides=None, using='default'):
+    """Empties and refills the given indexes (all by default)."""
+    if not is_enabled(using):
+        return
+    model_overrides = model_overrides or {}
+    with transaction.atomic(using=using):
+        for kind in kinds or INDEXES:
+            table = INDEXES[kind][0]
+            with connections[using].cursor() as cursor:
+                cursor.execute(f"DELETE FROM {table}")
+            _write(kind, _documents(kind, model=model_overrides.get(kind), using=using), using)
+            with connections[using].cursor() as cursor:
+                cursor.execute(f"INSERT INTO {table}({table}) VALUES ('optimize')")
+
+
+def filter_queryset(queryset, kind, query, match_all=True, rank=True):
+    """
+    Restricts a queryset of the indexed model to full-text matches. With
+    rank=True it is annotated with `search_rank` (weighted BM25, lower is
+    better). Returns queryset.none() for queries without searchable words.
+    """
+    match = build_match(query, match_all)
+    if match is None:
+        # Still annotated, callers order by search_rank
+        return (queryset.annotate(search_rank=Value(0.0)) if rank else queryset).none()
+
+    # The FTS table is joined once through the entry model, a rank subquery
+    # per row would rerun the whole MATCH for each match.
+    queryset = queryset.filter(**{f'{ENTRY_RELATION}__document__match': match})
+    if rank:
+        queryset = queryset.annotate(search_rank=F(f'{ENTRY_RELATION}__rank'))
+    return queryset
+
+
+def snippets(kind, query, pks, match_all=True, using='default'):
+    """{pk: highlighted excerpt} for the given matching rows."""
+    match = build_match(query, match_all)
+    pks = list(pks)
+    if match is None or not pks or not is_enabled(using):
+        return {}
+    table = INDEXES[kind][0]
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, snippet({table}, -1, '<mark>', '</mark>', '…', 16) FROM {table} "
+            f"WHERE {table} MATCH %s AND rowid IN ({', '.join(['%s'] * len(pks))})",
+            [match, *pks],
+        )
+        return dict(cursor.fetchall())
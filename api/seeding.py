@@ -0,0 +1,298 @@
+"""
+Synthetic data at production volume, for load tests and the bench_api command.
+
+seed() fills the database with a nested category tree, products with
+custom_attributes and specifications, users, reviews, orders, wishlists and
+M-Pesa transactions, all drawn from a seeded random generator so the same
+counts and seed always give the same rows. Popularity is skewed the way
+real traffic is: a few products collect most of the reviews and orders.
+Orders, reviews and products are spread over the last DAYS days.
+
+Rows are written with bulk_create, which skips the save signals, so the
+category paths are rebuilt once the tree is in, and the other derived
+tables (attribute facets, the search index, sales rollups, co-purchases) in
+one pass at the end, then the caches dropped. The ratings are drawn before
+the products so these are written with their review aggregates, which is
+much faster than recompute_ratings afterwards. RelatedProduct is left to the
+rebuild_related_products command unless related=True: it runs a few
+queries per product.
+"""
+import random
+import string
+from array import array
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+
+from .benchmarking import bulk_insert
+from .ratings import RATINGS, histogram_field
+
+DAYS = 365
+BATCH_SIZE = 5000
+PASSWORD = 'seed-password'  # Every seeded user's, for load tests that log in
+
+DEPARTMENTS = [
+    'Laptops', 'Phones', 'Tablets', 'Audio', 'Cameras', 'Gaming',
+    'Accessories', 'Networking', 'Storage', 'Wearables', 'Monitors', 'Printers',
+]
+QUALIFIERS = ['Budget', 'Premium', 'Business', 'Gaming', 'Refurbished', 'Kids', 'Pro', 'Outdoor', 'Compact', 'Smart']
+BRANDS = ['Lenovo', 'HP', 'Dell', 'Apple', 'Asus', 'Acer', 'MSI', 'Microsoft', 'Samsung', 'Xiaomi', 'Tecno', 'Infinix']
+RAM = ['2GB', '4GB', '8GB', '16GB', '32GB', '64GB']
+STORAGE = ['64GB', '128GB SSD', '256GB SSD', '512GB SSD', '1TB SSD', '2TB SSD', '1TB HDD']
+TYPES = ['Ultrabook', 'Gaming', 'Business', 'Convertible', 'Chromebook', 'Flagship', 'Mid-range', 'Entry']
+PROCESSORS = [f"Intel Core i{tier} - {gen}" for tier in (3, 5, 7, 9) for gen in ('1135G7', '1255U', '13620H')] + [
+    'AMD Ryzen 5 7530U', 'AMD Ryzen 7 7840HS', 'Apple M2', 'Apple M3', 'Snapdragon 8 Gen 2', 'MediaTek Helio G99',
+]
+COLORS = ['Black', 'Silver', 'Space Grey', 'Blue', 'White', 'Gold', 'Green']
+DISPLAYS = ['6.1"', '6.7"', '11"', '13.3"', '14"', '15.6"', '16"', '17.3"', '24"', '27"']
+COMMENTS = [
+    "Works as described, fast delivery.",
+    "Great value for the price.",
+    "Battery life could be better.",
+    "Exactly what I needed for work.",
+    "Stopped working after a month, had to return it.",
+    "Solid build quality and a bright screen.",
+    "A bit heavy but very powerful.",
+    "Would buy again from this shop.",
+]
+RATING_WEIGHTS = [5, 7, 15, 33, 40]  # 1 to 5 stars
+ORDER_STATUSES = (['delivered', 'shipped', 'processing', 'pending', 'cancelled'], [60, 10, 10, 8, 12])
+PAYMENT_STATUSES = (['paid', 'failed', 'processing'], [80, 12, 8])
+
+
+def default_counts(products):
+    """Row counts proportional to `products`, about what the production shop has per product."""
+    users = max(20, products // 10)
+    orders = max(20, products // 4)
+    return {
+        'categories': min(500, max(12, products // 2000)),
+        'products': products,
+        'users': users,
+        'reviews': products,
+        'orders': orders,
+        'wishlists': users * 3,
+        'transactions': orders // 2,
+    }
+
+
+def _skewed(rng, count):
+    """An index below `count`, low ones far more often: a few bestsellers, a long tail."""
+    return int(count * rng.random() ** 3)
+
+
+def _spread(model, pks, days=DAYS):
+    """Backdates created_at of the rows `pks` (in creation order) over the last `days` days."""
+    if not pks:
+        return
+    now = timezone.now()
+    chunk = -(-len(pks) // days)  # Rows per day, rounded up
+    for offset, start in enumerate(range(0, len(pks), chunk)):
+        rows = pks[start:start + chunk]
+        when = now - timedelta(days=days - offset, hours=12)
+        model.objects.filter(pk__gte=rows[0], pk__lte=rows[-1]).update(created_at=when)
+
+
+def _categories(rng, count):
+    from .category_tree import rebuild_paths
+    from .models import Category
+
+    roots = Category.objects.bulk_create([Category(name=name) for name in DEPARTMENTS[:count]])
+    levels, remaining = [roots], count - len(roots)
+    # The rest split over two more levels: department > kind > kind
+    for size in (remaining - remaining // 2, remaining // 2):
+        parents = levels[-1]
+        if not size:
+            break
+        children = []
+        for _ in range(size):
+            parent = rng.choice(parents)
+            children.append(Category(name=f"{rng.choice(QUALIFIERS)} {parent.name}"[:100], parent=parent))
+        levels.append(Category.objects.bulk_create(children))
+    rebuild_paths()
+    return [category.pk for level in levels for category in level]
+
+
+def _ratings(rng, count, products):
+    """(product index, stars) of `count` reviews, as two compact arrays."""
+    indexes, stars = array('L'), array('B')
+    for _ in range(count):
+        indexes.append(_skewed(rng, products))
+        stars.append(rng.choices(RATINGS, RATING_WEIGHTS)[0])
+    return indexes, stars
+
+
+def _products(rng, count, category_ids, ratings):
+    from .models import Product, ProductSpecification
+
+    histograms = {rating: array('L', bytes(array('L').itemsize * count)) for rating in RATINGS}
+    for index, rating in zip(*ratings):
+        histograms[rating][index] += 1
+
+    def products():
+        for i in range(count):
+            brand, kind = rng.choice(BRANDS), rng.choice(TYPES)
+            price = Decimal(rng.randrange(2_000, 400_000))
+            attributes = {
+                'brand': brand, 'type': kind, 'ram': rng.choice(RAM),
+                'storage': rng.choice(STORAGE), 'processor': rng.choice(PROCESSORS),
+            }
+            if i % 3 == 0:
+                attributes['color'] = rng.choice(COLORS)
+            counts = {rating: histograms[rating][i] for rating in RATINGS}
+            total = sum(counts.values())
+            yield Product(
+                name=f"{brand} {kind} {i}", slug=f"{brand}-{kind}-{i}".lower().replace(' ', '-'), sku=f"SEED{i:08d}",
+                description=f"{brand} {kind} with {attributes['ram']} RAM and {attributes['storage']} storage.",
+                price=price, original_price=price + Decimal(rng.randrange(500, 20_000)) if i % 4 == 0 else None,
+                category_id=rng.choice(category_ids), stock=0 if i % 20 == 0 else rng.randrange(1, 200),
+                is_featured=i % 50 == 0, is_bestseller=i % 33 == 0, is_new_arrival=i % 20 == 1,
+                custom_attributes=attributes, review_count=total,
+                avg_rating=round(sum(rating * n for rating, n in counts.items()) / total, 2) if total else 0,
+                **{histogram_field(rating): n for rating, n in counts.items()},
+            )
+
+    bulk_insert(Product, products(), batch_size=BATCH_SIZE)
+    rows = list(Product.objects.order_by('pk').values_list('pk', 'price', 'custom_attributes'))
+    bulk_insert(ProductSpecification, (
+        ProductSpecification(product_id=pk, name=name, value=value)
+        for pk, _, attributes in rows
+        for name, value in (
+            ('RAM', attributes['ram']), ('Storage', attributes['storage']),
+            ('Processor', attributes['processor']), ('Display', DISPLAYS[pk % len(DISPLAYS)]),
+        )[:3 + pk % 2]
+    ), batch_size=BATCH_SIZE)
+    _spread(Product, [pk for pk, _, _ in rows])
+    return [(pk, price) for pk, price, _ in rows]
+
+
+def _users(count):
+    User = get_user_model()
+    password = make_password(PASSWORD)  # Hashed once, hashing is slow on purpose
+    bulk_insert(User, (
+        User(username=f"seed-user-{i}", email=f"seed-user-{i}@example.com", password=password)
+        for i in range(count)
+    ), batch_size=BATCH_SIZE)
+    return list(User.objects.filter(username__startswith='seed-user-').order_by('pk').values_list('pk', flat=True))
+
+
+def _reviews(rng, ratings, products, user_ids):
+    from .models import Review
+
+    bulk_insert(Review, (
+        Review(product_id=products[index][0], user_id=rng.choice(user_ids), rating=rating, comment=rng.choice(COMMENTS))
+        for index, rating in zip(*ratings)
+    ), batch_size=BATCH_SIZE)
+    _spread(Review, list(Review.objects.order_by('pk').values_list('pk', flat=True)))
+
+
+def _orders(rng, count, products, user_ids):
+    from .checkout import shipping_cost
+    from .models import Order, OrderItem
+
+    statuses, weights = ORDER_STATUSES
+    created = []
+    for start in range(0, count, BATCH_SIZE):
+        orders, baskets = [], []
+        for _ in range(min(BATCH_SIZE, count - start)):
+            basket = {products[_skewed(rng, len(products))] for _ in range(rng.choice((1, 1, 1, 2, 2, 3, 4)))}
+            lines = [(pk, price, rng.choice((1, 1, 1, 2, 3))) for pk, price in basket]
+            method = rng.choice(('home', 'office'))
+            orders.append(Order(
+                user_id=rng.choice(user_ids), status=rng.choices(statuses, weights)[0],
+                shipping_method=method, shipping_cost=shipping_cost(method),
+                payment_method=rng.choice(('cash', 'card', 'transfer')),
+                total=sum(price * quantity for _, price, quantity in lines) + shipping_cost(method),
+            ))
+            baskets.append(lines)
+        Order.objects.bulk_create(orders)
+        OrderItem.objects.bulk_create([
+            OrderItem(order_id=order.pk, product_id=pk, quantity=quantity, price=price)
+            for order, lines in zip(orders, baskets) for pk, price, quantity in lines
+        ])
+        created.extend((order.pk, order.total) for order in orders)
+    _spread(Order, [pk for pk, _ in created])
+    return created
+
+
+def _wishlists(rng, count, products, user_ids):
+    from .models import Wishlist
+
+    pairs = set()
+    count = min(count, len(user_ids) * len(products))
+    while len(pairs) < count:
+        pairs.add((rng.choice(user_ids), products[_skewed(rng, len(products))][0]))
+    bulk_insert(Wishlist, (Wishlist(user_id=user, product_id=product) for user, product in sorted(pairs)), batch_size=BATCH_SIZE)
+
+
+def _transactions(rng, count, orders):
+    from mpesa.models import MpesaTransaction
+
+    statuses, weights = PAYMENT_STATUSES
+
+    def transactions():
+        for i, (order_id, total) in enumerate(rng.sample(orders, min(count, len(orders)))):
+            status = rng.choices(statuses, weights)[0]
+            receipt = ''.join(rng.choices(string.ascii_uppercase + string.digits, k=10)) if status == 'paid' else ''
+            phone = f"2547{rng.randrange(10 ** 8):08d}"
+            yield MpesaTransaction(
+                transaction_id=f"ws_CO_SEED{i:010d}", phone_number=phone, amount=total,
+                account_reference=f"ORDER{order_id}", transaction_desc=f"Payment for order {order_id}",
+                status=status, mpesa_receipt_number=receipt,
+                callback_data=None if status == 'processing' else {
+                    'ResultCode': 0 if status == 'paid' else 1032,
+                    'ResultDesc': 'The service request is processed successfully.' if status == 'paid' else 'Request cancelled by user',
+                },
+            )
+
+    bulk_insert(MpesaTransaction, transactions(), batch_size=BATCH_SIZE)
+
+
+def rebuild_derived(related=False):
+    """Recomputes the tables the save signals would have maintained, and drops the caches."""
+    from . import analytics, catalog_cache, recommendations, response_cache, search
+    from .facets import rebuild_attribute_index
+
+    rebuild_attribute_index()
+    search.rebuild()
+    analytics.rebuild()
+    if related:
+        recommendations.refresh(rebuild=True)
+    else:
+        recommendations.update_co_purchases()
+    catalog_cache.invalidate_cards()
+    catalog_cache.invalidate_collections()
+    catalog_cache.invalidate_category_tree()
+    response_cache.invalidate(*set(response_cache.MODEL_TAGS.values()))
+
+
+def seed(counts, seed=42, related=False, progress=None):
+    """
+    Writes the rows of `counts` (see default_counts) and rebuilds the derived
+    tables. progress(step, seconds) is called after each step. Returns the
+    ids of the seeded categories, products (with their price) and users.
+    """
+    rng = random.Random(seed)
+    timings = {}
+
+    def step(name, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        timings[name] = time.perf_counter() - started
+        if progress:
+            progress(name, timings[name])
+        return result
+
+    category_ids = step('categories', _categories, rng, counts['categories'])
+    ratings = _ratings(rng, counts['reviews'], counts['products'])
+    products = step('products', _products, rng, counts['products'], category_ids, ratings)
+    user_ids = step('users', _users, counts['users'])
+    step('reviews', _reviews, rng, ratings, products, user_ids)
+    orders = step('orders', _orders, rng, counts['orders'], products, user_ids)
+    step('wishlists', _wishlists, rng, counts['wishlists'], products, user_ids)
+    step('transactions', _transactions, rng, counts['transactions'], orders)
+    step('derived tables', rebuild_derived, related)
+    return {'categories': category_ids, 'products': products, 'users': user_ids}
@@ -1,22 +1,61 @@
+from django.conf import settings
 from rest_framework import serializers
+from . import images
+from .fieldsets import SparseFieldsetSerializerMixin
 from .models import Category, Product, ProductSpecification, Review, ReviewImage, Order, OrderItem, Wishlist
+from .ratings import RATINGS, histogram_field
+
+class ImageRenditionsField(serializers.Field):
+    """
+    {image field: srcset map (see api.images.rendition_urls)} for the image
+    fields of the object that are set, None for those not processed yet.
+    """
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, obj):
+        request = self.context.get('request')
+        return {
+            field: images.rendition_urls(obj, field, request)
+            for field in images.IMAGE_FIELDS[obj._meta.label] if getattr(obj, field)
+        }
+
+    def sparse_dependencies(self, model):
+        # The columns to_representation() reads, see api.fieldsets
+        return images.IMAGE_FIELDS[model._meta.label] + ['image_renditions']
+
+    def row_representation(self, *values):
+        # to_representation() from the sparse_dependencies() columns, see api.row_serializers
+        *names, renditions = values
+        request = self.context.get('request')
+        fields = images.IMAGE_FIELDS[self.parent.Meta.model._meta.label]
+        return {
+            field: images.stored_rendition_urls(renditions, field, name, request)
+            for field, name in zip(fields, names) if name
+        }
+
+class CategorySerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    image_renditions = ImageRenditionsField()
 
-class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ['id', 'name', 'image']
+        fields = ['id', 'name', 'image', 'image_renditions']
 
-class ProductSpecificationSerializer(serializers.ModelSerializer):
+class ProductSpecificationSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = ProductSpecification
         fields = ['name', 'value']
 
-class ReviewImageSerializer(serializers.ModelSerializer):
+class ReviewImageSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    image_renditions = ImageRenditionsField()
+
     class Meta:
         model = ReviewImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'image_renditions']
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     user_name = serializers.SerializerMethodField()
     user_avatar = serializers.SerializerMethodField()
     images = ReviewImageSerializer(many=True, read_only=True)
@@ -24,16 +63,22 @@ class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = ['id', 'rating', 'comment', 'user_name', 'user_avatar', 'created_at', 'images']
+        field_dependencies = {
+            'user_name': ['user'],
+            'user_avatar': ['user'],
+        }
 
     def get_user_name(self, obj):
         return obj.user.get_full_name() or obj.user.username
 
     def get_user_avatar(self, obj):
-        if obj.user.profile_image:
-            return obj.user.profile_image.url
+        # The default auth.User has no profile_image
+        profile_image = getattr(obj.user, 'profile_image', None)
+        if profile_image:
+            return profile_image.url
         return None
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     category_name = serializers.ReadOnlyField(source='category.name')
     specifications = ProductSpecificationSerializer(many=True, read_only=True)
     # Direct ImageFields from the model will be handled by ModelSerializer
@@ -43,6 +88,8 @@ class ProductSerializer(serializers.ModelSerializer):
     image_alt2 = serializers.ImageField(max_length=None, use_url=True, required=False, allow_null=True)
     image_alt3 = serializers.ImageField(max_length=None, use_url=True, required=False, allow_null=True)
     image_alt4 = serializers.ImageField(max_length=None, use_url=True, required=False, allow_null=True)
+    image_renditions = ImageRenditionsField()
+    rating_histogram = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
@@ -50,38 +97,63 @@ class ProductSerializer(serializers.ModelSerializer):
             'id', 'name', 'slug', 'description', 'price', 'original_price',
             'category', 'category_name', 'sku', 'stock', 'is_new_arrival',
             'is_bestseller', 'is_featured', 'custom_attributes', 'specifications',
-            'image_main', 'image_alt1', 'image_alt2', 'image_alt3', 'image_alt4',
+            'avg_rating', 'review_count', 'rating_histogram',
+            'image_main', 'image_alt1', 'image_alt2', 'image_alt3', 'image_alt4', 'image_renditions',
             'created_at', 'updated_at'
         ]
         read_only_fields = [
-            'id', 'slug', 'created_at', 'updated_at', 'category_name', 'specifications'
+            'id', 'slug', 'created_at', 'updated_at', 'category_name', 'specifications',
+            'avg_rating', 'review_count',
         ]
         # 'category' is a ForeignKey, it expects an ID for write operations.
         # Image fields are writable by default with ModelSerializer if not in read_only_fields.
         # custom_attributes is a JSONField, also writable.
+        # ?expand=category nests the category instead of its id, see api.fieldsets
+        expandable_fields = {'category': 'api.serializers.CategorySerializer'}
+        field_dependencies = {'rating_histogram': [histogram_field(rating) for rating in RATINGS]}
+
+    def get_rating_histogram(self, obj):
+        return {str(rating): getattr(obj, histogram_field(rating)) for rating in RATINGS}
+
+    def row_rating_histogram(self, *counts):
+        return {str(rating): count for rating, count in zip(RATINGS, counts)}
 
 class ProductDetailSerializer(ProductSerializer):
-    reviews = ReviewSerializer(many=True, read_only=True)
+    # Only the latest few, the full list is paginated by the reviews action
+    reviews = serializers.SerializerMethodField()
 
     class Meta(ProductSerializer.Meta):
         fields = ProductSerializer.Meta.fields + ['reviews']
         read_only_fields = ProductSerializer.Meta.read_only_fields # Inherit read_only_fields
+        field_querysets = {'reviews': 'with_latest_reviews'}
+
+    def get_reviews(self, obj):
+        reviews = getattr(obj, 'latest_reviews', None)  # Prefetched by Product.objects.with_latest_reviews()
+        if reviews is None:
+            reviews = obj.reviews.for_display()[:settings.PRODUCT_DETAIL_REVIEWS]
+        return ReviewSerializer(reviews, many=True, context=self.nested_context('reviews')).data
 
-class OrderItemSerializer(serializers.ModelSerializer):
+def product_image_url(image_main):
+    """What image_main.url gives for a stored name: the storage-relative URL, or None when unset."""
+    return Product.image_main.field.storage.url(image_main) if image_main else None
+
+class OrderItemSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     product_name = serializers.ReadOnlyField(source='product.name')
     product_image = serializers.SerializerMethodField()
 
     class Meta:
         model = OrderItem
         fields = ['id', 'product', 'product_name', 'product_image', 'quantity', 'price']
+        expandable_fields = {'product': 'api.serializers.ProductSerializer'}
+        field_dependencies = {'product_image': ['product__image_main']}
 
     def get_product_image(self, obj):
-        # Use the new image_main field
-        if obj.product.image_main:
-            return obj.product.image_main.url
-        return None # Or a placeholder image URL
+        return self.row_product_image(obj.product.image_main.name)
+
+    def row_product_image(self, image_main):
+        return product_image_url(image_main)
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
 
     class Meta:
@@ -90,8 +162,37 @@ class OrderSerializer(serializers.ModelSerializer):
             'id', 'status', 'shipping_method', 'shipping_cost',
             'payment_method', 'total', 'items', 'created_at'
         ]
+        # Orders are placed through CheckoutSerializer, which prices them server-side
+        read_only_fields = ['status', 'shipping_cost', 'total']
+
+class OrderSummarySerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    """Order history card, needs Order.objects.with_summary()."""
+    item_count = serializers.IntegerField(read_only=True)
+    first_image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Order
+        fields = ['id', 'status', 'total', 'item_count', 'first_image', 'created_at']
+        field_dependencies = {'first_image': ['first_image']}  # The with_summary() annotation
+
+    def get_first_image(self, obj):
+        return self.row_first_image(obj.first_image)
+
+    def row_first_image(self, first_image):
+        return product_image_url(first_image)
+
+class CheckoutItemSerializer(serializers.Serializer):
+    product = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1, max_value=1000)
+
+class CheckoutSerializer(serializers.Serializer):
+    items = CheckoutItemSerializer(many=True, allow_empty=False, max_length=200)
+    shipping_method = serializers.ChoiceField(choices=Order.SHIPPING_METHOD_CHOICES)
+    payment_method = serializers.ChoiceField(choices=Order.PAYMENT_METHOD_CHOICES)
+    # Only reserve the stock and leave the order pending until it's paid
+    hold = serializers.BooleanField(default=False)
 
-class WishlistSerializer(serializers.ModelSerializer):
+class WishlistSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
 
     class Meta:
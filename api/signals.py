@@ -0,0 +1,172 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import analytics, catalog_cache, facets, images, inventory, response_cache, search
+from .models import Category, Order, Product, ProductSpecification, Review, ReviewImage
+from .ratings import apply_rating_changes
+
+
+@receiver(post_save, sender=Product)
+def index_product_attributes(sender, instance, raw=False, **kwargs):
+    if raw:  # Skip fixture loading
+        return
+    facets.sync_product_attributes([instance])
+
+
+@receiver(pre_delete, sender=Product)
+def unindex_product_attributes(sender, instance, **kwargs):
+    facets.remove_product_attributes([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def index_product_search(sender, instance, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    search.index('product', [instance.pk], using)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product_search(sender, instance, using='default', **kwargs):
+    search.remove('product', [instance.pk], using)
+
+
+@receiver(post_save, sender=Category)
+def index_category_search(sender, instance, raw=False, using='default', **kwargs):
+    if raw or not search.is_enabled(using):
+        return
+    previous = search.indexed_values('category', instance.pk, using)
+    search.index('category', [instance.pk], using)
+    # Product documents carry the category name
+    if previous is not None and previous['name'] != instance.name:
+        product_ids = Product.objects.using(using).filter(category=instance).values_list('pk', flat=True)
+        search.index('product', product_ids, using)
+
+
+@receiver(post_delete, sender=Category)
+def unindex_category_search(sender, instance, using='default', **kwargs):
+    search.remove('category', [instance.pk], using)
+
+
+@receiver(post_save, sender=Product)
+def invalidate_product_card(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    catalog_cache.invalidate_cards([instance.pk])
+    # Only rebuild the collections this product joined or left. Instances that
+    # weren't loaded from the database have no previous flags, so they count
+    # as changed.
+    changed = [
+        name for name, flag in catalog_cache.COLLECTIONS.items()
+        if getattr(instance, flag) != instance.get_loaded_value(flag, False if created else None)
+    ]
+    if changed:
+        catalog_cache.invalidate_collections(changed)
+
+
+@receiver(post_delete, sender=Product)
+def drop_product_from_collections(sender, instance, **kwargs):
+    changed = [name for name, flag in catalog_cache.COLLECTIONS.items() if getattr(instance, flag)]
+    if changed:
+        catalog_cache.invalidate_collections(changed)
+
+
+@receiver(post_save, sender=ProductSpecification)
+@receiver(post_delete, sender=ProductSpecification)
+def invalidate_specification_card(sender, instance, raw=False, **kwargs):
+    if not raw:
+        catalog_cache.invalidate_cards([instance.product_id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_cards(sender, instance, raw=False, **kwargs):
+    # Every card embeds its category, bump the generation instead of each card
+    if not raw:
+        catalog_cache.invalidate_cards()
+        catalog_cache.invalidate_category_tree()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_category_counts(sender, instance, raw=False, **kwargs):
+    if not raw:
+        catalog_cache.invalidate_category_tree()
+
+
+def invalidate_cached_responses(sender, instance, raw=False, **kwargs):
+    if not raw:
+        response_cache.invalidate_model(sender)
+
+
+for model in (Product, Category, Review, ReviewImage, ProductSpecification):
+    for signal in (post_save, post_delete):
+        signal.connect(invalidate_cached_responses, sender=model, dispatch_uid=f'response-cache-{model._meta.label}')
+
+
+@receiver(pre_save, sender=Review)
+def load_previous_rating(sender, instance, raw=False, using='default', **kwargs):
+    # Reviews saved without being loaded first still need their old rating
+    if not raw:
+        instance.load_tracked_values(using)
+
+
+@receiver(post_save, sender=Review)
+def count_review_rating(sender, instance, created=False, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    old_product_id = instance.get_loaded_value('product_id')
+    old_rating = instance.get_loaded_value('rating')
+    if created or old_product_id is None:
+        apply_rating_changes(instance.product_id, added=[instance.rating], using=using)
+    elif (old_product_id, old_rating) != (instance.product_id, instance.rating):
+        apply_rating_changes(old_product_id, removed=[old_rating], using=using)
+        apply_rating_changes(instance.product_id, added=[instance.rating], using=using)
+    catalog_cache.invalidate_cards({old_product_id or instance.product_id, instance.product_id})
+
+
+@receiver(post_delete, sender=Review)
+def uncount_review_rating(sender, instance, using='default', **kwargs):
+    product_id = instance.get_loaded_value('product_id', instance.product_id)
+    apply_rating_changes(product_id, removed=[instance.get_loaded_value('rating', instance.rating)], using=using)
+    catalog_cache.invalidate_cards([product_id])
+
+
+@receiver(post_save, sender=Product)
+def record_stock_edit(sender, instance, created=False, raw=False, using='default', **kwargs):
+    # Stock typed into a form or the API, inventory's own UPDATEs don't save()
+    if not raw:
+        inventory.record_stock_edits([instance], created=created, using=using)
+
+
+@receiver(pre_save, sender=Order)
+def load_previous_status(sender, instance, raw=False, using='default', **kwargs):
+    if not raw:
+        instance.load_tracked_values(using)
+
+
+@receiver(post_save, sender=Order)
+def settle_order_reservations(sender, instance, created=False, raw=False, using='default', **kwargs):
+    # Held stock is sold once a pending order moves on, and returned if it's cancelled
+    if raw or created or instance.get_loaded_value('status') != 'pending' or instance.status == 'pending':
+        return
+    if instance.status == 'cancelled':
+        inventory.release(instance.reservations.all(), using=using)
+    else:
+        inventory.commit(instance.reservations.all(), using=using)
+
+
+@receiver(post_save, sender=Order)
+def count_order_status(sender, instance, created=False, raw=False, using='default', **kwargs):
+    # New orders are counted by api.checkout once their items exist
+    old_status = instance.get_loaded_value('status')
+    if not raw and not created and old_status is not None and old_status != instance.status:
+        analytics.record_status_change([instance.pk], old_status, instance.status, using=using)
+
+
+def build_image_renditions(sender, instance, raw=False, using='default', **kwargs):
+    if not raw and images.needs_renditions(instance):
+        images.schedule(instance, using)
+
+
+for model, _ in images.image_models():
+    post_save.connect(build_image_renditions, sender=model, dispatch_uid=f'image-renditions-{model._meta.label}')
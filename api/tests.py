@@ -1,3 +1,1232 @@
-from django.test import TestCase
+import io
+import os
+import runpy
+import shutil
+import sqlite3
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, router, transaction
+from django.db.models import Sum
+from django.db.utils import load_backend
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from mpesa.models import MpesaTransaction
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import analytics, catalog_io, inventory, recommendations, replicas, search, seeding
+from .checkout import place_order
+from .filters import AttributeFilterBackend
+from .models import (
+    AttributeFacet, Category, CoPurchase, DailyCategorySales, DailyOrderSales, DailyProductSales, Order, OrderItem,
+    Product, ProductAttribute, ProductSpecification, Review, Wishlist,
+)
+from .management.commands.bench_api import compare
+from .pagination import ProductCursorPagination
+from .ratings import recompute_ratings
+from .row_serializers import RowSerializer
+from .serializers import OrderSummarySerializer, ProductSerializer, WishlistSerializer
+
+
+class CatalogQueryCountTests(TestCase):
+    """
+    Catalog endpoints must issue the same number of queries whatever the
+    number of rows they render, i.e. no per-row lookups (N+1).
+    """
+
+    def setUp(self):
+        cache.clear()
+        caches[settings.RESPONSE_CACHE_ALIAS].clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user('shopper', password='secret')
+        self.category = Category.objects.create(name='Laptops')
+        self.product_count = 0
+
+    def add_products(self, count):
+        for _ in range(count):
+            self.product_count += 1
+            product = Product.objects.create(
+                name=f"Laptop {self.product_count}", price=1000, category=self.category, stock=5,
+                is_featured=True, is_new_arrival=True, is_bestseller=True,
+                custom_attributes={'brand': 'HP', 'ram': '16GB'},
+            )
+            ProductSpecification.objects.create(product=product, name='RAM', value='16GB')
+            ProductSpecification.objects.create(product=product, name='CPU', value='i7')
+            reviewer = User.objects.create_user(f"reviewer{self.product_count}")
+            Review.objects.create(product=product, user=reviewer, rating=4, comment='Good')
+            Review.objects.create(product=product, user=self.user, rating=5, comment='Great')
+            Wishlist.objects.create(user=self.user, product=product)
+            order = Order.objects.create(
+                user=self.user, shipping_method='home', shipping_cost=0, payment_method='cash', total=2000,
+            )
+            OrderItem.objects.create(order=order, product=product, quantity=2, price=1000)
+
+    def count_queries(self, url):
+        cache.clear()  # Measure the uncached path
+        caches[settings.RESPONSE_CACHE_ALIAS].clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def assertConstantQueries(self, url, authenticate=False):
+        if authenticate:
+            self.client.force_authenticate(self.user)
+        self.add_products(2)
+        small = self.count_queries(url)
+        self.add_products(8)
+        self.assertEqual(self.count_queries(url), small, f"query count grows with the page for {url}")
+
+    def test_product_list(self):
+        self.assertConstantQueries('/api/products/')
+
+    def test_product_list_cursor(self):
+        self.assertConstantQueries('/api/products/?pagination=cursor')
+
+    def test_product_list_filtered(self):
+        self.assertConstantQueries('/api/products/?attr.brand=HP&search=laptop&ordering=price')
+
+    def test_collections(self):
+        for url in ('/api/products/featured/', '/api/products/new-arrivals/', '/api/products/bestsellers/'):
+            with self.subTest(url=url):
+                self.assertConstantQueries(url)
+
+    def test_filter_options(self):
+        # ?search= nests the ranked search queryset in the facet counts
+        for url in ('/api/products/filter-options/?attr.ram=16GB', '/api/products/filter-options/?search=laptop'):
+            with self.subTest(url=url):
+                self.assertConstantQueries(url)
+
+    def test_categories(self):
+        self.assertConstantQueries('/api/categories/')
+
+    def test_wishlist(self):
+        for url in ('/api/wishlist/', '/api/wishlist/?view=compact'):
+            with self.subTest(url=url):
+                self.assertConstantQueries(url, authenticate=True)
+
+    def test_wishlist_membership_and_toggle(self):
+        self.client.force_authenticate(self.user)
+        self.add_products(2)
+        first, second = Product.objects.order_by('pk')
+        self.client.post('/api/wishlist/toggle/', {'product_id': second.pk}, format='json')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/wishlist/contains/?ids={first.pk},{second.pk},999999')
+        self.assertEqual(response.json()['wishlisted'], [first.pk])
+        self.assertEqual(len([query for query in queries if 'api_wishlist' in query['sql']]), 1)
+
+        self.client.post('/api/wishlist/toggle/', {'product_id': second.pk}, format='json')
+        self.assertTrue(Wishlist.objects.filter(user=self.user, product=second).exists())
+
+        for bad in ('abc', 1.5, [second.pk]):
+            with self.subTest(product_id=bad):
+                response = self.client.post('/api/wishlist/toggle/', {'product_id': bad}, format='json')
+                self.assertEqual(response.status_code, 400)
+        self.assertTrue(Wishlist.objects.filter(user=self.user, product=second).exists())
+
+        for url, body in (
+            ('/api/wishlist/contains/', [first.pk, second.pk]),
+            ('/api/wishlist/contains/', {'product_ids': '123'}),
+            ('/api/wishlist/toggle/', [second.pk]),
+        ):
+            with self.subTest(url=url, body=body):
+                response = self.client.post(url, body, format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+    def test_order_history(self):
+        for url in ('/api/orders/', '/api/orders/?pagination=cursor', '/api/orders/?view=summary&pagination=cursor'):
+            with self.subTest(url=url):
+                self.assertConstantQueries(url, authenticate=True)
+
+    def test_order_history_image_urls(self):
+        self.client.force_authenticate(self.user)
+        self.add_products(1)
+        Product.objects.update(image_main='products/laptop.jpg')
+        expected = '/media/products/laptop.jpg'  # image_main.url, as the order history always returned it
+        for url in ('/api/orders/', '/api/orders/?pagination=cursor'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).json()['results'][0]['items'][0]['product_image'], expected)
+        summary = self.client.get('/api/orders/?view=summary').json()['results'][0]
+        self.assertEqual(summary['first_image'], expected)
+
+    def test_admin_changelists(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='secret'))
+        for url in ('/admin/api/product/', '/admin/api/order/', '/admin/api/orderitem/', '/admin/api/review/'):
+            with self.subTest(url=url):
+                self.assertConstantQueries(url)
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=3)
+    def test_admin_count_is_capped(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='secret'))
+        self.add_products(5)
+        self.assertEqual(self.client.get('/admin/api/orderitem/').context['cl'].result_count, 5)  # Primary key span
+        order_id = OrderItem.objects.values_list('order_id', flat=True).first()
+        self.assertEqual(self.client.get(f'/admin/api/orderitem/?q={order_id}').context['cl'].result_count, 1)
+        # Filtered past the limit, the table size says nothing about the matches
+        Product.objects.filter(pk=Product.objects.order_by('pk').values('pk')[:1]).update(is_featured=False)
+        changelist = self.client.get('/admin/api/product/?is_featured__exact=1').context['cl']
+        self.assertEqual((changelist.result_count, changelist.show_full_result_count), (4, False))
+
+    def test_product_batch(self):
+        counts = []
+        for count in (2, 8):
+            self.add_products(count)
+            products = list(Product.objects.order_by('-pk'))
+            ids = ','.join(str(product.pk) for product in products[1:]) + ',999999'
+            url = f'/api/products/batch/?ids={ids}&slugs={products[0].slug},missing'
+            counts.append(self.count_queries(url))
+        self.assertEqual(counts[0], counts[1])
+
+        results = self.client.get(url).json()['results']
+        self.assertEqual([item.get('id') for item in results[:-3]], [product.pk for product in products[1:]])
+        self.assertEqual(results[-3], {'id': 999999, 'not_found': True})
+        self.assertEqual(results[-2]['slug'], products[0].slug)
+        self.assertEqual(results[-1], {'slug': 'missing', 'not_found': True})
+
+    def test_product_batch_rejects_bad_bodies(self):
+        for body in ([1, 2, 3], 'abc', {'ids': '123'}, {'ids': {'1': 1}}, {'slugs': 'abc'}):
+            with self.subTest(body=body):
+                response = self.client.post('/api/products/batch/', body, format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+    def test_sparse_fieldsets(self):
+        for url in (
+            '/api/products/?fields=id,name,category_name,rating_histogram',
+            '/api/products/?fields=id,category&expand=category&pagination=cursor',
+            '/api/orders/?fields=id,items.product_name,items.product_image',
+            '/api/orders/?expand=items.product',
+            '/api/wishlist/?fields=id,product.name,product.specifications',
+        ):
+            with self.subTest(url=url):
+                self.assertConstantQueries(url, authenticate=True)
+
+        product = self.client.get('/api/products/?fields=id,name,category.name&expand=category').json()['results'][0]
+        self.assertEqual(set(product), {'id', 'name', 'category'})
+        self.assertEqual(product['category'], {'name': 'Laptops'})
+        order = self.client.get('/api/orders/?fields=id,items.quantity').json()['results'][0]
+        self.assertEqual(order['items'], [{'quantity': 2}])
+
+    def test_product_detail_reviews(self):
+        # Grows the number of reviews on a single product instead of the page
+        product = Product.objects.create(name='Reviewed', price=1000, category=self.category)
+        url = f'/api/products/{product.slug}/'
+        for end in (2, 10):
+            for i in range(Review.objects.filter(product=product).count(), end):
+                Review.objects.create(product=product, user=User.objects.create_user(f"critic{i}"), rating=3, comment='Ok')
+            counts = [
+                self.count_queries(url),
+                self.count_queries(f'{url}reviews/'),
+                self.count_queries(f'{url}reviews/?ordering=-rating'),
+            ]
+            if end == 2:
+                expected = counts
+        self.assertEqual(counts, expected)
+
+    @override_settings(PRODUCT_DETAIL_REVIEWS=3)
+    def test_product_detail_embeds_latest_reviews(self):
+        product = Product.objects.create(name='Popular', price=1000, category=self.category)
+        for i in range(20):
+            Review.objects.create(product=product, user=User.objects.create_user(f"fan{i}"), rating=i % 5 + 1, comment=str(i))
+
+        detail = self.client.get(f'/api/products/{product.slug}/').json()
+        self.assertEqual([review['comment'] for review in detail['reviews']], ['19', '18', '17'])
+        self.assertEqual(detail['review_count'], 20)
+
+        page = self.client.get(f'/api/products/{product.slug}/reviews/?ordering=-rating').json()
+        seen = [review['rating'] for review in page['results']]
+        while page['next']:
+            page = self.client.get(page['next']).json()
+            seen += [review['rating'] for review in page['results']]
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(len(seen), 20)
+
+
+class CollectionTests(TestCase):
+    """featured/new-arrivals/bestsellers follow product writes and page like the other lists."""
+
+    collections = {'featured': 'is_featured', 'new-arrivals': 'is_new_arrival', 'bestsellers': 'is_bestseller'}
+
+    def setUp(self):
+        cache.clear()
+        caches[settings.RESPONSE_CACHE_ALIAS].clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Laptops')
+        self.members = {
+            flag: [
+                Product.objects.create(name=f"{flag} {number}", price=100, category=self.category, **{flag: True})
+                for number in range(14)
+            ]
+            for flag in self.collections.values()
+        }
+        Product.objects.create(name='Plain', price=100, category=self.category)
+
+    def listing(self, collection):
+        """{id: name} across every page of the collection, and the page sizes."""
+        names, sizes = {}, []
+        url = f'/api/products/{collection}/'
+        while url:
+            page = self.client.get(url).json()
+            sizes.append(len(page['results']))
+            names.update((product['id'], product['name']) for product in page['results'])
+            url = page['next']
+        return names, sizes
+
+    def test_pages_newest_first(self):
+        for collection, flag in self.collections.items():
+            with self.subTest(collection=collection):
+                first = self.client.get(f'/api/products/{collection}/').json()
+                self.assertEqual(first['count'], 14)
+                expected = [product.pk for product in reversed(self.members[flag])]
+                self.assertEqual([product['id'] for product in first['results']], expected[:12])
+                second = self.client.get(first['next']).json()
+                self.assertEqual([product['id'] for product in second['results']], expected[12:])
+                self.assertIsNone(second['next'])
+
+    def test_writes_refresh_the_collections(self):
+        for collection, flag in self.collections.items():
+            with self.subTest(collection=collection):
+                self.listing(collection)  # Warm the membership and card caches
+                leaving, renamed, deleted = (Product.objects.get(pk=p.pk) for p in self.members[flag][:3])
+                joining = Product.objects.get(name='Plain')
+
+                setattr(leaving, flag, False)
+                leaving.save()
+                setattr(joining, flag, True)
+                joining.save()
+                renamed.name = 'Renamed'
+                renamed.save()
+                deleted.delete()
+                added = Product.objects.create(name='Brand new', price=100, category=self.category, **{flag: True})
+
+                names, sizes = self.listing(collection)
+                self.assertEqual(sizes, [12, 2])
+                self.assertNotIn(leaving.pk, names)
+                self.assertNotIn(deleted.pk, names)
+                self.assertEqual(names[joining.pk], 'Plain')
+                self.assertEqual(names[renamed.pk], 'Renamed')
+                self.assertEqual(names[added.pk], 'Brand new')
+
+                # Put the catalog back for the next collection
+                setattr(joining, flag, False)
+                joining.save()
+
+
+class KeysetPaginationTests(TestCase):
+    """?pagination=cursor walks the whole catalog in order, ties included, in both directions."""
+
+    def setUp(self):
+        cache.clear()
+        caches[settings.RESPONSE_CACHE_ALIAS].clear()
+        self.client = APIClient()
+        category = Category.objects.create(name='Laptops')
+        for number in range(30):
+            # Three prices and four names, so every page boundary falls inside a tie
+            Product.objects.create(name=f"Laptop {number % 4}", price=100 * (number % 3 + 1), category=category)
+
+    def walk(self, url, link):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            page = response.json()
+            pages.append([product['id'] for product in page['results']])
+            url = page[link]
+        return pages
+
+    def test_every_product_once_in_order(self):
+        for ordering in ('price', '-price', 'name'):
+            with self.subTest(ordering=ordering):
+                tie_break = '-pk' if ordering.startswith('-') else 'pk'
+                expected = list(Product.objects.order_by(ordering, tie_break).values_list('pk', flat=True))
+
+                pages = self.walk(f'/api/products/?pagination=cursor&ordering={ordering}', 'next')
+                self.assertEqual([len(page) for page in pages], [12, 12, 6])
+                self.assertEqual([pk for page in pages for pk in page], expected)
+
+                # Back from the last page, through the previous links
+                last = self.client.get(f'/api/products/?pagination=cursor&ordering={ordering}').json()
+                while last['next']:
+                    last = self.client.get(last['next']).json()
+                backwards = self.walk(last['previous'], 'previous')
+                self.assertEqual(backwards, pages[-2::-1])
+
+    def test_tampered_and_stale_cursors_are_not_found(self):
+        page = self.client.get('/api/products/?pagination=cursor&ordering=price').json()
+        cursor = page['next'].split('cursor=')[1].split('&')[0]
+        self.assertEqual(self.client.get(f'/api/products/?ordering=price&cursor={cursor[:-4]}').status_code, 404)
+        self.assertEqual(self.client.get('/api/products/?ordering=price&cursor=not-base64!').status_code, 404)
+        # A cursor only means something for the ordering it was cut from
+        self.assertEqual(self.client.get(f'/api/products/?ordering=name&cursor={cursor}').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/products/?ordering=price&cursor={cursor}').status_code, 200)
+
+
+class SearchTests(TestCase):
+    """The FTS5 indexes answer ?search= with prefix matches in BM25 order and follow every write."""
+
+    def setUp(self):
+        cache.clear()
+        caches[settings.RESPONSE_CACHE_ALIAS].clear()
+        self.category = Category.objects.create(name='Laptops')
+        self.by_name = Product.objects.create(
+            name='Lenovo ThinkPad X1', price=100, category=self.category, description='A business machine',
+        )
+        self.by_description = Product.objects.create(
+            name='Dell Latitude', price=200, category=self.category, description='Rivals the thinkpad keyboard',
+        )
+        Product.objects.create(name='HP Spectre', price=300, category=self.category, description='Convertible')
+
+    def search(self, query):
+        return [product['id'] for product in APIClient().get(f'/api/products/?search={query}').json()['results']]
+
+    def test_bm25_ranks_name_matches_first(self):
+        self.assertEqual(self.search('thinkpad'), [self.by_name.pk, self.by_description.pk])
+        ranked = search.filter_queryset(Product.objects.all(), 'product', 'thinkpad').order_by('search_rank')
+        ranks = [product.search_rank for product in ranked]
+        self.assertEqual(ranks, sorted(ranks))
+        # An explicit ?ordering= wins over relevance
+        response = APIClient().get('/api/products/?search=thinkpad&ordering=-price').json()
+        self.assertEqual([product['id'] for product in response['results']], [self.by_description.pk, self.by_name.pk])
+
+    def test_prefix_matching_requires_every_word(self):
+        self.assertEqual(self.search('think'), [self.by_name.pk, self.by_description.pk])
+        self.assertEqual(self.search('len think'), [self.by_name.pk])
+        self.assertEqual(self.search('lenovo spectre'), [])
+        self.assertEqual(self.search('"*'), [])  # Nothing searchable, and no FTS syntax reaches MATCH
+
+    def test_snippets_highlight_the_match(self):
+        highlights = search.snippets('product', 'keyboard', [self.by_name.pk, self.by_description.pk])
+        self.assertEqual(list(highlights), [self.by_description.pk])
+        self.assertIn('<mark>keyboard</mark>', highlights[self.by_description.pk])
+
+    def test_writes_keep_the_index_in_sync(self):
+        self.by_name.name = 'Lenovo Yoga'
+        self.by_name.save()
+        self.assertEqual(self.search('yoga'), [self.by_name.pk])
+        self.assertEqual(self.search('thinkpad'), [self.by_description.pk])
+
+        # Product documents carry their category's name
+        self.category.name = 'Notebooks'
+        self.category.save()
+        self.assertEqual(len(self.search('notebooks')), 3)
+        self.assertEqual(self.search('laptops'), [])
+        self.assertEqual(search.indexed_values('category', self.category.pk), {'name': 'Notebooks'})
+
+        self.by_description.delete()
+        self.assertIsNone(search.indexed_values('product', self.by_description.pk))
+        self.assertEqual(self.search('thinkpad'), [])
+
+    def test_faq_index(self):
+        from chatbot.models import FAQ
+
+        shipping = FAQ.objects.create(question='How long does shipping take?', answer='Two to three days.')
+        FAQ.objects.create(question='Can I pay with M-Pesa?', answer='Yes, and shipping is free above 5000.')
+        ranked = search.filter_queryset(FAQ.objects.all(), 'faq', 'how long is shipping', match_all=False)
+        self.assertEqual(ranked.order_by('search_rank').first(), shipping)
+        shipping.delete()
+        self.assertIsNone(search.indexed_values('faq', shipping.pk))
+
+
+class FacetIndexTests(TestCase):
+    """AttributeFacet counts follow product saves and deletes, and filter-options reads them."""
+
+    def setUp(self):
+        cache.clear()
+        caches[settings.RESPONSE_CACHE_ALIAS].clear()
+        self.category = Category.objects.create(name='Laptops')
+        self.other = Category.objects.create(name='Desktops')
+        self.hp = Product.objects.create(
+            name='HP 1', price=100, category=self.category, custom_attributes={'brand': 'HP', 'ram': '16GB'},
+        )
+        self.dell = Product.objects.create(
+            name='Dell 1', price=200, category=self.other, custom_attributes={'Brand': ' dell ', 'ram': '16 GB'},
+        )
+        Product.objects.create(name='HP 2', price=300, category=self.other, custom_attributes={'brand': 'hp'})
+
+    def counts(self):
+        return {
+            (key, normalized): count
+            for key, normalized, count in AttributeFacet.objects.values_list('key', 'normalized_value', 'product_count')
+        }
+
+    def test_saves_and_deletes_move_the_counts(self):
+        self.assertEqual(self.counts(), {
+            ('brand', 'hp'): 2, ('brand', 'dell'): 1, ('ram', '16gb'): 1, ('ram', '16 gb'): 1,
+        })
+
+        self.hp.custom_attributes = {'brand': 'Dell', 'storage': '512GB SSD'}
+        self.hp.save()
+        self.assertEqual(self.counts(), {
+            ('brand', 'hp'): 1, ('brand', 'dell'): 2, ('ram', '16 gb'): 1, ('storage', '512gb ssd'): 1,
+        })
+
+        self.dell.delete()
+        self.assertEqual(self.counts(), {('brand', 'hp'): 1, ('brand', 'dell'): 1, ('storage', '512gb ssd'): 1})
+
+    def test_rebuild_restores_the_counts(self):
+        expected = self.counts()
+        AttributeFacet.objects.all().delete()
+        ProductAttribute.objects.filter(product=self.hp).delete()
+        call_command('rebuild_facets', stdout=io.StringIO())
+        self.assertEqual(self.counts(), expected)
+        self.assertEqual(ProductAttribute.objects.filter(product=self.hp).count(), 2)
+
+    def test_filter_options_are_scoped_to_the_filtered_products(self):
+        client = APIClient()
+        everything = client.get('/api/products/filter-options/').json()
+        self.assertEqual(everything['facets']['brand'], [{'value': 'dell', 'count': 1}, {'value': 'HP', 'count': 2}])
+        self.assertEqual(everything['price_range'], {'min': 100.0, 'max': 300.0})
+
+        scoped = client.get(f'/api/products/filter-options/?category={self.other.pk}').json()
+        self.assertEqual(scoped['facets']['brand'], [{'value': 'dell', 'count': 1}, {'value': 'hp', 'count': 1}])
+        self.assertEqual(scoped['facets']['ram'], [{'value': '16 GB', 'count': 1}])
+        self.assertEqual(scoped['price_range'], {'min': 200.0, 'max': 300.0})
+
+        scoped = client.get('/api/products/filter-options/?attr.brand=HP').json()
+        self.assertEqual(scoped['brand'], ['HP'])
+        self.assertEqual(scoped['facets']['brand'], [{'value': 'HP', 'count': 2}])
+
+
+class AttributeFilterTests(TestCase):
+    """?attr.<key>= results and counts match a plain Python filter of the catalog."""
+
+    def setUp(self):
+        cache.clear()
+        caches[settings.RESPONSE_CACHE_ALIAS].clear()
+        self.client = APIClient()
+        self.laptops = Category.objects.create(name='Laptops')
+        self.desktops = Category.objects.create(name='Desktops')
+        brands, rams, storage = ['HP', 'Dell', 'Lenovo'], ['8GB', '16GB', '32GB'], ['256GB SSD', '512GB SSD']
+        self.products = [
+            Product.objects.create(
+                name=f"Computer {number}", price=100 + number * 7 % 50, stock=5,
+                category=self.laptops if number % 4 else self.desktops,
+                custom_attributes={
+                    'brand': brands[number % 3], 'ram': rams[number % 5 % 3], 'storage': storage[number % 2],
+                },
+            )
+            for number in range(60)
+        ]
+
+    def expected(self, filters, category=None):
+        return {
+            product.pk for product in self.products
+            if all(product.custom_attributes[key] in values for key, values in filters.items())
+            and category in (None, product.category)
+        }
+
+    def assertMatches(self, query, filters, category=None):
+        expected = self.expected(filters, category)
+        for mode in ('', '&pagination=cursor'):
+            url = f"/api/products/?{query}{mode}&ordering=price"
+            with self.subTest(url=url):
+                page = self.client.get(url).json()
+                seen = [product['id'] for product in page['results']]
+                while page['next']:
+                    page = self.client.get(page['next']).json()
+                    seen += [product['id'] for product in page['results']]
+                self.assertEqual(page['count'], len(expected))
+                self.assertCountEqual(seen, expected)
+
+    def test_keys_are_anded_and_values_ored(self):
+        self.assertMatches('attr.brand=hp', {'brand': {'HP'}})
+        self.assertMatches('attr.brand=HP,Dell&attr.ram=16GB', {'brand': {'HP', 'Dell'}, 'ram': {'16GB'}})
+        self.assertMatches(
+            'attr.brand=Dell&attr.ram=16GB,32GB&attr.storage=512GB SSD',
+            {'brand': {'Dell'}, 'ram': {'16GB', '32GB'}, 'storage': {'512GB SSD'}},
+        )
+        self.assertMatches(
+            'attr.brand=HP,Lenovo&attr.ram=8GB,32GB', {'brand': {'HP', 'Lenovo'}, 'ram': {'8GB', '32GB'}},
+        )
+        self.assertMatches('attr.brand=Acer', {'brand': {'Acer'}})
+
+    def test_with_other_filters(self):
+        self.assertMatches(
+            f"attr.ram=8GB&category={self.desktops.pk}", {'ram': {'8GB'}}, category=self.desktops,
+        )
+        expected = {
+            pk for pk in self.expected({'brand': {'Dell'}}) if Product.objects.get(pk=pk).price >= 120
+        }
+        response = self.client.get('/api/products/?attr.brand=Dell&min_price=120').json()
+        self.assertEqual(response['count'], len(expected))
+
+    def test_count_free_pages_walk_the_ordering_index(self):
+        query = 'attr.brand=HP,Dell&attr.ram=16GB&ordering=-price'
+        expected = self.expected({'brand': {'HP', 'Dell'}, 'ram': {'16GB'}})
+        ordered = list(Product.objects.filter(pk__in=expected).order_by('-price', '-id').values_list('id', flat=True))
+        # Windows of two rows, so one page takes several rounds
+        with mock.patch.object(ProductCursorPagination, 'scan_window', 2), \
+                mock.patch.object(AttributeFilterBackend, 'max_listed_matches', 0), \
+                mock.patch.object(ProductCursorPagination, 'fetch_in_windows', autospec=True,
+                                  side_effect=ProductCursorPagination.fetch_in_windows) as fetch_in_windows:
+            page = self.client.get(f"/api/products/?{query}&pagination=cursor&count=false").json()
+            self.assertNotIn('count', page)
+            seen = [product['id'] for product in page['results']]
+            while page['next']:
+                page = self.client.get(page['next']).json()
+                seen += [product['id'] for product in page['results']]
+            self.assertEqual(seen, ordered)
+            self.assertEqual(fetch_in_windows.call_count, -(-len(ordered) // settings.REST_FRAMEWORK['PAGE_SIZE']))
+
+            previous = self.client.get(page['previous']).json()
+            end = len(seen) - len(page['results'])
+            self.assertEqual([product['id'] for product in previous['results']], seen[end - len(previous['results']):end])
+
+
+@override_settings(IMAGE_RENDITION_WORKERS=0, IMAGE_RENDITION_FORMATS=['webp'])
+class ImageRenditionTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, name, size=(1200, 800)):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def test_upload_builds_renditions(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.create(name='Laptops', image=self.upload('laptops.jpg'))
+        category.refresh_from_db()
+        renditions = category.image_renditions['image']['renditions']
+        self.assertEqual(renditions['thumb']['width'], 200)
+        self.assertEqual(renditions['medium']['width'], 600)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                name='Laptop', price=1000, category=category,
+                image_main=self.upload('laptop.jpg', size=(400, 300)),
+            )
+        data = APIClient().get(f'/api/products/{product.slug}/').json()
+        srcset = data['image_renditions']['image_main']['srcset']['webp']
+        self.assertIn(' 200w', srcset)
+        self.assertIn(' 400w', srcset)  # Never upscaled past the original
+
+    def test_unchanged_images_are_not_rebuilt(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.create(name='Phones', image=self.upload('phones.jpg'))
+        category.refresh_from_db()
+        category.name = 'Smartphones'
+        with self.captureOnCommitCallbacks() as callbacks:
+            category.save()
+        self.assertEqual(callbacks, [])
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class RowSerializerTests(TestCase):
+    """The fast list path must render the same bytes as the serializers."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        user = User.objects.create_user('shopper')
+        self.client.force_authenticate(user)
+        category = Category.objects.create(name='Laptops', image='categories/laptops.jpg')
+        renditions = {'image_main': {'source': 'products/laptop.jpg', 'renditions': {
+            'thumb': {'width': 200, 'webp': 'renditions/laptop-200.webp'},
+        }}}
+        for i in range(3):
+            product = Product.objects.create(
+                name=f"Laptop {i} \u2028 caf\u00e9", price='1234.50', original_price='1500.00' if i else None,
+                category=category, stock=i, avg_rating=4.333333333333333, custom_attributes={'brand': 'HP'},
+                image_main='products/laptop.jpg' if i else '', image_renditions=renditions if i else {},
+            )
+            ProductSpecification.objects.create(product=product, name='RAM', value='16GB')
+            Wishlist.objects.create(user=user, product=product)
+            order = Order.objects.create(user=user, shipping_method='home', shipping_cost=0, payment_method='cash', total=1234)
+            OrderItem.objects.create(order=order, product=product, quantity=1, price='1234.50')
+
+    def test_same_output_as_the_serializers(self):
+        for url in (
+            '/api/products/',
+            '/api/products/?pagination=cursor&ordering=-price',
+            '/api/products/?fields=id,name,category.name,image_renditions&expand=category',
+            '/api/categories/',
+            '/api/orders/',
+            '/api/orders/?view=summary',
+            '/api/wishlist/',
+        ):
+            with self.subTest(url=url):
+                fast = self.client.get(url)
+                with override_settings(FAST_READ_PATH=False):
+                    slow = self.client.get(url)
+                self.assertEqual(fast.status_code, 200)
+                self.assertEqual(fast.content, JSONRenderer().render(slow.data))
+
+    def test_compiles_the_list_serializers(self):
+        request = Request(APIRequestFactory().get('/'))
+        for serializer, queryset in (
+            (ProductSerializer(context={'request': request}), Product.objects.all()),
+            (OrderSummarySerializer(context={'request': request}), Order.objects.with_summary()),
+            (WishlistSerializer(context={'request': request}), Wishlist.objects.all()),
+        ):
+            with self.subTest(serializer=type(serializer).__name__):
+                RowSerializer(serializer, queryset)  # Raises Unsupported otherwise
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches[settings.RESPONSE_CACHE_ALIAS].clear()
+        self.client = APIClient()
+        category = Category.objects.create(name='Laptops')
+        self.product = Product.objects.create(name='Laptop', price=1000, category=category, stock=5)
+
+    def get(self, url, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **headers)
+        return response, len(queries)
+
+    def test_conditional_requests_and_invalidation(self):
+        url = '/api/products/?ordering=price&min_price=10'
+        first, _ = self.get(url)
+        etag = first['ETag']
+        reordered, queries = self.get('/api/products/?min_price=10&ordering=price')
+        self.assertEqual((reordered.content, queries), (first.content, 0))
+        not_modified, queries = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((not_modified.status_code, queries), (304, 0))
+
+        Review.objects.create(product=self.product, user=User.objects.create_user('critic'), rating=5, comment='Great')
+        reviewed, _ = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(reviewed.status_code, 200)
+        self.assertNotEqual(reviewed['ETag'], etag)
+
+        # Stock moved by UPDATEs, without any save signal
+        detail_url = f'/api/products/{self.product.slug}/'
+        self.assertEqual(self.client.get(detail_url).json()['stock'], 5)
+        inventory.adjust(self.product.pk, 3)
+        self.assertEqual(self.client.get(detail_url).json()['stock'], 8)
+
+
+
+class RelatedProductsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches[settings.RESPONSE_CACHE_ALIAS].clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user('shopper')
+        laptops = Category.objects.create(name='Laptops')
+        phones = Category.objects.create(name='Phones')
+        attributes = ({'brand': 'HP', 'ram': '16GB'}, {}, {'brand': 'Dell'}, {'brand': 'hp', 'ram': '16GB'})
+        self.a, self.b, self.c, self.d = [
+            Product.objects.create(name=f'Laptop {i}', price=1000, category=laptops, custom_attributes=values)
+            for i, values in enumerate(attributes)
+        ]
+        self.phone = Product.objects.create(name='Phone', price=500, category=phones)
+
+    def order(self, *products, status='delivered'):
+        order = Order.objects.create(
+            user=self.user, status=status, shipping_method='home', shipping_cost=0, payment_method='cash', total=0,
+        )
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=product, price=product.price) for product in products])
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=1))
+        return order
+
+    def related(self, product):
+        results = self.client.get(f'/api/products/{product.slug}/related/').json()['results']
+        return [(item['id'], item['relation']) for item in results]
+
+    def test_bought_together_then_similar(self):
+        self.order(self.a, self.b)
+        self.order(self.a, self.b)
+        self.order(self.a, self.c)
+        self.order(self.b)
+        self.order(self.a, self.phone, status='cancelled')
+        recommendations.refresh()
+        # b: 2 / sqrt(3 * 3), c: 1 / sqrt(3 * 1), d shares brand and ram with a
+        self.assertEqual(self.related(self.a), [
+            (self.b.pk, 'bought_together'), (self.c.pk, 'bought_together'), (self.d.pk, 'similar'),
+        ])
+        self.assertEqual(self.related(self.phone), [])
+
+        # Only the new order is read, orders still pending the sweep wait
+        self.order(self.a, self.d)
+        unsettled = self.order(self.a, self.phone)
+        Order.objects.filter(pk=unsettled.pk).update(created_at=timezone.now())
+        recommendations.refresh()
+        self.assertEqual(CoPurchase.objects.get(product=self.a, other=self.b).orders, 2)
+        self.assertEqual(self.related(self.a), [
+            (self.b.pk, 'bought_together'), (self.c.pk, 'bought_together'), (self.d.pk, 'bought_together'),
+        ])
+        self.assertEqual(self.client.get('/api/products/missing/related/').status_code, 404)
+
+
+@override_settings(REPLICA_DATABASE='replica')
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper')
+        self.product = Product.objects.create(name='Laptop', price=1000, category=Category.objects.create(name='Laptops'))
+
+    def request(self, user=None, cookies=None):
+        request = APIRequestFactory().get('/api/products/')
+        request.user = user or AnonymousUser()
+        request.COOKIES.update(cookies or {})
+        return request
+
+    def test_only_read_blocks_use_the_replica(self):
+        self.assertEqual(router.db_for_read(Product), 'default')
+        with replicas.reads_from('replica'):
+            self.assertEqual(router.db_for_read(Product), 'replica')
+            self.assertEqual(router.db_for_write(Product), 'default')
+        self.assertEqual(router.db_for_read(Product), 'default')
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        self.assertEqual(replicas.replica_for(self.request(self.user)), 'replica')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        rejected = client.post('/api/wishlist/toggle/', {}, format='json')
+        self.assertNotIn(replicas.PIN_COOKIE, rejected.cookies)
+
+        response = client.post('/api/wishlist/toggle/', {'product_id': self.product.pk}, format='json')
+        cookie = {replicas.PIN_COOKIE: response.cookies[replicas.PIN_COOKIE].value}
+        # The cookie pins the browser, the cache the user on any client
+        self.assertIsNone(replicas.replica_for(self.request(cookies=cookie)))
+        self.assertIsNone(replicas.replica_for(self.request(self.user)))
+        self.assertEqual(replicas.replica_for(self.request()), 'replica')
+
+    def test_pinned_reads_see_their_writes(self):
+        # A real replica: a copy of the test database as it is now, which later writes don't reach
+        caches[settings.RESPONSE_CACHE_ALIAS].clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'replica.sqlite3')
+        connection.ensure_connection()
+        with open(path, 'wb') as copy:
+            copy.write(connection.connection.serialize())
+        connections['replica'] = load_backend(connection.settings_dict['ENGINE']).DatabaseWrapper(
+            {**connection.settings_dict, 'NAME': path}, alias='replica',
+        )
+        self.addCleanup(connections.__delitem__, 'replica')
+        self.addCleanup(connections['replica'].close)
+
+        url = f'/api/products/{self.product.slug}/'
+        staff = User.objects.create_user('staff', is_staff=True)
+        writer = APIClient()
+        writer.force_authenticate(staff)
+        self.assertEqual(writer.patch(url, {'name': 'Laptop Pro'}, format='json').status_code, 200)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).name, 'Laptop Pro')
+
+        # Others read the replica, whose answer isn't cached while it may lag
+        for _ in range(2):
+            self.assertEqual(APIClient().get(url).json()['name'], 'Laptop')
+        # The writer sees its write, pinned by its cookie or, on another client, by its user
+        self.assertEqual(writer.get(url).json()['name'], 'Laptop Pro')
+        other_client = APIClient()
+        other_client.force_authenticate(staff)
+        self.assertEqual(other_client.get(url).json()['name'], 'Laptop Pro')
+
+
+class DatabaseProfileTests(TestCase):
+    def load_settings(self, **environ):
+        with mock.patch.dict(os.environ, environ):
+            return runpy.run_path(str(settings.BASE_DIR / 'salesbackend' / 'settings.py'))
+
+    def test_sqlite_connection(self):
+        # The test database lives in memory, which has no WAL: open a file with the same settings
+        profile = self.load_settings(DB_ENGINE='sqlite', DB_SQLITE_TIMEOUT='7')['DATABASES']['default']
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'profile.sqlite3')
+        connections['profile'] = load_backend(profile['ENGINE']).DatabaseWrapper(
+            {**connection.settings_dict, 'OPTIONS': profile['OPTIONS'], 'NAME': path}, alias='profile',
+        )
+        self.addCleanup(connections.__delitem__, 'profile')
+        self.addCleanup(connections['profile'].close)
+        with connections['profile'].cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone()[0], 7000)
+
+        # IMMEDIATE takes the write lock when the transaction starts, before any write
+        other = sqlite3.connect(path, timeout=0)
+        self.addCleanup(other.close)
+        with transaction.atomic(using='profile'):
+            with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+                other.execute('BEGIN IMMEDIATE')
+
+    def test_postgresql_connections(self):
+        database = self.load_settings(DB_ENGINE='postgresql', DB_CONN_MAX_AGE='300')['DATABASES']['default']
+        self.assertEqual(database['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual((database['CONN_MAX_AGE'], database['CONN_HEALTH_CHECKS']), (300, True))
+        self.assertEqual(self.load_settings(DB_ENGINE='postgresql', DB_CONN_MAX_AGE='0')['DATABASES']['default']['CONN_MAX_AGE'], 0)
+
+
+@override_settings(SHIPPING_COSTS={'home': '300', 'office': '0'})
+class CheckoutTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user('buyer', password='secret')
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Laptops')
+        self.laptop = Product.objects.create(name='Laptop', price=1000, category=category, stock=3)
+        self.mouse = Product.objects.create(name='Mouse', price=50, category=category, stock=10)
+
+    def checkout(self, items, **extra):
+        return self.client.post('/api/orders/checkout/', {
+            'items': items, 'shipping_method': 'home', 'payment_method': 'cash', **extra,
+        }, format='json')
+
+    def test_checkout_prices_the_order_and_takes_the_stock(self):
+        response = self.checkout([
+            {'product': self.laptop.pk, 'quantity': 1},
+            {'product': self.mouse.pk, 'quantity': 2},
+            {'product': self.laptop.pk, 'quantity': 1},
+        ], total='1.00')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['total'], '2400.00')
+        self.assertEqual(sorted((item['product'], item['quantity']) for item in response.json()['items']),
+                         [(self.laptop.pk, 2), (self.mouse.pk, 2)])
+        self.laptop.refresh_from_db()
+        self.mouse.refresh_from_db()
+        self.assertEqual((self.laptop.stock, self.mouse.stock), (1, 8))
+
+    def test_short_line_rolls_back_the_whole_cart(self):
+        response = self.checkout([
+            {'product': self.mouse.pk, 'quantity': 1},
+            {'product': self.laptop.pk, 'quantity': 4},
+        ])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['unavailable'], [{'product': self.laptop.pk, 'requested': 4, 'available': 3}])
+        self.mouse.refresh_from_db()
+        self.assertEqual(self.mouse.stock, 10)
+        self.assertFalse(Order.objects.exists())
+
+
+class SeedingTests(TestCase):
+    def test_seeded_shop_is_consistent(self):
+        counts = dict(seeding.default_counts(300), categories=40)
+        seeding.seed(counts)
+        self.assertEqual(Category.objects.count(), 40)
+        self.assertEqual(sorted(set(Category.objects.values_list('depth', flat=True))), [0, 1, 2])
+        for model, name in ((Product, 'products'), (Review, 'reviews'), (Order, 'orders'),
+                            (Wishlist, 'wishlists'), (MpesaTransaction, 'transactions')):
+            self.assertEqual(model.objects.count(), counts[name], name)
+        self.assertEqual(ProductSpecification.objects.values('product').distinct().count(), 300)
+        self.assertTrue(ProductAttribute.objects.exists())
+        self.assertEqual(DailyOrderSales.objects.aggregate(orders=Sum('orders'))['orders'], counts['orders'])
+
+        # The aggregates written with the products match the reviews
+        fields = ('avg_rating', 'review_count', 'rating_1_count', 'rating_5_count')
+        seeded = list(Product.objects.order_by('pk').values_list(*fields))
+        recompute_ratings()
+        self.assertEqual(list(Product.objects.order_by('pk').values_list(*fields)), seeded)
+
+    def test_bench_api_flags_regressions(self):
+        baseline = {'1000': {'products': {'queries': 3, 'p50': 10.0, 'p95': 12.0, 'p99': 15.0}}}
+        noisy = {'1000': {'products': {'queries': 3, 'p50': 19.0, 'p95': 60.0, 'p99': 90.0}}}
+        self.assertEqual(compare(noisy, baseline, tolerance=0.5, slack_ms=5), [])
+        worse = {'1000': {'products': {'queries': 4, 'p50': 25.0, 'p95': 30.0, 'p99': 35.0}}, '5': {}}
+        self.assertEqual(compare(worse, baseline, tolerance=0.5, slack_ms=5), [
+            'products at 1000: 3 -> 4 queries', 'products at 1000: p50 10.0 -> 25.0ms',
+        ])
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.buyer = User.objects.create_user('buyer')
+        category = Category.objects.create(name='Laptops')
+        self.laptop = Product.objects.create(name='Laptop', price=1000, category=category, stock=5)
+        self.mouse = Product.objects.create(name='Mouse', price=50, category=category, stock=10)
+
+    def rollups(self):
+        return [
+            sorted(model.objects.exclude(orders=0).values_list(*fields))
+            for model, fields in (
+                (DailyProductSales, ('day', 'product_id', 'units', 'revenue', 'orders')),
+                (DailyCategorySales, ('day', 'category_id', 'units', 'revenue', 'orders')),
+                (DailyOrderSales, ('day', 'status', 'payment_method', 'orders', 'revenue')),
+            )
+        ]
+
+    def test_orders_and_status_changes_match_a_rebuild(self):
+        place_order(self.buyer, [{'product': self.laptop.pk, 'quantity': 1}, {'product': self.mouse.pk, 'quantity': 2}], 'home', 'cash')
+        held = place_order(self.buyer, [{'product': self.mouse.pk, 'quantity': 1}], 'home', 'card', hold=True)
+        mouse = DailyProductSales.objects.get(product=self.mouse)
+        self.assertEqual((mouse.units, mouse.revenue, mouse.orders), (3, 150, 2))
+
+        held.status = 'cancelled'
+        held.save()
+        mouse.refresh_from_db()
+        self.assertEqual((mouse.units, mouse.orders), (2, 1))
+        self.assertEqual(DailyOrderSales.objects.get(status='cancelled').orders, 1)
+
+        live = self.rollups()
+        analytics.rebuild()
+        self.assertEqual(self.rollups(), live)
+
+    def test_analytics_endpoint_is_admin_only(self):
+        place_order(self.buyer, [{'product': self.mouse.pk, 'quantity': 3}, {'product': self.laptop.pk, 'quantity': 1}], 'home', 'cash')
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.client.get('/api/analytics/products/').status_code, 403)
+
+        self.client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+        results = self.client.get('/api/analytics/products/').json()['results']
+        self.assertEqual([(row['product_id'], row['units']) for row in results], [(self.laptop.pk, 1), (self.mouse.pk, 3)])
+        self.assertEqual(self.client.get('/api/analytics/categories/?interval=month').json()['results'][0]['units'], 4)
+        self.assertEqual(self.client.get('/api/analytics/?interval=year').status_code, 400)
+
+class InventoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('buyer')
+        self.product = Product.objects.create(
+            name='Laptop', price=1000, category=Category.objects.create(name='Laptops'), stock=5,
+        )
+
+    def assertStock(self, stock, reserved):
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved_stock), (stock, reserved))
+        ledger = self.product.inventory_movements.aggregate(stock=Sum('stock_change'), reserved=Sum('reserved_change'))
+        self.assertEqual((ledger['stock'], ledger['reserved'] or 0), (stock, reserved))
+
+    def hold(self, quantity=2):
+        return place_order(self.user, [{'product': self.product.pk, 'quantity': quantity}], 'home', 'cash', hold=True)
+
+    def test_expired_holds_are_released_and_cancel_the_order(self):
+        order = self.hold()
+        self.assertStock(3, 2)
+        self.assertEqual(inventory.release_expired(), 0)
+
+        self.assertEqual(inventory.release_expired(now=timezone.now() + timedelta(days=1)), 1)
+        self.assertStock(5, 0)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'cancelled')
+
+    def test_paid_order_commits_its_hold(self):
+        order = self.hold()
+        order.status = 'processing'
+        order.save()
+        self.assertStock(3, 0)
+        self.assertEqual(inventory.release_expired(now=timezone.now() + timedelta(days=1)), 0)
+        self.assertStock(3, 0)
+
+    def test_deleting_a_held_order_releases_it(self):
+        order = self.hold()
+        self.assertStock(3, 2)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.delete(f'/api/orders/{order.pk}/').status_code, 204)
+        self.assertStock(5, 0)
+        self.assertFalse(Order.objects.filter(pk=order.pk).exists())
+        # Out of the rollups too, as a rebuild from the remaining orders would have it
+        self.assertFalse(DailyOrderSales.objects.exclude(orders=0).exists())
+        self.assertFalse(DailyProductSales.objects.exclude(orders=0).exists())
+
+        order = self.hold()
+        self.client.force_login(User.objects.create_superuser('admin', password='secret'))
+        self.client.post(f'/admin/api/order/{order.pk}/delete/', {'post': 'yes'})
+        self.assertFalse(Order.objects.filter(pk=order.pk).exists())
+        self.assertStock(5, 0)
+
+    def test_stale_product_save_keeps_the_stock(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        self.hold()
+        stale.name = 'Renamed laptop'
+        stale.save()
+        self.assertStock(3, 2)
+        stale.stock = 10
+        stale.save()
+        self.assertStock(10, 2)
+
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.laptops = Category.objects.create(name='Laptops')
+
+    def import_csv(self, text, chunk_size=catalog_io.CHUNK_SIZE):
+        return catalog_io.import_catalog(io.StringIO(text), 'csv', chunk_size)
+
+    def assertLedgerMatches(self, product):
+        ledger = product.inventory_movements.aggregate(stock=Sum('stock_change'))['stock'] or 0
+        self.assertEqual(ledger, product.stock)
+
+    def test_import_creates_and_updates(self):
+        result = self.import_csv(
+            'sku,name,category,price,stock,attr.brand,specifications\n'
+            'LT-1,Laptop,laptops,1000,5,HP,"{""RAM"": ""16GB""}"\n'
+            'TB-1,Tablet,Tablets,300.505,2,Apple,\n'
+        )
+        self.assertEqual((result['created'], result['updated'], result['failed']), (2, 0, 0))
+        laptop, tablet = Product.objects.get(sku='LT-1'), Product.objects.get(sku='TB-1')
+        self.assertEqual((laptop.category, laptop.custom_attributes, laptop.stock), (self.laptops, {'brand': 'HP'}, 5))
+        self.assertEqual(list(laptop.specifications.values_list('name', 'value')), [('RAM', '16GB')])
+        self.assertEqual((tablet.category.name, str(tablet.price)), ('Tablets', '300.50'))
+        self.assertEqual(ProductAttribute.objects.get(product=laptop, key='brand').normalized_value, 'hp')
+        self.assertLedgerMatches(laptop)
+
+        result = self.import_csv('sku,name,price,stock\nLT-1,Laptop Pro,1200,8\n')
+        self.assertEqual((result['created'], result['updated']), (0, 1))
+        laptop.refresh_from_db()
+        self.assertEqual((laptop.name, laptop.price, laptop.stock), ('Laptop Pro', 1200, 8))
+        self.assertLedgerMatches(laptop)
+
+    def test_missing_columns_are_left_alone(self):
+        self.import_csv('sku,name,category,price,stock,is_featured\nLT-1,Laptop,Laptops,1000,5,yes\n')
+        laptop = Product.objects.get(sku='LT-1')
+        inventory.adjust(laptop.pk, -2, kind='sale')
+
+        self.import_csv('sku,price\nLT-1,950\n')
+        laptop.refresh_from_db()
+        self.assertEqual((laptop.name, laptop.price, laptop.stock, laptop.is_featured), ('Laptop', 950, 3, True))
+        self.assertLedgerMatches(laptop)
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        result = self.import_csv(
+            'sku,name,category,price,original_price\n'
+            'A,Fine,Laptops,10,\n'
+            'B,Not a number,Laptops,abc,\n'
+            'C,NaN,Laptops,nan,\n'
+            'D,Infinite,Laptops,inf,\n'
+            'E,Too big,Laptops,123456789012.5,\n'
+            'F,Rounds up too far,Laptops,99999999.999,\n'
+            'G,Bad original,Laptops,10,-Infinity\n'
+            'H,No category,,10,\n',
+            chunk_size=3,
+        )
+        self.assertEqual((result['created'], result['failed']), (1, 7))
+        self.assertEqual([error['line'] for error in result['errors']], [3, 4, 5, 6, 7, 8, 9])
+        self.assertIn('New products need category', result['errors'][-1]['error'])
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['A'])
+
+    def test_negative_stock_is_reported(self):
+        result = self.import_csv('sku,name,category,price,stock\nA,Fine,Laptops,10,3\nB,Oversold,Laptops,10,-2\n')
+        self.assertEqual((result['created'], result['failed']), (1, 1))
+        self.assertEqual(result['errors'], [{'line': 3, 'error': "stock: '-2' is negative"}])
+
+    def test_import_refreshes_the_category_tree(self):
+        caches[settings.RESPONSE_CACHE_ALIAS].clear()
+        client = APIClient()
+
+        def counts():
+            return [(node['name'], node['product_count']) for node in client.get('/api/categories/?view=tree').json()]
+
+        self.assertEqual(counts(), [('Laptops', 0)])
+        # Products bulk-created into an existing category, no Category signal fires
+        self.import_csv('sku,name,category,price,stock\nA,One,Laptops,10,3\nB,Two,Laptops,10,1\n')
+        self.assertEqual(counts(), [('Laptops', 2)])
+
+    def test_export_round_trips(self):
+        self.import_csv(
+            'sku,name,category,price,original_price,stock,is_bestseller,custom_attributes,specifications\n'
+            'LT-1,Laptop,Laptops,1000,1200,5,true,"{""brand"": ""HP""}","[{""name"": ""RAM"", ""value"": ""16GB""}]"\n'
+            'MS-1,Mouse,Accessories,50,,0,false,{},[]\n'
+        )
+        fields = ('sku', 'slug', 'name', 'category__name', 'price', 'original_price', 'stock', 'is_bestseller', 'custom_attributes')
+        before = list(Product.objects.order_by('pk').values_list(*fields))
+
+        for file_format in catalog_io.FORMATS:
+            exported = ''.join(catalog_io.export_catalog(file_format))
+            result = catalog_io.import_catalog(io.StringIO(exported), file_format)
+            self.assertEqual((result['created'], result['updated'], result['failed']), (0, 2, 0), file_format)
+            self.assertEqual(list(Product.objects.order_by('pk').values_list(*fields)), before, file_format)
+            self.assertEqual(list(ProductSpecification.objects.values_list('name', 'value')), [('RAM', '16GB')])
+
+
+class ReviewAggregateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Laptops')
+        self.laptop = Product.objects.create(name='Laptop', price=1000, category=category)
+        self.mouse = Product.objects.create(name='Mouse', price=50, category=category)
+
+    def assertAggregates(self, product, review_count, avg_rating, histogram):
+        product.refresh_from_db()
+        self.assertEqual(
+            (product.review_count, product.avg_rating, [getattr(product, f'rating_{r}_count') for r in range(1, 6)]),
+            (review_count, avg_rating, histogram),
+        )
+        live = [(p.review_count, p.avg_rating) for p in Product.objects.order_by('pk')]
+        recompute_ratings()
+        self.assertEqual([(p.review_count, p.avg_rating) for p in Product.objects.order_by('pk')], live)
+
+    def test_reviews_update_the_aggregates(self):
+        first = Review.objects.create(product=self.laptop, user=User.objects.create_user('a'), rating=5, comment='Great')
+        Review.objects.create(product=self.laptop, user=User.objects.create_user('b'), rating=2, comment='Meh')
+        self.assertAggregates(self.laptop, 2, 3.5, [0, 1, 0, 0, 1])
+
+        first.rating = 4
+        first.save()
+        self.assertAggregates(self.laptop, 2, 3.0, [0, 1, 0, 1, 0])
+
+        first.product = self.mouse
+        first.save()
+        self.assertAggregates(self.laptop, 1, 2.0, [0, 1, 0, 0, 0])
+        self.assertAggregates(self.mouse, 1, 4.0, [0, 0, 0, 1, 0])
+
+        first.delete()
+        self.assertAggregates(self.mouse, 0, 0.0, [0, 0, 0, 0, 0])
+
+    def test_stale_product_save_keeps_the_aggregates(self):
+        stale = Product.objects.get(pk=self.laptop.pk)
+        review = Review.objects.create(product=self.laptop, user=User.objects.create_user('a'), rating=5, comment='Great')
+        stale.name = 'Renamed laptop'
+        stale.save()
+        self.assertAggregates(self.laptop, 1, 5.0, [0, 0, 0, 0, 1])
+        self.assertEqual(self.laptop.name, 'Renamed laptop')
+
+        review.rating = 3
+        review.save()
+        self.assertAggregates(self.laptop, 1, 3.0, [0, 0, 1, 0, 0])
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.computers = Category.objects.create(name='Computers')
+        self.laptops = Category.objects.create(name='Laptops', parent=self.computers)
+        self.gaming = Category.objects.create(name='Gaming', parent=self.laptops)
+        self.phones = Category.objects.create(name='Phones')
+        for category, stock in ((self.computers, 1), (self.laptops, 2), (self.gaming, 3), (self.gaming, 0), (self.phones, 4)):
+            Product.objects.create(name=f'{category.name} {stock}', price=100, category=category, stock=stock)
+
+    def test_paths_follow_moves(self):
+        self.assertEqual(Category.objects.get(pk=self.gaming.pk).path, f'/{self.computers.pk}/{self.laptops.pk}/{self.gaming.pk}/')
+        self.laptops.parent = self.phones
+        self.laptops.save()
+        gaming = Category.objects.get(pk=self.gaming.pk)
+        self.assertEqual((gaming.path, gaming.depth), (f'/{self.phones.pk}/{self.laptops.pk}/{self.gaming.pk}/', 2))
+        self.phones.parent = self.gaming
+        with self.assertRaises(ValidationError):
+            self.phones.full_clean()
+        with self.assertRaises(ValidationError):
+            self.phones.save()
+        self.assertEqual(Category.objects.get(pk=self.phones.pk).path, f'/{self.phones.pk}/')
+
+    def test_admin_rejects_cycles(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='secret'))
+        response = self.client.post(f'/admin/api/category/{self.computers.pk}/change/', {'name': 'Computers', 'parent': self.gaming.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['adminform'].form.errors['parent'], ["A category can't be moved under its own subtree."])
+        self.assertIsNone(Category.objects.get(pk=self.computers.pk).parent_id)
+
+    def test_subtree_filter(self):
+        names = {product['name'] for product in APIClient().get(f'/api/products/?in_category={self.laptops.pk}').json()['results']}
+        self.assertEqual(names, {'Laptops 2', 'Gaming 3', 'Gaming 0'})
+
+    def test_tree_with_counts_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            tree = APIClient().get('/api/categories/?view=tree').json()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual([(node['name'], node['product_count']) for node in tree], [('Computers', 3), ('Phones', 1)])
+        laptops = tree[0]['children'][0]
+        self.assertEqual((laptops['direct_product_count'], laptops['product_count']), (1, 2))
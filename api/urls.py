@@ -1,13 +1,14 @@
 ### api/urls.py
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CategoryViewSet, ProductViewSet, OrderViewSet, WishlistViewSet
+from .views import CategoryViewSet, ProductViewSet, OrderViewSet, SalesAnalyticsViewSet, WishlistViewSet
 
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet)
 router.register(r'products', ProductViewSet)
 router.register(r'orders', OrderViewSet, basename='order')
 router.register(r'wishlist', WishlistViewSet, basename='wishlist')
+router.register(r'analytics', SalesAnalyticsViewSet, basename='analytics')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -3,26 +3,78 @@ from rest_framework import viewsets, permissions, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from django.db import IntegrityError, transaction
 from django.db.models import Min, Max
-from .models import Category, Product, Review, Order, Wishlist
+from django.http import StreamingHttpResponse
+from .models import Category, Product, RelatedProduct, Review, Order, Wishlist
+from . import analytics, catalog_cache, catalog_io
+from .checkout import CheckoutError, delete_order, place_order
+from .facets import FILTERABLE_ATTRIBUTE_KEYS, facet_counts
+from .fieldsets import SparseFieldsetViewMixin, project
+from .filters import AttributeFilterBackend, FullTextSearchFilter, ProductFilter
+from .pagination import OrderCursorPagination, ProductCursorPagination, ReviewCursorPagination
+from .replicas import ReplicaReadMixin
+from .response_cache import CATEGORY, PRODUCT, REVIEW, SPECIFICATION, CachedResponseMixin
+from .row_serializers import RowListMixin
 from .serializers import (
     CategorySerializer, ProductSerializer, ProductDetailSerializer,
-    ReviewSerializer, OrderSerializer, WishlistSerializer
+    ReviewSerializer, OrderSerializer, OrderSummarySerializer, CheckoutSerializer, WishlistSerializer
 )
 
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class CategoryViewSet(CachedResponseMixin, ReplicaReadMixin, SparseFieldsetViewMixin, RowListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    cache_tags = (CATEGORY, PRODUCT)  # ?view=tree counts products
+    filter_backends = [FullTextSearchFilter]
+    search_fields = ['name']
+    search_index = 'category'
     # lookup_field = 'slug' # Remove this line to use the default 'pk' (ID)
 
-class ProductViewSet(viewsets.ModelViewSet): # Changed from ReadOnlyModelViewSet
+    def list(self, request, *args, **kwargs):
+        # ?view=tree returns the whole nested tree with in-stock product counts
+        if request.query_params.get('view') == 'tree':
+            return Response(catalog_cache.category_tree(request))
+        return super().list(request, *args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.has_sparse_fieldsets():
+            return self.narrow_queryset(queryset)
+        return queryset
+
+class ProductViewSet(CachedResponseMixin, ReplicaReadMixin, SparseFieldsetViewMixin, RowListMixin, viewsets.ModelViewSet): # Changed from ReadOnlyModelViewSet
     queryset = Product.objects.all()
+    cached_actions = ('list', 'retrieve', 'filter_options', 'batch', 'related')
+    read_only_actions = ('batch',)  # POSTed id lists
+    cache_tags = (PRODUCT, CATEGORY, REVIEW, SPECIFICATION)
     # serializer_class is handled by get_serializer_class
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['category', 'is_new_arrival', 'is_bestseller', 'is_featured']
-    search_fields = ['name', 'description', 'sku']
-    ordering_fields = ['price', 'name', 'created_at']    
+    filter_backends = [DjangoFilterBackend, AttributeFilterBackend, FullTextSearchFilter, filters.OrderingFilter]
+    filterset_class = ProductFilter  # category (or in_category subtree), flags, price bounds and min_rating/min_reviews
+    search_fields = ['name', 'description', 'sku']  # Fallback when FTS5 is unavailable
+    search_index = 'product'
+    ordering_fields = ['price', 'name', 'created_at', 'avg_rating', 'review_count']    
     lookup_field = 'slug' # Use slug for product lookups
+    max_batch_size = 300
+
+    @property
+    def paginator(self):
+        # ?pagination=cursor switches list to keyset pagination (no OFFSET scans)
+        if not hasattr(self, '_paginator') and self.action == 'list' and self.request is not None \
+                and ProductCursorPagination.is_requested(self.request):
+            self._paginator = ProductCursorPagination()
+        return super().paginator
+
+    def get_queryset(self):
+        # Prefetch what the serializer for this action reads, nothing more
+        queryset = super().get_queryset()
+        if self.has_sparse_fieldsets():
+            # ?fields= / ?expand= only load what the requested fields read
+            return self.narrow_queryset(queryset)
+        if self.action == 'retrieve':
+            return queryset.for_detail()
+        if self.action in ('list', 'create', 'update', 'partial_update'):
+            return queryset.for_listing()
+        return queryset
 
     def get_serializer_class(self):
         if self.action == 'retrieve':
@@ -34,83 +86,152 @@ class ProductViewSet(viewsets.ModelViewSet): # Changed from ReadOnlyModelViewSet
         """
         Instantiates and returns the list of permissions that this view requires.
         """
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in ['create', 'update', 'partial_update', 'destroy', 'import_catalog', 'export_catalog']:
             self.permission_classes = [permissions.IsAdminUser]
         else: # For list, retrieve, and custom GET actions
             self.permission_classes = [permissions.AllowAny] # Or IsAuthenticatedOrReadOnly for viewing
         return super().get_permissions()
 
+    def collection_response(self, name):
+        # Membership ids and rendered cards both come from the cache, the page
+        # is cut from the id list so no COUNT or OFFSET query is needed.
+        page = self.paginate_queryset(catalog_cache.collection_ids(name))
+        fields, _ = self.get_fieldsets()
+        cards = catalog_cache.product_cards(page, self.request)
+        return self.get_paginated_response([project(card, fields) for card in cards])
+
     @action(detail=False, methods=['get'])
     def featured(self, request):
-        featured = Product.objects.filter(is_featured=True)
-        serializer = self.get_serializer(featured, many=True, context={'request': request})
-        return Response(serializer.data)
+        return self.collection_response('featured')
 
     @action(detail=False, methods=['get'], url_path='new-arrivals') # Explicitly set URL path
     def new_arrivals(self, request):
-        new_arrivals = Product.objects.filter(is_new_arrival=True)
-        serializer = self.get_serializer(new_arrivals, many=True, context={'request': request})
-        return Response(serializer.data)
+        return self.collection_response('new_arrivals')
 
     @action(detail=False, methods=['get'])
     def bestsellers(self, request):
-        bestsellers = Product.objects.filter(is_bestseller=True)
-        serializer = self.get_serializer(bestsellers, many=True, context={'request': request})
-        return Response(serializer.data)
+        return self.collection_response('bestsellers')
+
+    @action(detail=False, methods=['get', 'post'])
+    def batch(self, request):
+        """
+        Several products in the order asked for: ?ids=3,1,2 and/or ?slugs=a,b
+        (ids first), or a POSTed {"ids": [...], "slugs": [...]}. A product that
+        doesn't exist comes back as {"id": ..., "not_found": true} (or "slug")
+        in its place. Cards come from the card cache, so the number of queries
+        doesn't grow with the number of products.
+        """
+        if request.method == 'POST':
+            if not isinstance(request.data, dict):
+                return Response({'error': 'Expected an object with "ids" and/or "slugs"'}, status=status.HTTP_400_BAD_REQUEST)
+            raw_ids, slugs = request.data.get('ids') or [], request.data.get('slugs') or []
+        else:
+            raw_ids, slugs = [
+                [value.strip() for value in request.query_params.get(name, '').split(',') if value.strip()]
+                for name in ('ids', 'slugs')
+            ]
+        try:
+            if not isinstance(raw_ids, list):
+                raise TypeError
+            product_ids = [int(value) for value in raw_ids]
+        except (TypeError, ValueError):
+            return Response({'error': 'Product ids must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(slugs, list) or not all(isinstance(slug, str) for slug in slugs):
+            return Response({'error': 'Slugs must be a list of strings'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(product_ids) + len(slugs) > self.max_batch_size:
+            return Response({'error': f'At most {self.max_batch_size} products per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        slug_ids = dict(Product.objects.filter(slug__in=set(slugs)).values_list('slug', 'pk')) if slugs else {}
+        wanted = [('id', pk, pk) for pk in product_ids] + [('slug', slug, slug_ids.get(slug)) for slug in slugs]
+        found = dict.fromkeys(pk for _, _, pk in wanted if pk is not None)
+        cards = {card['id']: card for card in catalog_cache.product_cards(found, request)}
+        fields, _ = self.get_fieldsets()
+        return Response({'results': [
+            project(cards[pk], fields) if pk in cards else {key: value, 'not_found': True}
+            for key, value, pk in wanted
+        ]})
 
     @action(detail=False, methods=['get'], url_path='filter-options')
     def filter_options(self, request):
         """
         Returns available filter options for products.
         e.g., distinct brands, storage sizes, types, and price range.
-        These are extracted from product custom_attributes.
+        Values come from the precomputed attribute facet index. When category,
+        flag, price, attribute or search filters are active, the per-value
+        counts are scoped to the matching products.
         """
-        queryset = Product.objects.all() # Or self.get_queryset() if you have other base filters
+        queryset = self.filter_queryset(self.get_queryset())
 
         # Price Range
         price_stats = queryset.aggregate(min_price=Min('price'), max_price=Max('price'))
         min_price = price_stats.get('min_price') if price_stats.get('min_price') is not None else 0
         max_price = price_stats.get('max_price') if price_stats.get('max_price') is not None else 0
 
-        # Define keys you want to extract from custom_attributes for filtering.
-        # These keys should be consistently used when adding products.
-        # Example: {'brand': 'Brand Name', 'storage': 'Storage Capacity', 'type': 'Product Type'}
-        # The key is what you'll use in the frontend, the value is a display name (optional here).
-        filterable_keys_in_custom_attributes = ['brand', 'storage', 'type', 'ram', 'processor'] # Added 'processor'
-
-        dynamic_options = {key: set() for key in filterable_keys_in_custom_attributes}
-
-        for product in queryset:
-            if isinstance(product.custom_attributes, dict):
-                for key in filterable_keys_in_custom_attributes:
-                    # Attempt to find the key case-insensitively in custom_attributes
-                    value_found = None
-                    for ca_key, ca_value in product.custom_attributes.items():
-                        if ca_key.lower() == key.lower():
-                            value_found = ca_value
-                            break
-                    
-                    if value_found and isinstance(value_found, str) and value_found.strip():
-                        dynamic_options[key].add(value_found.strip())
-
-        # Convert sets to sorted lists for consistent ordering in the frontend
-        for key in dynamic_options:
-            dynamic_options[key] = sorted(list(dynamic_options[key]))
+        if queryset.query.has_filters():
+            counts = facet_counts(FILTERABLE_ATTRIBUTE_KEYS, products=queryset)
+        else:
+            counts = facet_counts(FILTERABLE_ATTRIBUTE_KEYS)
+
+        # Plain value lists are kept for existing clients, 'facets' adds the counts
+        dynamic_options = {key: [facet['value'] for facet in facets] for key, facets in counts.items()}
 
         return Response({
             'price_range': {'min': float(min_price), 'max': float(max_price)},
-            **dynamic_options
+            **dynamic_options,
+            'facets': counts,
         })
 
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_catalog(self, request):
+        """Bulk upsert from an uploaded CSV/JSONL `file`, see api.catalog_io for the columns."""
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'A file upload is required'}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.data.get('file_format') or catalog_io.detect_format(upload.name)
+        if file_format not in catalog_io.FORMATS:
+            return Response({'error': f"file_format must be one of {', '.join(catalog_io.FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        result = catalog_io.import_catalog(catalog_io.text_stream(upload), file_format)
+        return Response(result, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export_catalog(self, request):
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in catalog_io.FORMATS:
+            return Response({'error': f"file_format must be one of {', '.join(catalog_io.FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(catalog_io.export_catalog(file_format), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="catalog.{file_format}"'
+        return response
+
+    @action(detail=True, methods=['get'])
+    def related(self, request, slug=None):
+        """
+        Products bought together with this one, then similar ones, best first.
+        Each card has a "relation": "bought_together" or "similar". The list
+        is precomputed by the rebuild_related_products command.
+        """
+        neighbours = list(
+            RelatedProduct.objects.filter(product__slug=slug).order_by('rank').values_list('related_id', 'source')
+        )
+        if not neighbours and not Product.objects.filter(slug=slug).exists():
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        relations = dict(neighbours)
+        fields, _ = self.get_fieldsets()
+        cards = catalog_cache.product_cards(relations, request)
+        return Response({'results': [
+            project({**card, 'relation': relations[card['id']]}, fields) for card in cards
+        ]})
+
     @action(detail=True, methods=['get', 'post'])
     def reviews(self, request, slug=None): # Changed pk to slug
         product = self.get_object() # self.get_object() will use the lookup_field ('slug')
 
         if request.method == 'GET':
-            # product is fetched by slug, reviews are related to product instance
-            reviews = Review.objects.filter(product=product).order_by('-created_at')
-            serializer = ReviewSerializer(reviews, many=True, context={'request': request})
-            return Response(serializer.data)
+            # Cursor pages, ?ordering=-created_at (default), created_at, -rating or rating
+            paginator = ReviewCursorPagination()
+            page = paginator.paginate_queryset(Review.objects.filter(product=product).for_display(), request, view=self)
+            serializer = ReviewSerializer(page, many=True, context={'request': request})
+            return paginator.get_paginated_response(serializer.data)
 
         elif request.method == 'POST':
             if not request.user.is_authenticated:
@@ -122,39 +243,196 @@ class ProductViewSet(viewsets.ModelViewSet): # Changed from ReadOnlyModelViewSet
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(SparseFieldsetViewMixin, RowListMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    @property
+    def paginator(self):
+        # ?pagination=cursor pages the history by created_at without OFFSET
+        if not hasattr(self, '_paginator') and self.action == 'list' and self.request is not None \
+                and OrderCursorPagination.is_requested(self.request):
+            self._paginator = OrderCursorPagination()
+        return super().paginator
+
+    def is_summary(self):
+        # ?view=summary lists lightweight cards instead of full orders
+        return self.action == 'list' and self.request.query_params.get('view') == 'summary'
+
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        queryset = Order.objects.filter(user=self.request.user).order_by('-created_at', '-id')
+        if self.is_summary():
+            return queryset.with_summary()
+        if self.has_sparse_fieldsets():
+            return self.narrow_queryset(queryset)
+        if self.action in ('list', 'retrieve', 'update', 'partial_update'):
+            return queryset.for_history()
+        return queryset
 
-    def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+    def get_serializer_class(self):
+        if self.is_summary():
+            return OrderSummarySerializer
+        return OrderSerializer
+
+    def create(self, request, *args, **kwargs):
+        return self.checkout(request)
 
-class WishlistViewSet(viewsets.ModelViewSet):
+    def perform_destroy(self, instance):
+        delete_order(instance)
+
+    @action(detail=False, methods=['post'])
+    def checkout(self, request):
+        """
+        Places an order for a cart of {product, quantity} lines. Stock is
+        reserved and the total computed in one transaction, see api.checkout.
+        """
+        cart = CheckoutSerializer(data=request.data)
+        cart.is_valid(raise_exception=True)
+        try:
+            order = place_order(request.user, **cart.validated_data)
+        except CheckoutError as exc:
+            return Response({'error': str(exc), 'unavailable': exc.unavailable}, status=status.HTTP_409_CONFLICT)
+        order = Order.objects.for_history().get(pk=order.pk)
+        data = OrderSerializer(order, context={'request': request}).data
+        if cart.validated_data['hold']:
+            data['reserved_until'] = order.reservations.values_list('expires_at', flat=True).first()
+        return Response(data, status=status.HTTP_201_CREATED)
+
+class WishlistViewSet(SparseFieldsetViewMixin, RowListMixin, viewsets.ModelViewSet):
     serializer_class = WishlistSerializer
     permission_classes = [permissions.IsAuthenticated]
+    max_membership_ids = 200
+
+    def is_compact(self):
+        # ?view=compact lists {id, product_id, added_at, product card} from the card cache
+        return self.action == 'list' and self.request.query_params.get('view') == 'compact'
 
     def get_queryset(self):
-        return Wishlist.objects.filter(user=self.request.user)
+        queryset = Wishlist.objects.filter(user=self.request.user).order_by('-added_at', '-id')
+        if self.is_compact():
+            return queryset.only('id', 'product_id', 'added_at')
+        if self.has_sparse_fieldsets():
+            return self.narrow_queryset(queryset)
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.select_related('product__category').prefetch_related('product__specifications')
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_compact():
+            return super().list(request, *args, **kwargs)
+        entries = self.paginate_queryset(self.get_queryset())
+        cards = {card['id']: card for card in catalog_cache.product_cards([entry.product_id for entry in entries], request)}
+        fields, _ = self.get_fieldsets()
+        return self.get_paginated_response([
+            project({'id': entry.id, 'product_id': entry.product_id, 'added_at': entry.added_at, 'product': cards.get(entry.product_id)}, fields)
+            for entry in entries
+        ])
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    @action(detail=False, methods=['get', 'post'])
+    def contains(self, request):
+        """
+        Which of the given products are wishlisted: ?ids=1,2,3 or a POSTed
+        {"product_ids": [...]}. One lookup on the (user, product) unique index.
+        """
+        if request.method == 'POST':
+            if not isinstance(request.data, dict):
+                return Response({'error': 'Expected an object with "product_ids"'}, status=status.HTTP_400_BAD_REQUEST)
+            raw_ids = request.data.get('product_ids') or []
+        else:
+            raw_ids = [value for value in request.query_params.get('ids', '').split(',') if value.strip()]
+        try:
+            if not isinstance(raw_ids, list):
+                raise TypeError
+            product_ids = {int(value) for value in raw_ids}
+        except (TypeError, ValueError):
+            return Response({'error': 'Product ids must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(product_ids) > self.max_membership_ids:
+            return Response({'error': f'At most {self.max_membership_ids} product ids per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        wishlisted = set(
+            Wishlist.objects.filter(user=request.user, product_id__in=product_ids).values_list('product_id', flat=True)
+        ) if product_ids else set()
+        return Response({
+            'wishlisted': sorted(wishlisted),
+            'membership': {str(product_id): product_id in wishlisted for product_id in sorted(product_ids)},
+        })
+
     @action(detail=False, methods=['post'])
     def toggle(self, request):
+        if not isinstance(request.data, dict):
+            return Response({'error': 'Expected an object with "product_id"'}, status=status.HTTP_400_BAD_REQUEST)
+        product_id = request.data.get('product_id')
+        if not product_id:
+            return Response({'error': 'Product ID is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            product_id = int(str(product_id))
+        except ValueError:
+            return Response({'error': 'Product ID must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # A single DELETE, then (if nothing was there) a single INSERT that
+        # ignores a concurrent insert of the same row, so there is no window
+        # between reading and writing the entry.
+        deleted, _ = Wishlist.objects.filter(user=request.user, product_id=product_id).delete()
+        if deleted:
+            return Response({'status': 'removed from wishlist'})
         try:
-            product_id = request.data.get('product_id')
-            if not product_id:
-                return Response({'error': 'Product ID is required'}, status=status.HTTP_400_BAD_REQUEST)
-
-            wishlist_item = Wishlist.objects.filter(user=request.user, product_id=product_id).first()
-            if wishlist_item:
-                wishlist_item.delete()
-                return Response({'status': 'removed from wishlist'})
-            else:
-                Wishlist.objects.create(user=request.user, product_id=product_id)
-                return Response({'status': 'added to wishlist'})
-        except Exception as e:
-            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            with transaction.atomic():
+                Wishlist.objects.bulk_create([Wishlist(user=request.user, product_id=product_id)], ignore_conflicts=True)
+        except IntegrityError:
+            return Response({'error': 'Product not found'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'status': 'added to wishlist'})
+
+class SalesAnalyticsViewSet(viewsets.ViewSet):
+    """
+    Sales reports for dashboards, read from the daily rollups (api.analytics).
+    Every report takes ?start=YYYY-MM-DD&end=YYYY-MM-DD (the last 30 days by
+    default) and the series ones ?interval=day|week|month.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    max_top_products = 100
+
+    def bad_request(self, message):
+        return Response({'error': str(message)}, status=status.HTTP_400_BAD_REQUEST)
+
+    def list(self, request):
+        # Orders and revenue per period, status and payment method
+        try:
+            start, end, interval = analytics.parse_range(request.query_params)
+        except ValueError as exc:
+            return self.bad_request(exc)
+        return Response({
+            'start': start, 'end': end, 'interval': interval,
+            'results': analytics.order_summary(start, end, interval),
+        })
+
+    @action(detail=False, methods=['get'])
+    def products(self, request):
+        """Best selling products by revenue, ?limit= (at most 100) and ?category=<id>."""
+        try:
+            start, end, _ = analytics.parse_range(request.query_params)
+        except ValueError as exc:
+            return self.bad_request(exc)
+        try:
+            limit = int(request.query_params.get('limit', 20))
+            category = int(request.query_params['category']) if request.query_params.get('category') else None
+        except ValueError:
+            return self.bad_request('limit and category must be integers')
+        return Response({
+            'start': start, 'end': end,
+            'results': analytics.top_products(start, end, max(1, min(limit, self.max_top_products)), category),
+        })
+
+    @action(detail=False, methods=['get'])
+    def categories(self, request):
+        """Units, revenue and orders per period and category."""
+        try:
+            start, end, interval = analytics.parse_range(request.query_params)
+        except ValueError as exc:
+            return self.bad_request(exc)
+        return Response({
+            'start': start, 'end': end, 'interval': interval,
+            'results': analytics.category_sales(start, end, interval),
+        })
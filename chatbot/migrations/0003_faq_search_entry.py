@@ -0,0 +1,27 @@
+# Generated by Django 5.1 on 2026-10-17 02:38
+
+import api.search
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0002_chatbotquery_alter_faq_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FAQSearchEntry',
+            fields=[
+                ('faq', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='chatbot.faq')),
+                ('document', api.search.DocumentField(db_column='api_search_faq')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'api_search_faq',
+                'managed': False,
+            },
+        ),
+    ]
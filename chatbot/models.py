@@ -2,6 +2,8 @@ from django.db import models
 
 from django.utils import timezone
 
+from api.search import DocumentField, search_entry_field
+
 
 class FAQ(models.Model):
     question = models.CharField(max_length=255)
@@ -18,6 +20,16 @@ class FAQ(models.Model):
     def __str__(self):
         return self.question
 
+class FAQSearchEntry(models.Model):
+    """A row of the api_search_faq FTS5 table, see api.search."""
+    faq = search_entry_field(FAQ)
+    document = DocumentField(db_column='api_search_faq')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'api_search_faq'
+
 class SiteInfo(models.Model):
     key = models.CharField(max_length=100, unique=True)
     value = models.TextField()
@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api import search
+from .models import FAQ
+
+
+@receiver(post_save, sender=FAQ)
+def index_faq_search(sender, instance, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    search.index('faq', [instance.pk], using)
+
+
+@receiver(post_delete, sender=FAQ)
+def unindex_faq_search(sender, instance, using='default', **kwargs):
+    search.remove('faq', [instance.pk], using)
@@ -4,38 +4,42 @@ from groq import Groq
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
-from django.db.models import Q, Avg
+from django.db.models import Q
 from .models import FAQ, SiteInfo
 from api.models import Product, Category, Review  # Import your ecommerce models
+from api import catalog_cache, search
+from api.replicas import ReplicaReadMixin
+from api.response_cache import CATEGORY, PRODUCT, REVIEW, CachedResponseMixin
 
 # Initialize Groq client
 client = Groq(api_key=os.getenv('GROQ_API_KEY'))
 
-class ChatbotAskView(APIView):
+class ChatbotAskView(ReplicaReadMixin, APIView):
     permission_classes = [AllowAny]
+    read_only_actions = ('post',)  # Asking only reads the catalog
     
     def get_product_context(self, query="", limit=5):
         """Get relevant product information based on query"""
-        products = Product.objects.select_related('category').prefetch_related('reviews')
+        products = Product.objects.select_related('category').prefetch_related('specifications').filter(stock__gt=0)
         
-        if query:
-            # Search products by name, description, or category
-            products = products.filter(
-                Q(name__icontains=query) |
-                Q(description__icontains=query) |
-                Q(category__name__icontains=query) |
-                Q(sku__icontains=query)
-            )
-        
-        # Get top products (featured, bestsellers, new arrivals)
-        products = products.filter(stock__gt=0).order_by('-is_featured', '-is_bestseller', '-is_new_arrival')[:limit]
+        if query and search.is_enabled(products.db):
+            # Full-text search, any word may match and BM25 relevance comes first
+            products = search.filter_queryset(products, 'product', query, match_all=False)
+            products = products.order_by('search_rank', '-is_featured', '-is_bestseller', '-is_new_arrival')[:limit]
+        else:
+            if query:
+                # Search products by name, description, or category
+                products = products.filter(
+                    Q(name__icontains=query) |
+                    Q(description__icontains=query) |
+                    Q(category__name__icontains=query) |
+                    Q(sku__icontains=query)
+                )
+            # Get top products (featured, bestsellers, new arrivals)
+            products = products.order_by('-is_featured', '-is_bestseller', '-is_new_arrival')[:limit]
         
         product_info = []
         for product in products:
-            # Calculate average rating
-            avg_rating = product.reviews.aggregate(Avg('rating'))['rating__avg'] or 0
-            review_count = product.reviews.count()
-            
             # Determine discount percentage
             discount = 0
             if product.original_price and product.original_price > product.price:
@@ -50,12 +54,12 @@ class ChatbotAskView(APIView):
                 'description': product.description,
                 'sku': product.sku,
                 'stock': product.stock,
-                'rating': round(avg_rating, 1),
-                'review_count': review_count,
+                'rating': round(product.avg_rating, 1),
+                'review_count': product.review_count,
                 'is_featured': product.is_featured,
                 'is_bestseller': product.is_bestseller,
                 'is_new_arrival': product.is_new_arrival,
-                'specifications': list(product.specifications.values('name', 'value')),
+                'specifications': [{'name': spec.name, 'value': spec.value} for spec in product.specifications.all()],
             }
             product_info.append(product_data)
         
@@ -63,23 +67,24 @@ class ChatbotAskView(APIView):
     
     def get_category_context(self):
         """Get category information"""
-        categories = Category.objects.filter(parent=None)[:10]  # Main categories
-        category_info = []
-        
-        for category in categories:
-            product_count = category.products.filter(stock__gt=0).count()
-            category_data = {
-                'name': category.name,
-                'product_count': product_count,
-                'subcategories': list(category.children.values_list('name', flat=True))
+        # Main categories from the cached tree, counts include their subcategories
+        return [
+            {
+                'name': category['name'],
+                'product_count': category['product_count'],
+                'subcategories': [child['name'] for child in category['children']],
             }
-            category_info.append(category_data)
-        
-        return category_info
+            for category in catalog_cache.category_tree()[:10]
+        ]
     
-    def get_business_context(self):
-        """Get FAQ and site information"""
-        faqs = FAQ.objects.all()[:10]
+    def get_business_context(self, query=""):
+        """Get FAQ and site information, FAQs most relevant to the query first"""
+        faqs = FAQ.objects.all()
+        if query and search.is_enabled(faqs.db):
+            relevant = list(search.filter_queryset(faqs, 'faq', query, match_all=False).order_by('search_rank')[:10])
+            faqs = relevant or faqs[:10]
+        else:
+            faqs = faqs[:10]
         site_info = SiteInfo.objects.all()[:10]
         
         faq_context = [f"Q: {f.question}\nA: {f.answer}" for f in faqs]
@@ -140,7 +145,7 @@ class ChatbotAskView(APIView):
             ])
             
             # Get relevant context
-            business_context = self.get_business_context()
+            business_context = self.get_business_context(question)
             category_context = self.get_category_context()
             
             product_context = []
@@ -264,9 +269,11 @@ Use the provided context to give accurate, helpful responses. If you don't have
             }, status=500)
 
 
-class ProductSearchView(APIView):
+class ProductSearchView(CachedResponseMixin, ReplicaReadMixin, APIView):
     """Dedicated endpoint for product search"""
     permission_classes = [AllowAny]
+    cached_actions = ('get',)
+    cache_tags = (PRODUCT, CATEGORY, REVIEW)
     
     def get(self, request):
         query = request.query_params.get('q', '')
@@ -275,21 +282,25 @@ class ProductSearchView(APIView):
         
         products = Product.objects.select_related('category').filter(stock__gt=0)
         
-        if query:
-            products = products.filter(
-                Q(name__icontains=query) |
-                Q(description__icontains=query)
-            )
-        
         if category:
             products = products.filter(category__name__icontains=category)
         
-        products = products.order_by('-is_featured', '-is_bestseller', 'name')[:limit]
+        if query and search.is_enabled(products.db):
+            using = products.db
+            products = search.filter_queryset(products, 'product', query)
+            products = list(products.order_by('search_rank', '-is_featured', '-is_bestseller', 'name')[:limit])
+            highlights = search.snippets('product', query, [product.id for product in products], using=using)
+        else:
+            if query:
+                products = products.filter(
+                    Q(name__icontains=query) |
+                    Q(description__icontains=query)
+                )
+            products = products.order_by('-is_featured', '-is_bestseller', 'name')[:limit]
+            highlights = {}
         
         product_data = []
         for product in products:
-            avg_rating = product.reviews.aggregate(Avg('rating'))['rating__avg'] or 0
-            
             product_data.append({
                 'id': product.id,
                 'name': product.name,
@@ -299,12 +310,13 @@ class ProductSearchView(APIView):
                 'category': product.category.name,
                 'description': product.description[:200] + "..." if len(product.description) > 200 else product.description,
                 'stock': product.stock,
-                'rating': round(avg_rating, 1),
-                'review_count': product.reviews.count(),
+                'rating': round(product.avg_rating, 1),
+                'review_count': product.review_count,
                 'image_url': product.image_main.url if product.image_main else None,
                 'is_featured': product.is_featured,
                 'is_bestseller': product.is_bestseller,
                 'is_new_arrival': product.is_new_arrival,
+                'highlight': highlights.get(product.id),
             })
         
         return Response({
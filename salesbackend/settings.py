@@ -64,6 +64,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.replicas.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -119,11 +120,129 @@ SIMPLE_JWT = {
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=sqlite (default) or postgresql, see bench_write_contention to
+# compare them under concurrent writes.
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+# Seconds a connection is kept for the next requests of the same worker,
+# 0 opens one per request.
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 60))
+
+# WAL lets readers run alongside the writer and synchronous=NORMAL is safe
+# with it. Write transactions take the lock up front (IMMEDIATE) and wait
+# up to DB_SQLITE_TIMEOUT seconds for it, instead of failing with "database
+# is locked" when two of them want to upgrade a read lock at once.
+SQLITE_OPTIONS = {
+    'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA temp_store=MEMORY',
+    'transaction_mode': 'IMMEDIATE',
+    'timeout': int(os.getenv('DB_SQLITE_TIMEOUT', 20)),
+}
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'salesbackend'),
+            'USER': os.getenv('DB_USER', ''),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', ''),
+            'PORT': os.getenv('DB_PORT', ''),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,  # Reconnect when a kept connection died
+            # .iterator() streams through server-side cursors, which don't
+            # survive transaction pooling: set it to 1 behind PgBouncer.
+            'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_DISABLE_SERVER_SIDE_CURSORS', '0') == '1',
+            'OPTIONS': {'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 5))},
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_NAME') or BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': SQLITE_OPTIONS,
+        }
+    }
+
+# Catalog GETs read from a replica of the default database when one is set
+# up: DB_REPLICA_NAME for SQLite (a copy kept in sync outside Django),
+# DB_REPLICA_HOST / DB_REPLICA_PORT for PostgreSQL. A client stays on the
+# primary for REPLICA_PIN_SECONDS after it writes, see api.replicas. Tests
+# run the replica as a mirror of the test database.
+REPLICA_DATABASE = None
+if os.getenv('DB_REPLICA_HOST') or os.getenv('DB_REPLICA_NAME'):
+    REPLICA_DATABASE = 'replica'
+    DATABASES[REPLICA_DATABASE] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('DB_REPLICA_NAME') or DATABASES['default']['NAME'],
+        'HOST': os.getenv('DB_REPLICA_HOST') or DATABASES['default'].get('HOST', ''),
+        'PORT': os.getenv('DB_REPLICA_PORT') or DATABASES['default'].get('PORT', ''),
+        'TEST': {'MIRROR': 'default'},
     }
+DATABASE_ROUTERS = ['api.replicas.PrimaryReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 10))
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'salesbackend',
+    },
+    # Rendered catalog responses (api.response_cache). Per process by default,
+    # e.g. RESPONSE_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+    # RESPONSE_CACHE_LOCATION=redis://127.0.0.1:6379/1 shares them between workers.
+    'responses': {
+        'BACKEND': os.getenv('RESPONSE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('RESPONSE_CACHE_LOCATION', 'salesbackend-responses'),
+    },
+}
+RESPONSE_CACHE_ALIAS = 'responses'
+# Seconds a cached response is kept (it's dropped earlier when its data
+# changes), 0 turns the response cache off.
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 300))
+
+# Seconds that product cards and collection membership lists (featured,
+# new arrivals, bestsellers) stay cached. They are invalidated on change,
+# the timeout bounds staleness between processes with a per-process cache.
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', 300))
+
+# List endpoints render straight from values() rows (api.row_serializers)
+# instead of going through the serializers. Set to 0 to turn it off.
+FAST_READ_PATH = os.getenv('FAST_READ_PATH', '1') != '0'
+
+# Latest reviews embedded in the product detail response, the rest are served
+# page by page from /api/products/<slug>/reviews/.
+PRODUCT_DETAIL_REVIEWS = int(os.getenv('PRODUCT_DETAIL_REVIEWS', 5))
+
+# Resized copies of uploaded images (name -> max width in px), built by
+# api.images on a pool of IMAGE_RENDITION_WORKERS threads (0 builds them
+# inline after the upload commits). Add 'avif' to the formats on Pillow 11.2+.
+IMAGE_RENDITIONS = {'thumb': 200, 'medium': 600}
+IMAGE_RENDITION_FORMATS = os.getenv('IMAGE_RENDITION_FORMATS', 'webp').split(',')
+IMAGE_RENDITION_QUALITY = int(os.getenv('IMAGE_RENDITION_QUALITY', 80))
+IMAGE_RENDITION_WORKERS = int(os.getenv('IMAGE_RENDITION_WORKERS', 2))
+
+# Seconds a checkout with "hold" keeps its stock reserved while the payment
+# is pending. Overdue holds are released by the release_expired_reservations
+# command, run it every minute or so (cron, a scheduler or --every).
+STOCK_RESERVATION_SECONDS = int(os.getenv('STOCK_RESERVATION_SECONDS', 900))
+
+# Neighbours kept per product by api.recommendations and served by
+# /api/products/<slug>/related/. Rebuilt by the rebuild_related_products
+# command, run it hourly or so (cron, a scheduler or --every).
+RELATED_PRODUCTS_LIMIT = int(os.getenv('RELATED_PRODUCTS_LIMIT', 12))
+
+# Admin changelists of large tables (orders, items, reviews, products) count
+# at most this many rows. Past it, unfiltered ones page through a table estimate
+# and filtered or searched ones report "more than" the limit.
+ADMIN_EXACT_COUNT_LIMIT = int(os.getenv('ADMIN_EXACT_COUNT_LIMIT', 10000))
+
+# Shipping cost charged per Order.shipping_method at checkout (api.checkout).
+SHIPPING_COSTS = {
+    'home': os.getenv('SHIPPING_COST_HOME', '0'),
+    'office': os.getenv('SHIPPING_COST_OFFICE', '0'),
 }
 
 
@@ -0,0 +1,17 @@
+# Generated by Django 5.1 on 2026-10-17 04:08
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_image_renditions'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='user',
+            name='image_renditions',
+        ),
+    ]